@@ -0,0 +1,156 @@
+# =====================================
+# agenda.py — agenda recall e visite per TMK
+# =====================================
+# Per ogni cliente la prossima scadenza effettiva:
+#   recall = ProssimoRecall, altrimenti UltimoRecall + 3 mesi
+#   visita = ProssimaVisita, altrimenti UltimaVisita + 6 mesi
+# calcolata in modo vettorizzato una volta per versione dati
+# (CRMModel.agenda) e tenuta in indici ordinati per TMK: "cosa ha Giulia
+# questa settimana" sono due searchsorted per tipo + i k risultati.
+# Si aggiorna sul singolo cliente quando vengono salvate le sue date.
+# =====================================
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from scadenze_index import DateIndex
+
+RECALL_MESI = 3
+VISITA_MESI = 6
+TIPI = {"recall": ("ProssimoRecall", "UltimoRecall", RECALL_MESI),
+        "visita": ("ProssimaVisita", "UltimaVisita", VISITA_MESI)}
+TUTTI = "*"   # chiave dell'indice su tutti i TMK
+
+
+def prossime_date(cli: pd.DataFrame) -> pd.DataFrame:
+    """Colonne 'recall' e 'visita' (datetime64) con i default a 3 / 6 mesi applicati."""
+    out = pd.DataFrame(index=cli.index)
+    for tipo, (prossimo, ultimo, mesi) in TIPI.items():
+        out[tipo] = cli[f"{prossimo}_dt"].fillna(cli[f"{ultimo}_dt"] + pd.DateOffset(months=mesi))
+    return out
+
+
+def _prossima(row: pd.Series, tipo: str):
+    prossimo, ultimo, mesi = TIPI[tipo]
+    v = row[f"{prossimo}_dt"]
+    if pd.isna(v) and pd.notna(row[f"{ultimo}_dt"]):
+        v = row[f"{ultimo}_dt"] + pd.DateOffset(months=mesi)
+    return v
+
+
+class Agenda:
+    """Prossimi recall/visite per cliente e indici ordinati per (TMK, tipo)."""
+
+    def __init__(self, model, date: pd.DataFrame, tmk: pd.Series):
+        self.model = model
+        self.date = date             # etichetta cliente → recall, visita
+        self.tmk = tmk.copy()        # etichetta cliente → TMK all'ultimo aggiornamento
+        self._n_tmk = tmk.value_counts().to_dict()   # TMK → clienti assegnati
+        self._idx: dict[tuple[str, str], DateIndex] = {}
+        for tipo in TIPI:
+            self._idx[(TUTTI, tipo)] = DateIndex.build(date[tipo])
+            for t, labels in tmk.groupby(tmk, sort=False).groups.items():
+                self._idx[(t, tipo)] = DateIndex.build(date.loc[labels, tipo])
+
+    @classmethod
+    def build(cls, model) -> "Agenda":
+        return cls(model, prossime_date(model.clienti), model.clienti["TMK"])
+
+    def tmk_list(self) -> list[str]:
+        return sorted({t for t, _ in self._idx if t not in (TUTTI, "")})
+
+    def prossimi(self, label) -> tuple:
+        """(recall, visita) effettivi del cliente: Timestamp o NaT."""
+        r = self.date.loc[label]
+        return r["recall"], r["visita"]
+
+    def update_row(self, table: str, idx, row: pd.Series) -> None:
+        if table != "clienti":
+            return
+        old_tmk, new_tmk = self.tmk.get(idx, ""), row["TMK"]
+        cambiato = old_tmk != new_tmk
+        if cambiato:
+            self._n_tmk[new_tmk] = self._n_tmk.get(new_tmk, 0) + 1
+            if idx in self.tmk.index:
+                self._n_tmk[old_tmk] -= 1
+        self.tmk[idx] = new_tmk
+        vuoto = cambiato and self._n_tmk.get(old_tmk, 0) <= 0   # TMK senza più clienti: esce da tmk_list
+        for tipo in TIPI:
+            data = _prossima(row, tipo)
+            self.date.loc[idx, tipo] = data
+            if vuoto:
+                self._idx.pop((old_tmk, tipo), None)
+            elif cambiato and (old_tmk, tipo) in self._idx:
+                self._idx[(old_tmk, tipo)].discard(idx)
+            per_tmk = self._idx.setdefault((new_tmk, tipo), DateIndex.build(pd.Series([], dtype="datetime64[ns]")))
+            for ix in (self._idx[(TUTTI, tipo)], per_tmk):
+                ix.set(idx, data)
+        if vuoto:
+            self._n_tmk.pop(old_tmk, None)
+
+    def eventi(self, tmk: str | None = None, start=None, end=None, tipi=tuple(TIPI)) -> pd.DataFrame:
+        """
+        Recall/visite in [start, end] (None = aperto) del TMK (None = tutti), ordinati per data:
+        colonne Data, Tipo, _label (etichetta cliente), RagioneSociale, ClienteID, TMK.
+        """
+        parti = []
+        for tipo in tipi:
+            ix = self._idx.get((tmk or TUTTI, tipo))
+            if ix is None:
+                continue
+            d, labels = ix.items(start, end)
+            parti.append(pd.DataFrame({"Data": d, "Tipo": tipo, "_label": labels}))
+        if not parti:
+            return pd.DataFrame(columns=["Data", "Tipo", "_label", "RagioneSociale", "ClienteID", "TMK"])
+        ev = pd.concat(parti, ignore_index=True).sort_values("Data", kind="stable", ignore_index=True)
+        cli = self.model.clienti
+        for c in ("RagioneSociale", "ClienteID", "TMK"):
+            ev[c] = cli[c].reindex(ev["_label"]).to_numpy()
+        return ev
+
+
+# =====================================
+# EXPORT iCalendar (RFC 5545)
+# =====================================
+def _ics_text(s) -> str:
+    return str(s or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _fold(line: str) -> str:
+    """Righe > 75 ottetti spezzate con CRLF + spazio."""
+    raw = line.encode("utf-8")
+    if len(raw) <= 75:
+        return line
+    parts, cur = [], b""
+    for ch in line:
+        b = ch.encode("utf-8")
+        if len(cur) + len(b) > (75 if not parts else 74):
+            parts.append(cur.decode("utf-8"))
+            cur = b""
+        cur += b
+    parts.append(cur.decode("utf-8"))
+    return "\r\n ".join(parts)
+
+
+def ical(eventi: pd.DataFrame, nome: str = "Agenda CRM SHT") -> bytes:
+    """Calendario .ics con un evento di un giorno per ogni riga di Agenda.eventi()."""
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    icone = {"recall": "📞 Recall", "visita": "👣 Visita"}
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//SHT//CRM Clienti//IT",
+             "CALSCALE:GREGORIAN", f"X-WR-CALNAME:{_ics_text(nome)}"]
+    giorni = pd.to_datetime(eventi["Data"])
+    for r, d in zip(eventi.itertuples(index=False), giorni):
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{r.Tipo}-{_ics_text(r.ClienteID)}-{d:%Y%m%d}@crm-sht",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART;VALUE=DATE:{d:%Y%m%d}",
+            f"DTEND;VALUE=DATE:{d + pd.Timedelta(days=1):%Y%m%d}",
+            f"SUMMARY:{_ics_text(icone.get(r.Tipo, r.Tipo) + ': ' + str(r.RagioneSociale))}",
+            f"DESCRIPTION:{_ics_text(f'Cliente {r.ClienteID} · TMK {r.TMK or chr(8212)}')}",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return ("\r\n".join(_fold(x) for x in lines) + "\r\n").encode("utf-8")
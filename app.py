@@ -5,18 +5,31 @@ from __future__ import annotations
 import streamlit as st
 import pandas as pd
 import time
+import html
+import tempfile
 from datetime import datetime
 from pathlib import Path
-from fpdf import FPDF
-from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, JsCode
-from docx import Document
-from docx.shared import Pt
 from mega_links_sync import (
     sync_from_mega,
+    sync_dataset_files,
     upload_to_mega,
-    sync_gabriele_files,
-    save_preventivo_to_mega
+    get_backend,
+    get_uploader
 )
+from csv_merge import pending_conflicts, read_csv_any, resolve_conflicts
+from perf import count_full_run, counted_fragment, last_ms, rerun_fragment, rerun_stats, timed
+from ui_tables import TABLE_CSS, html_table, paginate, server_grid
+from search_index import cerca_clienti
+from contratti_store import OWNER_COL, append_contratto, delete_contratto, migrate_file, update_cliente, update_contratto
+from datasets import DATASETS, dataset, load_view, owner_for_user, split_by_owner, view_labels, view_version
+from agenda import RECALL_MESI, VISITA_MESI, ical
+from importi import euro, format_euro, parse_euro
+from mrr import ORIZZONTE_MESI
+from rinnovi import ANTICIPO_GIORNI, TOLLERANZA_GIORNI
+from preventivi_docx import TEMPLATE_OPTIONS, Lavoro, campi_template, genera_batch_zip, genera_preventivo_word
+from preventivi_store import get_store
+from exports import EXPORT_CACHE, FORMATI, clienti_attivi, n_clienti_attivi, pdf_batch_zip, portafoglio_excel_bytes, safe_text
+from crm_model import CRMModel, data_version, get_model, rekey_model, scadenza_badge
 
 
 # =====================================
@@ -57,29 +70,15 @@ LOGO_URL = "https://www.shtsrl.com/template/images/logo.png"
 STORAGE_DIR = Path(__file__).parent / "storage"
 STORAGE_DIR.mkdir(parents=True, exist_ok=True)
 
-# File CSV principali
-CLIENTI_CSV = STORAGE_DIR / "clienti.csv"
-CONTRATTI_CSV = STORAGE_DIR / "contratti.csv"
-
-# Cartella e file per Gabriele
-GABRIELE_DIR = STORAGE_DIR / "gabriele"
-GABRIELE_DIR.mkdir(parents=True, exist_ok=True)
-GABRIELE_CLIENTI = GABRIELE_DIR / "clienti.csv"
-GABRIELE_CONTRATTI = GABRIELE_DIR / "contratti.csv"
+# File CSV del dataset principale (gli altri agenti: registro in datasets.py)
+CLIENTI_CSV = dataset(None).clienti
+CONTRATTI_CSV = dataset(None).contratti
 
 # Cartella preventivi
 PREVENTIVI_DIR = STORAGE_DIR / "preventivi"
 PREVENTIVI_DIR.mkdir(parents=True, exist_ok=True)
 
-# Cartella template preventivi
-TEMPLATES_DIR = Path(__file__).parent / "templates"
-TEMPLATES_DIR.mkdir(parents=True, exist_ok=True)
-TEMPLATE_OPTIONS = {
-    "Offerta A4": "Offerta_A4.docx",
-    "Offerta A3": "Offerta_A3.docx",
-    "Centralino": "Offerta_Centralino.docx",
-    "Varie": "Offerta_Varie.docx",
-}
+# Template preventivi: storage/templates (TEMPLATES_DIR / TEMPLATE_OPTIONS in preventivi_docx.py)
 
 # Durate standard contratti
 DURATE_MESI = ["12", "24", "36", "48", "60", "72"]
@@ -98,7 +97,7 @@ CLIENTI_COLS = [
 
 
 CONTRATTI_COLS = [
-    "ClienteID", "RagioneSociale", "NumeroContratto", "DataInizio", "DataFine", "Durata",
+    "ContrattoID", "ClienteID", "RagioneSociale", "NumeroContratto", "DataInizio", "DataFine", "Durata",
     "DescrizioneProdotto", "NOL_FIN", "NOL_INT", "TotRata",
     "CopieBN", "EccBN", "CopieCol", "EccCol", "Stato"
 ]
@@ -118,24 +117,6 @@ def fmt_date(d) -> str:
     except Exception:
         return ""
 
-def money(x):
-    """Formatta numeri in valuta italiana"""
-    try:
-        v = float(pd.to_numeric(x, errors="coerce"))
-        if pd.isna(v): return ""
-        return f"{v:,.2f} €"
-    except Exception:
-        return ""
-
-def safe_text(txt):
-    """Rimuove caratteri non compatibili con PDF latin-1"""
-    if pd.isna(txt) or txt is None: return ""
-    s = str(txt)
-    replacements = {"€": "EUR", "–": "-", "—": "-", "“": '"', "”": '"', "‘": "'", "’": "'"}
-    for k, v in replacements.items():
-        s = s.replace(k, v)
-    return s.encode("latin-1", "replace").decode("latin-1")
-
 def ensure_columns(df, cols):
     for c in cols:
         if c not in df.columns:
@@ -204,7 +185,7 @@ def load_csv(path: Path, cols: list[str]) -> pd.DataFrame:
     return df
 
 def save_csv(df: pd.DataFrame, path: Path, date_cols=None):
-    out = df.copy()
+    out = df.drop(columns=[c for c in df.columns if str(c).startswith("_")])
     if date_cols:
         for c in date_cols:
             out[c] = out[c].apply(fmt_date)
@@ -224,40 +205,51 @@ def save_if_changed(df_new, path: Path, original_df):
         return True
 
 # =====================================
-# FUNZIONI DI SALVATAGGIO DEDICATE (con correzione automatica date + upload Box)
+# FUNZIONI DI SALVATAGGIO DEDICATE (con correzione automatica date + upload asincrono)
 # =====================================
 def save_clienti(df: pd.DataFrame):
-    """Salva il CSV clienti correggendo e formattando le date, poi aggiorna su Box."""
+    """Salva il CSV clienti correggendo e formattando le date, poi accoda l'upload sul backend."""
     for c in ["UltimoRecall", "ProssimoRecall", "UltimaVisita", "ProssimaVisita"]:
         if c in df.columns:
             df[c] = fix_inverted_dates(df[c], col_name=c)
 
-    # 🔹 Salva localmente
-    save_csv(df, CLIENTI_CSV, date_cols=["UltimoRecall", "ProssimoRecall", "UltimaVisita", "ProssimaVisita"])
+    # 🔹 Salva localmente, ogni riga nel file del suo proprietario
+    paths = []
+    for path, righe in split_by_owner(df, "clienti"):
+        save_csv(righe, path, date_cols=["UltimoRecall", "ProssimoRecall", "UltimaVisita", "ProssimaVisita"])
+        paths.append(path)
 
-    # 🔹 Sincronizza su Box
+    # 🔹 Upload in background sul backend di sincronizzazione
     try:
-        upload_to_mega(CLIENTI_CSV)
-        st.toast("📤 Dati clienti sincronizzati su Box.", icon="✅")
+        if all([upload_to_mega(p) is not None for p in paths]):
+            st.toast(f"📤 Upload clienti avviato su {get_backend().label}.", icon="✅")
     except Exception as e:
-        st.warning(f"⚠️ Upload clienti su Box non riuscito: {e}")
+        st.warning(f"⚠️ Upload clienti non riuscito: {e}")
 
 
 def save_contratti(df: pd.DataFrame):
-    """Salva il CSV contratti correggendo e formattando le date, poi aggiorna su Box."""
+    """Salva il CSV contratti correggendo e formattando le date, poi accoda l'upload sul backend."""
     for c in ["DataInizio", "DataFine"]:
         if c in df.columns:
             df[c] = fix_inverted_dates(df[c], col_name=c)
 
-    # 🔹 Salva localmente
-    save_csv(df, CONTRATTI_CSV, date_cols=["DataInizio", "DataFine"])
+    # 🔹 Salva localmente, ogni riga nel file del suo proprietario
+    paths = []
+    for path, righe in split_by_owner(df, "contratti"):
+        save_csv(righe, path, date_cols=["DataInizio", "DataFine"])
+        paths.append(path)
 
-    # 🔹 Sincronizza su Box
+    # 🔹 Upload in background sul backend di sincronizzazione
     try:
-        upload_to_mega(CONTRATTI_CSV)
-        st.toast("📤 Dati contratti sincronizzati su Box.", icon="✅")
+        if all([upload_to_mega(p) is not None for p in paths]):
+            st.toast(f"📤 Upload contratti avviato su {get_backend().label}.", icon="✅")
     except Exception as e:
-        st.warning(f"⚠️ Upload contratti su Box non riuscito: {e}")
+        st.warning(f"⚠️ Upload contratti non riuscito: {e}")
+
+
+def _modello(df_cli: pd.DataFrame, df_ct: pd.DataFrame) -> CRMModel:
+    """Modello della versione dati del run (firme dei file, in session_state): niente hash dei DataFrame."""
+    return get_model(df_cli, df_ct, st.session_state.get("_data_version"))
 
 
 # =====================================
@@ -359,25 +351,12 @@ def normalize_cliente_id(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def load_clienti() -> pd.DataFrame:
-    """Carica i dati dei clienti dal file CSV (solo lettura, nessuna riscrittura automatica)."""
-    import pandas as pd
-
-    try:
-        if CLIENTI_CSV.exists():
-            df = pd.read_csv(
-                CLIENTI_CSV,
-                dtype=str,
-                sep=None,              # autodetect ; or ,
-                engine="python",
-                encoding="utf-8-sig",
-                on_bad_lines="skip"
-            )
-        else:
-            df = pd.DataFrame(columns=CLIENTI_COLS)
-    except Exception as e:
-        st.error(f"❌ Errore durante la lettura dei clienti: {e}")
-        df = pd.DataFrame(columns=CLIENTI_COLS)
+def load_clienti(path: Path = CLIENTI_CSV) -> pd.DataFrame:
+    """
+    Carica i clienti di un dataset (solo lettura, nessuna riscrittura automatica).
+    Gira anche nei thread di datasets.load_view: niente chiamate st.*, gli errori salgono.
+    """
+    df = read_csv_any(path)      # separatore ; o , rilevato, parser C
 
     # Pulizia e normalizzazione
     df = (
@@ -395,25 +374,9 @@ def load_clienti() -> pd.DataFrame:
     return df
 
 
-def load_contratti() -> pd.DataFrame:
-    """Carica i dati dei contratti dal file CSV (solo lettura, nessuna riscrittura automatica)."""
-    import pandas as pd
-
-    try:
-        if CONTRATTI_CSV.exists():
-            df = pd.read_csv(
-                CONTRATTI_CSV,
-                dtype=str,
-                sep=None,              # autodetect ; or ,
-                engine="python",
-                encoding="utf-8-sig",
-                on_bad_lines="skip"
-            )
-        else:
-            df = pd.DataFrame(columns=CONTRATTI_COLS)
-    except Exception as e:
-        st.error(f"❌ Errore durante la lettura dei contratti: {e}")
-        df = pd.DataFrame(columns=CONTRATTI_COLS)
+def load_contratti(path: Path = CONTRATTI_CSV) -> pd.DataFrame:
+    """Carica i contratti di un dataset (come load_clienti: senza st.*, gli errori salgono)."""
+    df = read_csv_any(path)
 
     # Pulizia e normalizzazione
     df = (
@@ -524,6 +487,89 @@ def kpi_card(label: str, value, icon: str, color: str) -> str:
     </div>
     """
 
+# =====================================
+# OFFERTE DI RINNOVO IN BLOCCO (contratti in scadenza)
+# =====================================
+CAMPI_RINNOVO = ("CONTRATTO", "SCADENZA")   # segnaposto compilati dalle offerte di rinnovo
+
+
+def _dir_preventivi(autore: str) -> Path:
+    """Cartella dei preventivi dell'autore (singoli e in blocco): storage/preventivi/<autore>/."""
+    return PREVENTIVI_DIR / autore.lower().strip()
+
+
+def _panel_rinnovi(model, vista: pd.DataFrame, oggi: pd.Timestamp):
+    autore = st.session_state.get("user", "").lower().strip()
+    if not autore:
+        st.caption("🔐 Effettua il login per generare le offerte di rinnovo.")
+        return
+
+    c1, c2, c3 = st.columns([2, 2, 1.5])
+    periodo = c1.date_input("Scadenza tra", value=(oggi, oggi + pd.DateOffset(months=6)),
+                            format="DD/MM/YYYY", key="rinn_periodo")
+    tmk_opts = sorted(t for t in vista["TMK"].dropna().astype(str).str.strip().unique() if t)
+    tmk = c2.multiselect("TMK (vuoto = tutti)", tmk_opts, key="rinn_tmk")
+    template = c3.selectbox("Template", TEMPLATE_OPTIONS.keys(), key="rinn_template")
+    if len(periodo) != 2:
+        st.info("Seleziona data iniziale e finale.")
+        return
+
+    sel = vista.loc[model.scadenze().window(pd.Timestamp(periodo[0]), pd.Timestamp(periodo[1]))]
+    if tmk:
+        sel = sel[sel["TMK"].isin(tmk)]
+    st.caption(f"📄 {len(sel)} contratti in scadenza: un'offerta per contratto, numerate in blocco.")
+    mancanti = [c for c in CAMPI_RINNOVO if c not in campi_template(template)]
+    if mancanti:
+        st.warning(f"⚠️ Il template {template} non ha i segnaposto {', '.join(f'<<{c}>>' for c in mancanti)}: "
+                   "contratto e scadenza non compariranno nell'offerta (restano registrati nell'elenco preventivi).")
+
+    if st.button("⚙️ Genera offerte di rinnovo", disabled=sel.empty, key="rinn_genera"):
+        barra = st.progress(0.0, text="Avvio…")
+
+        def avanzamento(fatti, totale, secondi):
+            barra.progress(fatti / max(totale, 1), text=f"{fatti}/{totale} offerte · {fatti / secondi:.0f}/s")
+
+        indirizzi = model.clienti["Indirizzo"].reindex(sel["_cli"]).fillna("").to_numpy()
+        scad = sel["DataFine_dt"].dt.strftime("%d/%m/%Y").to_numpy()
+        dest_dir = _dir_preventivi(autore)
+        dest = Path(tempfile.gettempdir()) / f"rinnovi_{autore}_{datetime.now():%Y%m%d%H%M%S}.zip"
+        try:
+            store = get_store()
+            with timed("preventivo.rinnovi", contratti=len(sel), template=template):
+                numeri = store.alloca(len(sel))   # un'unica riserva del contatore per tutto il blocco
+                lavori = [
+                    Lavoro(num, r.Cliente, {"Indirizzo": ind, "CAP": r.CAP, "Citta": r.Citta},
+                           {"CONTRATTO": r.NumeroContratto, "SCADENZA": sc})
+                    for num, r, ind, sc in zip(numeri, sel.itertuples(index=False), indirizzi, scad)
+                ]
+                stats = genera_batch_zip(dest, template, lavori, salva_in=dest_dir, progress=avanzamento)
+                creato = datetime.now().strftime("%d/%m/%Y %H:%M")
+                # ogni offerta registra il contratto che rinnova
+                rif = sel.reindex(columns=["ClienteID", "NumeroContratto", "ContrattoID"], fill_value="")
+                store.aggiungi([{
+                    "NumeroOfferta": lv.num_off, "ClienteID": r.ClienteID, "Cliente": lv.nome_cliente, "Autore": autore,
+                    "Template": TEMPLATE_OPTIONS[template], "NomeFile": lv.nome_file,
+                    "Percorso": str(dest_dir / lv.nome_file), "DataCreazione": creato,
+                    "NumeroContratto": r.NumeroContratto, "ContrattoID": r.ContrattoID,
+                } for lv, r in zip(lavori, rif.itertuples(index=False))])
+            if get_backend().writable:
+                for lv in lavori:
+                    upload_to_mega(dest_dir / lv.nome_file)
+                upload_to_mega(STORAGE_DIR / "preventivi.csv")
+            st.session_state["rinnovi_zip"] = (str(dest), stats, f"{numeri[0]} … {numeri[-1]}")
+        except Exception as e:
+            st.error(f"❌ Errore generazione offerte: {e}")
+
+    if "rinnovi_zip" in st.session_state:
+        path, stats, numeri = st.session_state["rinnovi_zip"]
+        st.success(f"✅ {stats['preventivi']} offerte ({numeri}) in {stats['secondi']:.1f} s · "
+                   f"{stats['byte'] / 1e6:.1f} MB")
+        if Path(path).exists():
+            with open(path, "rb") as f:
+                st.download_button("📦 Scarica ZIP offerte", f, file_name=Path(path).name,
+                                   mime="application/zip", key="dl_rinnovi")
+
+
 # =====================================
 # PAGINA DASHBOARD (CLASSICA con TMK e gestione Fabio/Gabriele)
 # =====================================
@@ -532,18 +578,17 @@ def page_dashboard(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
     st.markdown("<h2>📊 Dashboard Gestionale</h2>", unsafe_allow_html=True)
     st.divider()
 
+    model = _modello(df_cli, df_ct)
+    vista = model.contratti_view()   # contratti + cliente, materializzata per versione dati
+
     # === KPI principali ===
-    stato = df_ct["Stato"].fillna("").astype(str).str.lower()
+    stato = vista["Stato_n"]
     total_clients = len(df_cli)
     active_contracts = int((stato != "chiuso").sum())
     closed_contracts = int((stato == "chiuso").sum())
     now = pd.Timestamp.now().normalize()
 
-    df_ct["DataInizio"] = pd.to_datetime(df_ct["DataInizio"], errors="coerce", dayfirst=True)
-    new_contracts = df_ct[
-        (df_ct["DataInizio"].notna()) &
-        (df_ct["DataInizio"] >= pd.Timestamp(year=now.year, month=1, day=1))
-    ]
+    new_contracts = vista[vista["DataInizio_dt"] >= pd.Timestamp(year=now.year, month=1, day=1)]
 
     c1, c2, c3, c4 = st.columns(4)
     c1.markdown(kpi_card("Clienti attivi", total_clients, "👥", "#1976D2"), unsafe_allow_html=True)
@@ -646,14 +691,10 @@ def page_dashboard(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
                         "Stato": "aperto"
                     }
 
-                    # --- Scelta automatica file in base all'utente ---
+                    # --- File del dataset dell'utente (registro datasets) ---
                     user = st.session_state.get("user", "").lower()
-                    if user == "gabriele":
-                        path_cli = GABRIELE_CLIENTI
-                        path_ct = GABRIELE_CONTRATTI
-                    else:
-                        path_cli = CLIENTI_CSV
-                        path_ct = CONTRATTI_CSV
+                    ds = dataset(owner_for_user(user))
+                    path_cli, path_ct = ds.clienti, ds.contratti
 
                     # --- Aggiorna CSV ---
                     if path_cli.exists():
@@ -663,12 +704,8 @@ def page_dashboard(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
                     df_exist = pd.concat([df_exist, pd.DataFrame([nuovo_cliente])], ignore_index=True)
                     df_exist.to_csv(path_cli, index=False, encoding="utf-8-sig")
 
-                    if path_ct.exists():
-                        df_ct_exist = pd.read_csv(path_ct, dtype=str, encoding="utf-8-sig", on_bad_lines="skip").fillna("")
-                    else:
-                        df_ct_exist = pd.DataFrame(columns=df_ct.columns)
-                    df_ct_exist = pd.concat([df_ct_exist, pd.DataFrame([nuovo_contratto])], ignore_index=True)
-                    df_ct_exist.to_csv(path_ct, index=False, encoding="utf-8-sig")
+                    # contratto con la sua ContrattoID, come dalla pagina Contratti
+                    append_contratto(path_ct, nuovo_contratto, CONTRATTI_COLS)
 
                     st.success(f"✅ Cliente '{ragione}' creato e salvato correttamente ({user.upper()})")
                     st.session_state.update({
@@ -686,90 +723,59 @@ def page_dashboard(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
 
     oggi = pd.Timestamp.now().normalize()
     entro_6_mesi = oggi + pd.DateOffset(months=6)
-    df_ct["DataFine"] = pd.to_datetime(df_ct["DataFine"], errors="coerce", dayfirst=True)
-
-    scadenze = df_ct[
-        (df_ct["DataFine"].notna()) &
-        (df_ct["DataFine"] >= oggi) &
-        (df_ct["DataFine"] <= entro_6_mesi) &
-        (df_ct["Stato"].astype(str).str.lower() != "chiuso")
-    ].copy()
-
-    if not scadenze.empty and "RagioneSociale" not in scadenze.columns:
-        scadenze = scadenze.merge(df_cli[["ClienteID", "RagioneSociale"]], on="ClienteID", how="left")
+    scadenze = vista.loc[model.scadenze().window(oggi, entro_6_mesi)]   # già in ordine di DataFine
 
     if scadenze.empty:
         st.success("✅ Nessun contratto attivo in scadenza nei prossimi 6 mesi.")
     else:
-        scadenze["DataFine"] = scadenze["DataFine"].apply(fmt_date)
-        scadenze = scadenze.sort_values("DataFine")
         st.markdown(f"📅 **{len(scadenze)} contratti in scadenza entro 6 mesi:**")
-        head_cols = st.columns([2, 1, 1, 1, 0.8])
-        head_cols[0].markdown("**Cliente**")
-        head_cols[1].markdown("**Contratto**")
-        head_cols[2].markdown("**Scadenza**")
-        head_cols[3].markdown("**Stato**")
-        head_cols[4].markdown("**Azioni**")
-        st.markdown("---")
-
-        for i, r in scadenze.iterrows():
-            bg_color = "#f8fbff" if i % 2 == 0 else "#ffffff"
-            # normalizzo l'ID da inviare
-            raw_id = str(r.get("ClienteID", "")).strip()
-            cliente_id_norm = raw_id.lstrip("0").upper()
-        
-            cols = st.columns([2, 1, 1, 1, 0.8])
-            with cols[0]:
-                st.markdown(f"<div style='background:{bg_color};padding:6px'><b>{r.get('RagioneSociale','—')}</b></div>", unsafe_allow_html=True)
-            with cols[1]:
-                st.markdown(f"<div style='background:{bg_color};padding:6px'>{r.get('NumeroContratto','—')}</div>", unsafe_allow_html=True)
-            with cols[2]:
-                st.markdown(f"<div style='background:{bg_color};padding:6px'>{fmt_date(r.get('DataFine'))}</div>", unsafe_allow_html=True)
-            with cols[3]:
-                st.markdown(f"<div style='background:{bg_color};padding:6px'>{r.get('Stato','—')}</div>", unsafe_allow_html=True)
-            with cols[4]:
-                if st.button("📂 Apri", key=f"open_scad_{cliente_id_norm}_{i}", use_container_width=True):
-                    if cliente_id_norm:
-                        st.session_state["selected_cliente"] = cliente_id_norm
-                        st.session_state.pop("nav_target", None)
-                        st.session_state["nav_target"] = "Contratti"
-                        st.session_state["_go_contratti_now"] = True
-                        st.rerun()
-                    else:
-                        st.warning("⚠️ ID cliente non valido per questo contratto.")
+        view = pd.DataFrame({
+            "Cliente": scadenze["Cliente"],
+            "Contratto": scadenze["NumeroContratto"].replace("", "—"),
+            "Scadenza": scadenze["DataFine_dt"].dt.strftime("%d/%m/%Y"),
+            "Stato": scadenze["Stato"].replace("", "—"),
+            "_cid": scadenze["_cid"],
+        })
+        page_view, page, _ = paginate(view, key="dash_scad", default_size=25)
+        sel = server_grid(
+            page_view, key=f"grid_dash_scad_{page}",
+            headers={"Cliente": "Cliente", "Contratto": "Contratto", "Scadenza": "Scadenza", "Stato": "Stato"},
+        )
+        if st.button("📂 Apri contratti del cliente", disabled=sel is None, key="open_scad"):
+            if sel["_cid"]:
+                st.session_state["selected_cliente"] = sel["_cid"]
+                st.session_state["nav_target"] = "Contratti"
+                st.session_state["_go_contratti_now"] = True
+                st.rerun()
+            else:
+                st.warning("⚠️ ID cliente non valido per questo contratto.")
 
+    with st.expander("🧾 Offerte di rinnovo in blocco"):
+        _panel_rinnovi(model, vista, oggi)
 
     # === CONTRATTI RECENTI SENZA DATA FINE ===
     st.divider()
     st.markdown("### ⚠️ Contratti recenti senza data di fine")
 
-    df_ct["DataInizio"] = pd.to_datetime(df_ct["DataInizio"], errors="coerce", dayfirst=True)
-    df_ct["DataFine"] = pd.to_datetime(df_ct["DataFine"], errors="coerce", dayfirst=True)
     oggi = pd.Timestamp.now().normalize()
 
-    contratti_senza_fine = df_ct[
-        (df_ct["DataFine"].isna()) &
-        (df_ct["DataInizio"].notna()) &
-        (df_ct["DataInizio"] >= oggi)
-    ].copy()
+    contratti_senza_fine = vista[
+        (vista["DataFine_dt"].isna()) &
+        (vista["DataInizio_dt"] >= oggi)
+    ].sort_values("DataInizio_dt", ascending=False, kind="stable")
 
     if contratti_senza_fine.empty:
         st.success("✅ Tutti i contratti recenti hanno una data di fine.")
     else:
         st.warning(f"⚠️ {len(contratti_senza_fine)} contratti inseriti da oggi non hanno ancora una data di fine:")
-        if "RagioneSociale" not in contratti_senza_fine.columns:
-            contratti_senza_fine = contratti_senza_fine.merge(
-                df_cli[["ClienteID", "RagioneSociale"]],
-                on="ClienteID", how="left"
-            )
-
-        contratti_senza_fine["DataInizio"] = contratti_senza_fine["DataInizio"].apply(fmt_date)
-        contratti_senza_fine = contratti_senza_fine.sort_values("DataInizio", ascending=False)
+        contratti_senza_fine = contratti_senza_fine.assign(
+            RagioneSociale=contratti_senza_fine["Cliente"],
+            DataInizio=contratti_senza_fine["DataInizio_dt"].dt.strftime("%d/%m/%Y"),
+        )
 
         for i, r in contratti_senza_fine.iterrows():
-            # normalizzo l'ID da inviare
-            raw_id = str(r.get("ClienteID", "")).strip()
-            cliente_id_norm = raw_id.lstrip("0").upper()
+            # ID normalizzato già calcolato nel modello
+            cliente_id_norm = r["_cid"]
         
             col1, col2, col3, col4, col5 = st.columns([2.5, 1, 1.2, 2.5, 0.8])
             with col1:
@@ -796,91 +802,54 @@ def page_dashboard(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
 
 
 # =====================================
-# PAGINA CLIENTI (VERSIONE STABILE CON PREVENTIVI E LOGIN CORRETTO)
+# PANNELLI CLIENTE (fragment: salvataggi senza rerun dell'intera app)
 # =====================================
-def page_clienti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
-    st.subheader("📋 Gestione Clienti")
-
-    # === PRE-SELEZIONE CLIENTE DA NAVIGAZIONE ===
-    if "selected_cliente" in st.session_state:
-        sel_id_nav = str(st.session_state.pop("selected_cliente"))
-        cli_ids = df_cli["ClienteID"].astype(str)
-        if sel_id_nav in set(cli_ids):
-            row = df_cli.loc[cli_ids == sel_id_nav].iloc[0]
-            st.session_state["cliente_selezionato"] = row["RagioneSociale"]
-
-    # === RICERCA CLIENTE ===
-    search_query = st.text_input("🔍 Cerca cliente per nome o ID", key="search_cli")
-    if search_query:
-        filtered = df_cli[
-            df_cli["RagioneSociale"].str.contains(search_query, case=False, na=False)
-            | df_cli["ClienteID"].astype(str).str.contains(search_query, na=False)
-        ]
+# Ogni pannello è un st.fragment: salvare note, date o anagrafica riesegue
+# solo il pannello stesso. Il DataFrame in memoria e il modello tipizzato
+# vengono aggiornati sulla riga modificata, senza ricaricare i CSV.
+def _aggiorna_riga(tabella: str, df_cli: pd.DataFrame, df_ct: pd.DataFrame, idx, values: dict):
+    """Modifica puntuale di una riga clienti/contratti: DataFrame + modello in memoria + CSV."""
+    model = _modello(df_cli, df_ct)
+    df = df_cli if tabella == "clienti" else df_ct
+    if tabella == "contratti":
+        # scrittura puntuale sul file del proprietario, per ContrattoID
+        path = _store_contratti(df_ct, idx)
+        update_contratto(path, df_ct.at[idx, "ContrattoID"], values)
+        upload_to_mega(path)
     else:
-        filtered = df_cli.copy()
+        # solo la riga del cliente, nel file del suo proprietario
+        path = dataset(df_cli.at[idx, OWNER_COL] if OWNER_COL in df_cli.columns else None).clienti
+        update_cliente(path, df_cli.at[idx, "ClienteID"], values)
+        upload_to_mega(path)
+    df.loc[idx, list(values)] = list(values.values())
+    model.update_row(tabella, idx, {c: df.at[idx, c] for c in values})
+    # nuova versione = firme dei file appena scritti, così il prossimo run completo ritrova questo modello
+    if st.session_state.get("_data_version"):
+        st.session_state["_data_version"] = view_version(df_cli.attrs.get("owners", []))
+    rekey_model(model, st.session_state.get("_data_version") or data_version(df_cli, df_ct))
 
-    if filtered.empty:
-        st.warning("❌ Nessun cliente trovato.")
-        return
 
-    options = filtered["RagioneSociale"].tolist()
-    selected_name = st.session_state.get("cliente_selezionato", options[0])
-    sel_rag = st.selectbox(
-        "Seleziona Cliente",
-        options,
-        index=options.index(selected_name) if selected_name in options else 0,
-        key="sel_cliente_box"
-    )
+def _store_contratti(df: pd.DataFrame, idx) -> Path:
+    """File contratti del proprietario della riga idx (di df_ct o df_cli)."""
+    return dataset(df.at[idx, OWNER_COL] if OWNER_COL in df.columns else None).contratti
 
-    cliente = filtered[filtered["RagioneSociale"] == sel_rag].iloc[0]
-    sel_id = str(cliente["ClienteID"])
 
-    # === HEADER + AZIONI ===
-    col1, col2 = st.columns([4, 1])
-    with col1:
-        st.markdown(f"## 🏢 {cliente['RagioneSociale']}")
-        st.caption(f"ID Cliente: {sel_id}")
-    with col2:
-        if st.button("📄 Vai ai Contratti", use_container_width=True, key=f"go_cont_{sel_id}"):
-            st.session_state.update({"selected_cliente": sel_id, "nav_target": "Contratti", "_go_contratti_now": True})
-            st.rerun()
+def _riga_cliente(df_cli: pd.DataFrame, df_ct: pd.DataFrame, sel_id: str):
+    idx = _modello(df_cli, df_ct).cliente_label(sel_id)
+    return idx, df_cli.loc[idx]
 
-        if st.button("✏️ Modifica Anagrafica", use_container_width=True, key=f"btn_edit_{sel_id}"):
-            st.session_state[f"edit_cli_{sel_id}"] = not st.session_state.get(f"edit_cli_{sel_id}", False)
-            st.rerun()
 
-        if st.button("🗑️ Cancella Cliente", use_container_width=True, key=f"ask_del_{sel_id}"):
-            st.session_state["confirm_delete_cliente"] = sel_id
-            st.rerun()
-
-    # === CONFERMA CANCELLAZIONE ===
-    if st.session_state.get("confirm_delete_cliente") == sel_id:
-        st.warning(f"⚠️ Eliminare definitivamente **{cliente['RagioneSociale']}** (ID {sel_id}) e tutti i contratti associati?")
-        cdel1, cdel2 = st.columns(2)
-        with cdel1:
-            if st.button("✅ Sì, elimina", use_container_width=True, key=f"do_del_{sel_id}"):
-                try:
-                    df_cli_new = df_cli[df_cli["ClienteID"].astype(str) != sel_id].copy()
-                    df_ct_new  = df_ct[df_ct["ClienteID"].astype(str)  != sel_id].copy()
-                    df_cli_new.to_csv(CLIENTI_CSV, index=False, encoding="utf-8-sig")
-                    df_ct_new.to_csv(CONTRATTI_CSV, index=False, encoding="utf-8-sig")
-                    try: st.cache_data.clear()
-                    except: pass
-                    st.session_state.pop("confirm_delete_cliente", None)
-                    st.success("🗑️ Cliente e contratti eliminati con successo! ✅")
-                    time.sleep(0.5)
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"❌ Errore durante l'eliminazione: {e}")
-        with cdel2:
-            if st.button("❌ Annulla", use_container_width=True, key=f"undo_del_{sel_id}"):
-                st.session_state.pop("confirm_delete_cliente", None)
-                st.info("Operazione annullata.")
-                st.rerun()
+@counted_fragment
+def _panel_anagrafica(df_cli: pd.DataFrame, df_ct: pd.DataFrame, sel_id: str):
+    idx, cliente = _riga_cliente(df_cli, df_ct, sel_id)
 
     # === ANAGRAFICA CLIENTE (visuale compatta tipo scheda) ===
     st.divider()
-    st.markdown("### 🧾 Anagrafica Cliente")
+    h1, h2 = st.columns([4, 1])
+    h1.markdown("### 🧾 Anagrafica Cliente")
+    if h2.button("✏️ Modifica Anagrafica", use_container_width=True, key=f"btn_edit_{sel_id}"):
+        st.session_state[f"edit_cli_{sel_id}"] = not st.session_state.get(f"edit_cli_{sel_id}", False)
+        rerun_fragment()
 
     st.markdown(
         f"""
@@ -924,45 +893,51 @@ def page_clienti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
             salva = st.form_submit_button("💾 Salva Modifiche")
             if salva:
                 try:
-                    idx = df_cli.index[df_cli["ClienteID"].astype(str) == sel_id][0]
-                    df_cli.loc[idx, [
-                        "Indirizzo","Citta","CAP","Telefono","Cell","Email",
-                        "PersonaRiferimento","PartitaIVA","IBAN","SDI","TMK"
-                    ]] = [indirizzo, citta, cap, telefono, cell, email, persona, piva, iban, sdi, tmk_sel]
-                    save_clienti(df_cli)
-                    st.success("✅ Anagrafica aggiornata.")
+                    _aggiorna_riga("clienti", df_cli, df_ct, idx, {
+                        "Indirizzo": indirizzo, "Citta": citta, "CAP": cap, "Telefono": telefono,
+                        "Cell": cell, "Email": email, "PersonaRiferimento": persona,
+                        "PartitaIVA": piva, "IBAN": iban, "SDI": sdi, "TMK": tmk_sel,
+                    })
+                    st.toast("✅ Anagrafica aggiornata.", icon="✅")
                     st.session_state[f"edit_cli_{sel_id}"] = False
-                    st.rerun()
+                    rerun_fragment()
                 except Exception as e:
                     st.error(f"❌ Errore durante il salvataggio: {e}")
 
+
+@counted_fragment
+def _panel_note(df_cli: pd.DataFrame, df_ct: pd.DataFrame, sel_id: str):
+    idx, cliente = _riga_cliente(df_cli, df_ct, sel_id)
+
     # === NOTE CLIENTE ===
     st.divider()
     st.markdown("### 📝 Note Cliente")
     st.caption("Annotazioni o informazioni utili sul cliente (visibili a tutti gli utenti).")
 
-    note_attuali = cliente.get("NoteCliente", "")
     nuove_note = st.text_area(
         "Scrivi o modifica le note del cliente:",
-        note_attuali,
+        cliente.get("NoteCliente", ""),
         height=160,
-        key=f"note_{sel_id}_{int(time.time()*1000)}"
+        key=f"note_{sel_id}"
     )
 
     n1, n2 = st.columns([0.25, 0.75])
     with n1:
         if st.button("💾 Salva Note", use_container_width=True, key=f"save_note_{sel_id}"):
             try:
-                idx_row = df_cli.index[df_cli["ClienteID"].astype(str) == sel_id][0]
-                df_cli.loc[idx_row, "NoteCliente"] = nuove_note
-                save_clienti(df_cli)
-                st.success("✅ Note salvate correttamente.")
-                st.rerun()
+                _aggiorna_riga("clienti", df_cli, df_ct, idx, {"NoteCliente": nuove_note})
+                st.toast("✅ Note salvate correttamente.", icon="✅")
+                rerun_fragment()
             except Exception as e:
                 st.error(f"❌ Errore durante il salvataggio: {e}")
     with n2:
         st.info("Le modifiche vengono salvate immediatamente nel file clienti.csv")
 
+
+@counted_fragment
+def _panel_recall(df_cli: pd.DataFrame, df_ct: pd.DataFrame, sel_id: str):
+    idx, cliente = _riga_cliente(df_cli, df_ct, sel_id)
+
     # === RECALL & VISITE ===
     st.divider()
     st.markdown("### ⚡ Recall e Visite")
@@ -979,29 +954,113 @@ def page_clienti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
     uv_val = _safe_date(cliente.get("UltimaVisita"))
     pv_val = _safe_date(cliente.get("ProssimaVisita"))
 
-    if ur_val and not pr_val:
-        pr_val = (pd.Timestamp(ur_val) + pd.DateOffset(months=3)).date()
-    if uv_val and not pv_val:
-        pv_val = (pd.Timestamp(uv_val) + pd.DateOffset(months=6)).date()
+    # prossime date proposte dall'agenda (default: ultimo recall + 3 mesi, ultima visita + 6 mesi)
+    pr_def, pv_def = _modello(df_cli, df_ct).agenda().prossimi(idx)
+    pr_val = pr_val or (None if pd.isna(pr_def) else pr_def.date())
+    pv_val = pv_val or (None if pd.isna(pv_def) else pv_def.date())
 
-    uniq = f"{sel_id}_{int(time.time()*1000)}"
     r1, r2, r3, r4 = st.columns(4)
-    ur = r1.date_input("⏰ Ultimo Recall",  value=ur_val, format="DD/MM/YYYY", key=f"ur_{uniq}")
-    pr = r2.date_input("📅 Prossimo Recall", value=pr_val, format="DD/MM/YYYY", key=f"pr_{uniq}")
-    uv = r3.date_input("👣 Ultima Visita",  value=uv_val, format="DD/MM/YYYY", key=f"uv_{uniq}")
-    pv = r4.date_input("🗓️ Prossima Visita", value=pv_val, format="DD/MM/YYYY", key=f"pv_{uniq}")
+    ur = r1.date_input("⏰ Ultimo Recall",  value=ur_val, format="DD/MM/YYYY", key=f"ur_{sel_id}")
+    pr = r2.date_input("📅 Prossimo Recall", value=pr_val, format="DD/MM/YYYY", key=f"pr_{sel_id}")
+    uv = r3.date_input("👣 Ultima Visita",  value=uv_val, format="DD/MM/YYYY", key=f"uv_{sel_id}")
+    pv = r4.date_input("🗓️ Prossima Visita", value=pv_val, format="DD/MM/YYYY", key=f"pv_{sel_id}")
 
-    if st.button("💾 Salva Aggiornamenti", use_container_width=True, key=f"save_recall_{uniq}"):
+    if st.button("💾 Salva Aggiornamenti", use_container_width=True, key=f"save_recall_{sel_id}"):
         try:
-            idx = df_cli.index[df_cli["ClienteID"].astype(str) == sel_id][0]
-            df_cli.loc[idx, ["UltimoRecall","ProssimoRecall","UltimaVisita","ProssimaVisita"]] = \
-                [fmt_date(ur), fmt_date(pr), fmt_date(uv), fmt_date(pv)]
-            save_clienti(df_cli)
-            st.success("✅ Date aggiornate.")
-            st.rerun()
+            _aggiorna_riga("clienti", df_cli, df_ct, idx, {
+                "UltimoRecall": fmt_date(ur), "ProssimoRecall": fmt_date(pr),
+                "UltimaVisita": fmt_date(uv), "ProssimaVisita": fmt_date(pv),
+            })
+            st.toast("✅ Date aggiornate.", icon="✅")
+            rerun_fragment()
         except Exception as e:
             st.error(f"❌ Errore salvataggio recall/visite: {e}")
 
+
+# =====================================
+# PAGINA CLIENTI (VERSIONE STABILE CON PREVENTIVI E LOGIN CORRETTO)
+# =====================================
+def page_clienti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
+    st.subheader("📋 Gestione Clienti")
+
+    # === PRE-SELEZIONE CLIENTE DA NAVIGAZIONE ===
+    model = _modello(df_cli, df_ct)
+    if "selected_cliente" in st.session_state:
+        row = model.cliente(st.session_state.pop("selected_cliente"))
+        if row is not None:
+            st.session_state["cliente_selezionato"] = row["RagioneSociale"]
+            st.session_state["search_cli"] = ""
+            st.session_state.pop("sel_cliente_box", None)
+
+    # === RICERCA CLIENTE ===
+    search_query = st.text_input("🔍 Cerca cliente per nome, città o ID", key="search_cli")
+    if search_query:
+        filtered = df_cli.loc[cerca_clienti(model, search_query)]
+    else:
+        filtered = df_cli.copy()
+
+    if filtered.empty:
+        st.warning("❌ Nessun cliente trovato.")
+        return
+
+    options = filtered["RagioneSociale"].tolist()
+    selected_name = st.session_state.get("cliente_selezionato", options[0])
+    sel_rag = st.selectbox(
+        "Seleziona Cliente",
+        options,
+        index=options.index(selected_name) if selected_name in options else 0,
+        key="sel_cliente_box"
+    )
+
+    cliente = filtered[filtered["RagioneSociale"] == sel_rag].iloc[0]
+    sel_id = str(cliente["ClienteID"])
+
+    # === HEADER + AZIONI ===
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        st.markdown(f"## 🏢 {cliente['RagioneSociale']}")
+        st.caption(f"ID Cliente: {sel_id}")
+    with col2:
+        if st.button("📄 Vai ai Contratti", use_container_width=True, key=f"go_cont_{sel_id}"):
+            st.session_state.update({"selected_cliente": sel_id, "nav_target": "Contratti", "_go_contratti_now": True})
+            st.rerun()
+
+        if st.button("🗑️ Cancella Cliente", use_container_width=True, key=f"ask_del_{sel_id}"):
+            st.session_state["confirm_delete_cliente"] = sel_id
+            st.rerun()
+
+    # === CONFERMA CANCELLAZIONE ===
+    if st.session_state.get("confirm_delete_cliente") == sel_id:
+        st.warning(f"⚠️ Eliminare definitivamente **{cliente['RagioneSociale']}** (ID {sel_id}) e tutti i contratti associati?")
+        cdel1, cdel2 = st.columns(2)
+        with cdel1:
+            if st.button("✅ Sì, elimina", use_container_width=True, key=f"do_del_{sel_id}"):
+                try:
+                    df_cli_new = df_cli[df_cli["ClienteID"].astype(str) != sel_id].copy()
+                    df_ct_new  = df_ct[df_ct["ClienteID"].astype(str)  != sel_id].copy()
+                    for tabella, df_new in (("clienti", df_cli_new), ("contratti", df_ct_new)):
+                        for path, righe in split_by_owner(df_new, tabella):
+                            save_csv(righe, path)
+                            upload_to_mega(path)
+                    try: st.cache_data.clear()
+                    except: pass
+                    st.session_state.pop("confirm_delete_cliente", None)
+                    st.success("🗑️ Cliente e contratti eliminati con successo! ✅")
+                    time.sleep(0.5)
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"❌ Errore durante l'eliminazione: {e}")
+        with cdel2:
+            if st.button("❌ Annulla", use_container_width=True, key=f"undo_del_{sel_id}"):
+                st.session_state.pop("confirm_delete_cliente", None)
+                st.info("Operazione annullata.")
+                st.rerun()
+
+    # === ANAGRAFICA, NOTE, RECALL (pannelli fragment) ===
+    _panel_anagrafica(df_cli, df_ct, sel_id)
+    _panel_note(df_cli, df_ct, sel_id)
+    _panel_recall(df_cli, df_ct, sel_id)
+
     # === SEZIONE PREVENTIVI ===
     st.divider()
     st.markdown("## 🧾 Gestione Preventivi Cliente")
@@ -1014,21 +1073,8 @@ def page_clienti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
     sel_id = str(cliente["ClienteID"])
     nome_cliente = cliente["RagioneSociale"]
 
-    PREVENTIVI_FILE = STORAGE_DIR / "preventivi.csv"
-    if not PREVENTIVI_FILE.exists():
-        df_prev = pd.DataFrame(columns=[
-            "NumeroOfferta", "ClienteID", "Cliente", "Autore",
-            "Template", "NomeFile", "Percorso", "DataCreazione"
-        ])
-        df_prev.to_csv(PREVENTIVI_FILE, index=False, encoding="utf-8-sig")
-    else:
-        df_prev = pd.read_csv(PREVENTIVI_FILE, dtype=str).fillna("")
-
-    anno_corrente = datetime.now().year
-    prev_anno = df_prev[df_prev["NumeroOfferta"].str.contains(f"OFF-{anno_corrente}", na=False)]
-    ultimo_num = max([int(x.split("-")[-1]) for x in prev_anno["NumeroOfferta"].tolist() if x.split("-")[-1].isdigit()], default=0)
-    nuovo_num = ultimo_num + 1
-    num_off = f"OFF-{anno_corrente:04d}-{nuovo_num:03d}"
+    store = get_store()
+    num_off = store.prossimo()   # anteprima: il numero viene riservato alla generazione
 
     with st.form(f"frm_prev_{sel_id}"):
         st.subheader("🧾 Crea Nuovo Preventivo")
@@ -1042,12 +1088,15 @@ def page_clienti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
 
     if genera:
         try:
-            out_path = PREVENTIVI_DIR / nome_file
-            out_path.parent.mkdir(parents=True, exist_ok=True)
-            doc = genera_preventivo_word(template, nome_cliente, num_off, out_path)
-
-            autore = st.session_state.get("user", "fabio")
-            save_preventivo_to_mega(out_path, nome_cliente, autore=autore)
+            anteprima, num_off = num_off, store.alloca()[0]
+            if nome_file == f"{anteprima}.docx":
+                nome_file = f"{num_off}.docx"
+            autore = utente_corrente
+            out_path = _dir_preventivi(autore) / nome_file
+            with timed("preventivo.genera", template=template):
+                genera_preventivo_word(template, nome_cliente, num_off, out_path, cliente=cliente)
+            if get_backend().writable:
+                upload_to_mega(out_path)
 
             nuova_riga = {
                 "NumeroOfferta": num_off,
@@ -1059,8 +1108,7 @@ def page_clienti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
                 "Percorso": str(out_path),
                 "DataCreazione": datetime.now().strftime("%d/%m/%Y %H:%M"),
             }
-            df_prev = pd.concat([df_prev, pd.DataFrame([nuova_riga])], ignore_index=True)
-            df_prev.to_csv(PREVENTIVI_FILE, index=False, encoding="utf-8-sig")
+            store.aggiungi([nuova_riga])
 
             st.success(f"✅ Preventivo generato: {out_path.name}")
             st.rerun()
@@ -1072,44 +1120,127 @@ def page_clienti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
     # === Elenco preventivi cliente ===
     st.divider()
     st.subheader("📂 Elenco Preventivi")
+    _panel_elenco_preventivi(sel_id, utente_corrente)
+
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
 
-    df_prev = pd.read_csv(PREVENTIVI_FILE, dtype=str).fillna("")
-    prev_cli = df_prev[df_prev["ClienteID"].astype(str) == sel_id]
 
-    if "Autore" in df_prev.columns and utente_corrente not in ["fabio", "admin"]:
-        prev_cli = prev_cli[prev_cli["Autore"].str.lower() == utente_corrente]
+@counted_fragment
+def _panel_elenco_preventivi(sel_id: str, utente_corrente: str):
+    """
+    Elenco dallo store (dimensione ed esistenza dei file già indicizzate): i
+    byte di un preventivo si leggono solo su richiesta e restano in
+    EXPORT_CACHE, limitata in memoria e condivisa tra le sessioni.
+    """
+    store = get_store()
+    admin = utente_corrente in ["fabio", "admin"]
+    prev_cli = store.di_cliente(sel_id, autore=None if admin else utente_corrente)   # già dal più recente
 
     if prev_cli.empty:
         st.info("Nessun preventivo per questo cliente.")
-    else:
-        prev_cli = prev_cli.sort_values("DataCreazione", ascending=False)
-        for i, r in prev_cli.iterrows():
-            file_path = Path(r["Percorso"])
-            c1, c2, c3, c4 = st.columns([2, 1, 1, 0.6])
-            c1.markdown(f"**{r['NumeroOfferta']}** — {r['Template']}<br>📅 {r['DataCreazione']}", unsafe_allow_html=True)
-            c2.markdown(f"👤 Autore: **{r['Autore']}**")
-
-            if file_path.exists():
-                with open(file_path, "rb") as f:
-                    c3.download_button(
-                        "⬇️ Scarica",
-                        f.read(),
-                        file_name=file_path.name,
-                        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                        key=f"dl_prev_{i}"
-                    )
-
-            if utente_corrente in ["fabio", "admin"]:
-                if c4.button("🗑 Elimina", key=f"del_prev_{i}"):
-                    try:
-                        if file_path.exists():
-                            file_path.unlink()
-                        df_prev = df_prev.drop(i)
-                        df_prev.to_csv(PREVENTIVI_FILE, index=False, encoding="utf-8-sig")
-                        st.success("🗑 Preventivo eliminato.")
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"❌ Errore eliminazione: {e}")
+        return
+    for i, r in prev_cli.iterrows():
+        numero = r["NumeroOfferta"]
+        file_path = Path(r["Percorso"])
+        c1, c2, c3, c4 = st.columns([2, 1, 1, 0.6])
+        c1.markdown(f"**{numero}** — {r['Template']}<br>📅 {r['DataCreazione']}", unsafe_allow_html=True)
+        c2.markdown(f"👤 Autore: **{r['Autore']}**")
+
+        if r["_esiste"]:
+            key = ("preventivo", r["Percorso"], int(r["_byte"]))
+            data = EXPORT_CACHE.get(key)
+            if data is None and c3.button(f"⚙️ Prepara ({r['_byte'] / 1024:.0f} KB)", key=f"prep_prev_{numero}_{i}"):
+                try:
+                    data = file_path.read_bytes()
+                    EXPORT_CACHE.put(key, data)
+                except OSError as e:
+                    c3.error(f"File non leggibile: {e}")
+            if data is not None:
+                c3.download_button("⬇️ Scarica", data, file_name=file_path.name, mime=DOCX_MIME,
+                                   key=f"dl_prev_{numero}_{i}")
+        else:
+            c3.caption("📭 File non presente")
+
+        if admin:
+            if c4.button("🗑 Elimina", key=f"del_prev_{numero}_{i}"):
+                try:
+                    if file_path.exists():
+                        file_path.unlink()
+                    store.elimina(numero)
+                    st.success("🗑 Preventivo eliminato.")
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"❌ Errore eliminazione: {e}")
+
+
+# =====================================
+# TABELLA CONTRATTI (fragment: paginazione e chiudi/riapri senza rerun completo)
+# =====================================
+@counted_fragment
+def _panel_tabella_contratti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, ct: pd.DataFrame,
+                             sel_id: str, permessi_limitati: bool):
+    page_ct, page, _ = paginate(ct, key=f"ct_tbl_{sel_id}")
+
+    with timed("contratti.tabella", cliente=sel_id, pagina=page, righe=len(page_ct)):
+        disp = pd.DataFrame({
+            "N°": page_ct["NumeroContratto"].replace("", "—"),
+            "Inizio": page_ct["DataInizio"].map(fmt_date),
+            "Fine": page_ct["DataFine"].map(fmt_date),
+            "Durata": page_ct["Durata"],
+            "Descrizione": page_ct["DescrizioneProdotto"].map(safe_text),
+            "TotRata": format_euro(parse_euro(page_ct["TotRata"]), vuoto="—"),
+            "NOL_FIN": page_ct["NOL_FIN"],
+            "NOL_INT": page_ct["NOL_INT"],
+            "CopieBN": page_ct["CopieBN"],
+            "EccBN": page_ct["EccBN"],
+            "CopieCol": page_ct["CopieCol"],
+            "EccCol": page_ct["EccCol"],
+        }, index=page_ct.index)
+        stato_pag = page_ct["Stato"].astype(str).str.lower()
+        row_cls = pd.Series("", index=page_ct.index).mask(stato_pag == "chiuso", "row-closed")
+        st.markdown(html_table(disp, [
+            ("N°", "N°", "mono"), ("Inizio", "Inizio", "mono"), ("Fine", "Fine", "mono"),
+            ("Durata", "Durata", ""), ("Descrizione", "Descrizione Prodotto", "left"),
+            ("TotRata", "Tot. Rata", ""), ("NOL_FIN", "NOL FIN", "mono"), ("NOL_INT", "NOL INT", "mono"),
+            ("CopieBN", "Copie B/N", "mono"), ("EccBN", "Ecc. B/N", "mono"),
+            ("CopieCol", "Copie Col", "mono"), ("EccCol", "Ecc. Col", "mono"),
+        ], row_classes=row_cls), unsafe_allow_html=True)
+    st.caption(f"⏱️ Tabella pagina {page} generata in {last_ms('contratti.tabella'):.1f} ms")
+
+    # --- azioni sul contratto selezionato (una sola riga di pulsanti)
+    sel_labels = {
+        i: f"{r['NumeroContratto'] or '—'} · {fmt_date(r['DataInizio'])} · {str(r['DescrizioneProdotto'])[:50]}"
+        for i, r in page_ct[["NumeroContratto", "DataInizio", "DescrizioneProdotto"]].iterrows()
+    }
+    a0, a1, a2, a3 = st.columns([4, 1, 1, 1])
+    i = a0.selectbox("Contratto selezionato", list(sel_labels), format_func=sel_labels.get,
+                     key=f"ct_sel_{sel_id}_{page}")
+    stato = str(ct.loc[i, "Stato"]).lower()
+
+    # ✏️ Modifica contratto → apre la pagina dedicata
+    if a1.button("✏️ Modifica", key="edit_ct", use_container_width=True, disabled=permessi_limitati):
+        st.session_state["edit_ct_id"] = ct.at[i, "ContrattoID"]
+        st.session_state["nav_target"] = "✏️ Modifica Contratto"
+        st.rerun()
+
+    # 🔒 Chiudi / Riapri contratto
+    stato_btn = "🔒 Chiudi" if stato != "chiuso" else "🟢 Riapri"
+    if a2.button(stato_btn, key="lock_ct", use_container_width=True, disabled=permessi_limitati):
+        try:
+            nuovo_stato = "chiuso" if stato != "chiuso" else "aperto"
+            _aggiorna_riga("contratti", df_cli, df_ct, i, {"Stato": nuovo_stato})
+            ct.loc[i, "Stato"] = nuovo_stato
+            st.toast(f"🔁 Stato contratto aggiornato: {nuovo_stato.upper()}", icon="✅")
+            rerun_fragment()
+        except Exception as e:
+            st.error(f"❌ Errore aggiornamento stato: {e}")
+
+    # 🗑️ Elimina contratto
+    if a3.button("🗑️ Elimina", key="del_ct", use_container_width=True, disabled=permessi_limitati):
+        st.session_state["delete_ct_id"] = ct.at[i, "ContrattoID"]
+        st.session_state["ask_delete_now"] = True
+        st.rerun()
 
 
 # =====================================
@@ -1117,12 +1248,12 @@ def page_clienti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
 # =====================================
 def page_contratti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
     # FIX: sincronizza selezione cliente se arriviamo da pulsante esterno
+    model = _modello(df_cli, df_ct)
+    labels = df_cli["ClienteID"].astype(str) + " — " + df_cli["RagioneSociale"].astype(str)
     if "selected_cliente" in st.session_state:
-        selected_id = st.session_state.pop("selected_cliente")
-        df_cli["label"] = df_cli.apply(lambda r: f"{r['ClienteID']} — {r['RagioneSociale']}", axis=1)
-        label = df_cli[df_cli["ClienteID"] == selected_id]["label"].values
-        if len(label) > 0:
-            st.session_state["sel_cli_ct"] = label[0]
+        label = model.cliente_label(st.session_state.pop("selected_cliente"))
+        if label is not None:
+            st.session_state["sel_cli_ct"] = labels[label]
 
     ruolo_scrittura = st.session_state.get("ruolo_scrittura", role)
     permessi_limitati = ruolo_scrittura == "limitato"
@@ -1135,22 +1266,21 @@ def page_contratti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
         st.info("Nessun cliente presente.")
         return
 
-    labels = df_cli.apply(lambda r: f"{r['ClienteID']} — {r['RagioneSociale']}", axis=1)
     sel_label = st.selectbox("Seleziona Cliente", labels, index=0, key="sel_cli_ct")
     sel_id = sel_label.split(" — ")[0]
-    rag_soc = df_cli.loc[df_cli["ClienteID"] == sel_id, "RagioneSociale"].iloc[0]
+    rag_soc = model.cliente(sel_id)["RagioneSociale"]
 
     st.markdown(f"<h3 style='text-align:center;color:#2563eb'>{rag_soc}</h3>", unsafe_allow_html=True)
     st.caption(f"ID Cliente: {sel_id}")
 
     # === Filtra contratti del cliente ===
-    ct = df_ct[df_ct["ClienteID"].astype(str) == str(sel_id)].copy()
+    ct = df_ct.loc[model.contratti_labels(sel_id)].copy()
     if not ct.empty:
         ct = ct[
             (ct["NumeroContratto"].astype(str).str.strip() != "") |
             (ct["DescrizioneProdotto"].astype(str).str.strip() != "")
         ]
-        ct = ct.dropna(how="all").reset_index(drop=True)
+        ct = ct.dropna(how="all")
 
     # === CREA NUOVO CONTRATTO ===
     with st.expander("➕ Crea Nuovo Contratto", expanded=False):
@@ -1202,93 +1332,30 @@ def page_contratti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
                         if not num.strip() and not desc.strip():
                             st.warning("⚠️ Inserisci almeno il numero contratto o una descrizione valida.")
                         else:
-                            df_ct = pd.concat([df_ct, pd.DataFrame([nuovo])], ignore_index=True)
-                            df_ct = df_ct.dropna(how="all").reset_index(drop=True)
-                            save_contratti(df_ct)
+                            # il contratto va nel file del proprietario del cliente
+                            path = _store_contratti(df_cli, model.cliente_label(sel_id))
+                            append_contratto(path, nuovo, CONTRATTI_COLS)
+                            upload_to_mega(path)
                             st.success("✅ Contratto creato correttamente.")
                             st.rerun()
                     except Exception as e:
                         st.error(f"❌ Errore durante la creazione del contratto: {e}")
 
-    # === STILE TABELLA ===
-    st.markdown("""
-    <style>
-      .tbl-wrap{border:1px solid #e5e7eb; border-radius:12px; overflow:hidden;
-        box-shadow:0 4px 16px rgba(0,0,0,.06); background:#fff;}
-      .tbl-head{background:#2563eb; color:#fff; font-weight:700; font-size:13px;}
-      .tbl-head > div{padding:10px 8px; text-align:center; border-right:1px solid rgba(255,255,255,.25);}
-      .tbl-row{font-size:13px; border-top:1px solid #eef2f7;}
-      .tbl-row:hover{background:#f6faff;}
-      .cell{padding:8px 8px; text-align:center;}
-      .cell-left{text-align:left;}
-      .row-closed{background:#fff1f1 !important;}
-    </style>
-    """, unsafe_allow_html=True)
-
+    # === TABELLA CONTRATTI (un solo blocco HTML per pagina) ===
+    st.markdown(TABLE_CSS, unsafe_allow_html=True)
     st.markdown("### 📋 Contratti del Cliente")
 
     if ct.empty:
         st.info("Nessun contratto registrato.")
         return
 
-    # --- intestazione
-    head_cols = st.columns([0.7, 0.9, 0.9, 0.8, 2.8, 1.1, 1, 1, 0.9, 0.9, 0.9, 0.9, 1])
-    head_lbls = ["N°","Inizio","Fine","Durata","Descrizione Prodotto","Tot. Rata","NOL FIN","NOL INT","Copie B/N","Ecc. B/N","Copie Col","Ecc. Col","Azioni"]
-    for c, h in zip(head_cols, head_lbls):
-        c.markdown(f"<div class='tbl-head'><div>{h}</div></div>", unsafe_allow_html=True)
-
-    # --- righe
-    oggi = pd.Timestamp.now().normalize()
-    for i, r in ct.iterrows():
-        stato = str(r.get("Stato","aperto")).lower()
-        row_cls = "row-closed" if stato == "chiuso" else ""
-
-        cols = st.columns([0.7, 0.9, 0.9, 0.8, 2.8, 1.1, 1, 1, 0.9, 0.9, 0.9, 0.9, 1])
-        cols[0].markdown(f"<div class='tbl-row {row_cls}'><div class='cell mono'>{r.get('NumeroContratto','—')}</div></div>", unsafe_allow_html=True)
-        cols[1].markdown(f"<div class='tbl-row {row_cls}'><div class='cell mono'>{fmt_date(r.get('DataInizio'))}</div></div>", unsafe_allow_html=True)
-        cols[2].markdown(f"<div class='tbl-row {row_cls}'><div class='cell mono'>{fmt_date(r.get('DataFine'))}</div></div>", unsafe_allow_html=True)
-        cols[3].markdown(f"<div class='tbl-row {row_cls}'><div class='cell'>{safe_text(r.get('Durata',''))}</div></div>", unsafe_allow_html=True)
-        cols[4].markdown(f"<div class='tbl-row {row_cls}'><div class='cell cell-left'>{safe_text(r.get('DescrizioneProdotto',''))}</div></div>", unsafe_allow_html=True)
-        cols[5].markdown(f"<div class='tbl-row {row_cls}'><div class='cell cell-right'>{money(r.get('TotRata')) or '—'}</div></div>", unsafe_allow_html=True)
-        cols[6].markdown(f"<div class='tbl-row {row_cls}'><div class='cell mono'>{r.get('NOL_FIN','')}</div></div>", unsafe_allow_html=True)
-        cols[7].markdown(f"<div class='tbl-row {row_cls}'><div class='cell mono'>{r.get('NOL_INT','')}</div></div>", unsafe_allow_html=True)
-        cols[8].markdown(f"<div class='tbl-row {row_cls}'><div class='cell mono'>{r.get('CopieBN','')}</div></div>", unsafe_allow_html=True)
-        cols[9].markdown(f"<div class='tbl-row {row_cls}'><div class='cell mono'>{r.get('EccBN','')}</div></div>", unsafe_allow_html=True)
-        cols[10].markdown(f"<div class='tbl-row {row_cls}'><div class='cell mono'>{r.get('CopieCol','')}</div></div>", unsafe_allow_html=True)
-        cols[11].markdown(f"<div class='tbl-row {row_cls}'><div class='cell mono'>{r.get('EccCol','')}</div></div>", unsafe_allow_html=True)
-
-        # --- azioni (chiavi univoche)
-        with cols[12]:
-            b1, b2, b3 = st.columns(3)
-
-            # ✏️ Modifica contratto → apre la pagina dedicata
-            if b1.button("✏️", key=f"edit_ct_{i}", help="Modifica contratto", disabled=permessi_limitati):
-                st.session_state["edit_gidx"] = i
-                st.session_state["nav_target"] = "✏️ Modifica Contratto"
-                st.rerun()
-
-            # 🔒 Chiudi / Riapri contratto
-            stato_btn = "🔒" if stato != "chiuso" else "🟢"
-            if b2.button(stato_btn, key=f"lock_ct_{i}", help="Chiudi/Riapri contratto", disabled=permessi_limitati):
-                try:
-                    nuovo_stato = "chiuso" if stato != "chiuso" else "aperto"
-                    df_ct.loc[df_ct.index == i, "Stato"] = nuovo_stato
-                    save_contratti(df_ct)
-                    st.toast(f"🔁 Stato contratto aggiornato: {nuovo_stato.upper()}", icon="✅")
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"❌ Errore aggiornamento stato: {e}")
-
-            # 🗑️ Elimina contratto
-            if b3.button("🗑️", key=f"del_ct_{i}", help="Elimina contratto", disabled=permessi_limitati):
-                st.session_state["delete_gidx"] = i
-                st.session_state["ask_delete_now"] = True
-                st.rerun()
+    _panel_tabella_contratti(df_cli, df_ct, ct, sel_id, permessi_limitati)
 
 
     # === ELIMINAZIONE CONTRATTO ===
-    if st.session_state.get("ask_delete_now") and st.session_state.get("delete_gidx") is not None:
-        gidx = st.session_state["delete_gidx"]
+    if st.session_state.get("ask_delete_now") and st.session_state.get("delete_ct_id"):
+        cid = st.session_state["delete_ct_id"]
+        gidx = model.contratto_label(cid)
         if gidx in ct.index:
             contratto = ct.loc[gidx]
             numero = contratto.get("NumeroContratto", "Senza numero")
@@ -1296,288 +1363,61 @@ def page_contratti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
             c1, c2 = st.columns(2)
             with c1:
                 if st.button("✅ Sì, elimina", use_container_width=True):
-                    df_ct = df_ct.drop(index=gidx).copy()
-                    save_contratti(df_ct)
+                    path = _store_contratti(df_ct, gidx)
+                    delete_contratto(path, cid)
+                    upload_to_mega(path)
                     st.success("🗑️ Contratto eliminato.")
                     st.session_state.pop("ask_delete_now", None)
-                    st.session_state.pop("delete_gidx", None)
+                    st.session_state.pop("delete_ct_id", None)
                     st.rerun()
             with c2:
                 if st.button("❌ Annulla", use_container_width=True):
                     st.session_state.pop("ask_delete_now", None)
-                    st.session_state.pop("delete_gidx", None)
+                    st.session_state.pop("delete_ct_id", None)
                     st.info("Annullato.")
                     st.rerun()
 
 
-    # === ESPORTAZIONI (Excel + PDF) ===
+    # === ESPORTAZIONI (Excel + PDF): generate solo su richiesta, poi servite dalla cache ===
     st.divider()
     st.markdown("### 📤 Esportazioni")
+    with timed("contratti.esportazioni", cliente=sel_id):
+        _panel_esportazioni(ct, sel_id, rag_soc, model.version)
 
-    from datetime import datetime
-    data_export = datetime.now().strftime("%d/%m/%Y")
-
-    # === EXPORT EXCEL ===
-    cex1, cex2 = st.columns(2)
-    with cex1:
-        try:
-            from openpyxl import Workbook
-            from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
-            from openpyxl.utils import get_column_letter
-            from io import BytesIO
-
-            wb = Workbook()
-            ws = wb.active
-            ws.title = f"Contratti {rag_soc}"
-
-            # 🔹 Titolo
-            ws.merge_cells("A1:L1")
-            cell_title = ws["A1"]
-            cell_title.value = f"Contratti Cliente: {rag_soc} — Data: {data_export}"
-            cell_title.font = Font(bold=True, size=14)
-            cell_title.alignment = Alignment(horizontal="center", vertical="center")
-            ws.row_dimensions[1].height = 25
-
-            # 🔹 Intestazioni coerenti
-            headers = [
-                "N°", "Inizio", "Fine", "Durata", "Descrizione Prodotto",
-                "Tot. Rata", "NOL FIN", "NOL INT", "Copie B/N",
-                "Ecc. B/N", "Copie Col", "Ecc. Col"
-            ]
-            ws.append(headers)
-
-            yellow_fill = PatternFill(start_color="FFFDE7", end_color="FFFDE7", fill_type="solid")
-            header_font = Font(bold=True, color="000000")
-            thin_border = Border(
-                left=Side(style="thin"), right=Side(style="thin"),
-                top=Side(style="thin"), bottom=Side(style="thin")
-            )
-
-            for col_idx, header in enumerate(headers, 1):
-                c = ws.cell(row=2, column=col_idx)
-                c.fill = yellow_fill
-                c.font = header_font
-                c.alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-                c.border = thin_border
-                ws.column_dimensions[get_column_letter(col_idx)].width = 18
-
-            # 🔹 Righe dati
-            for _, r in ct.iterrows():
-                ws.append([
-                    r.get("NumeroContratto", ""),
-                    fmt_date(r.get("DataInizio")),
-                    fmt_date(r.get("DataFine")),
-                    r.get("Durata", ""),
-                    r.get("DescrizioneProdotto", ""),
-                    money(r.get("TotRata")),
-                    r.get("NOL_FIN", ""),
-                    r.get("NOL_INT", ""),
-                    r.get("CopieBN", ""),
-                    r.get("EccBN", ""),
-                    r.get("CopieCol", ""),
-                    r.get("EccCol", "")
-                ])
-
-            # 🔹 Allineamento e altezza righe dinamica
-            for row in ws.iter_rows(min_row=3, max_row=ws.max_row, min_col=1, max_col=12):
-                for cell in row:
-                    cell.alignment = Alignment(horizontal="center", vertical="top", wrap_text=True)
-                    cell.border = thin_border
-                ws.row_dimensions[row[0].row].height = 22 + (len(str(row[4].value)) // 70) * 10
-
-            bio = BytesIO()
-            wb.save(bio)
-            st.download_button(
-                "📘 Esporta Excel",
-                bio.getvalue(),
-                file_name=f"Contratti_{rag_soc}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-        except Exception as e:
-            st.error(f"Errore export Excel: {e}")
-
-        # === EXPORT PDF (centrato in pagina, A4 orizzontale, 1 pagina quando possibile) ===
-    with cex2:
-        try:
-            from fpdf import FPDF
-            import requests
-            from io import BytesIO
 
-            LOGO_URL = "https://www.shtsrl.com/template/images/logo.png"
-
-            pdf = FPDF("L", "mm", "A4")
-            # Disabilito l'autobreak per evitare pagine “vuote” solo col footer
-            pdf.set_auto_page_break(auto=False)
-            pdf.add_page()
-
-            # Margini più “grafici”
-            left_margin = 12
-            right_margin = 12
-            top_margin = 10
-            bottom_margin = 12
-            pdf.set_margins(left=left_margin, top=top_margin, right=right_margin)
-
-            page_w = pdf.w
-            usable_w = page_w - left_margin - right_margin
-
-            # === Logo SHT centrato ===
+def _panel_esportazioni(ct: pd.DataFrame, sel_id: str, rag_soc: str, version: str):
+    etichette = {"excel": ("📘", "Excel"), "pdf": ("📗", "PDF")}
+    for col, (tipo, (builder, ext, mime)) in zip(st.columns(2), FORMATI.items()):
+        icona, nome = etichette[tipo]
+        key = (sel_id, version, tipo)
+        data = EXPORT_CACHE.get(key)
+        if data is None and col.button(f"⚙️ Prepara {nome}", key=f"prep_{tipo}_{sel_id}"):
             try:
-                resp = requests.get(LOGO_URL, timeout=5)
-                if resp.status_code == 200:
-                    logo_bytes = BytesIO(resp.content)
-                    # logo di 35mm, centrato
-                    logo_w = 35
-                    x_logo = left_margin + (usable_w - logo_w) / 2.0
-                    pdf.image(logo_bytes, x=x_logo, y=8, w=logo_w)
-            except Exception:
-                pass
-
-            # Spazio sotto il logo
-            pdf.set_y(8 + 35 + 4)
-
-            # === Titolo centrato ===
-            pdf.set_font("Arial", "B", 13)
-            pdf.cell(0, 8, safe_text(f"Contratti Cliente: {rag_soc} - {data_export}"), ln=1, align="C")
-            pdf.ln(3)
-
-            # === Intestazioni + larghezze colonna ===
-            headers = [
-                "N°", "Inizio", "Fine", "Durata", "Descrizione Prodotto",
-                "Tot. Rata", "NOL FIN", "NOL INT", "Copie B/N",
-                "Ecc. B/N", "Copie Col", "Ecc. Col"
-            ]
-            # Larghezze pensate per A4 orizzontale, ma calcoliamo lo start centrato
-            col_widths = [10, 20, 20, 15, 110, 25, 20, 20, 22, 22, 22, 22]
-            table_w = sum(col_widths)
-            # Se la tabella è più larga dello spazio utile, la riduciamo in scala uniforme
-            if table_w > usable_w:
-                scale = usable_w / table_w
-                col_widths = [w * scale for w in col_widths]
-                table_w = usable_w
-
-            # X iniziale per centrare
-            start_x = left_margin + (usable_w - table_w) / 2.0
-
-            # === Header riga ===
-            pdf.set_font("Arial", "B", 9)
-            pdf.set_fill_color(255, 253, 231)
-            pdf.set_xy(start_x, pdf.get_y())
-            for h, w in zip(headers, col_widths):
-                pdf.cell(w, 8, safe_text(h), border=1, align="C", fill=True)
-            pdf.ln(8)
-
-            # === Dati ===
-            pdf.set_font("Arial", "", 8)
-            row_gap = 0  # nessun gap extra, per comprimere in una pagina quando possibile
-
-            # Altezza minima riga e gestione wrap descrizione
-            def draw_row(r):
-                nonlocal start_x
-                stato = str(r.get("Stato", "aperto")).lower()
-                is_closed = (stato == "chiuso")
-                fill_color = (255, 230, 230) if is_closed else (255, 255, 255)
-
-                row_values = [
-                    r.get("NumeroContratto", ""),
-                    fmt_date(r.get("DataInizio")),
-                    fmt_date(r.get("DataFine")),
-                    r.get("Durata", ""),
-                    safe_text(r.get("DescrizioneProdotto", "")),
-                    money(r.get("TotRata")),
-                    r.get("NOL_FIN", ""),
-                    r.get("NOL_INT", ""),
-                    r.get("CopieBN", ""),
-                    r.get("EccBN", ""),
-                    r.get("CopieCol", ""),
-                    r.get("EccCol", "")
-                ]
-
-                # Calcola quante “linee” servono per la descrizione stimando ~95 char per 110mm (scala se ridotta)
-                # Più robusto: usa la larghezza reale del font
-                pdf.set_font("Arial", "", 8)
-                desc_text = str(row_values[4])
-                desc_w = col_widths[4]
-                # stimiamo quante righe servono alla descrizione con la funzione di misura stringa
-                # dividendo in base alla larghezza disponibile
-                words = desc_text.split()
-                lines = []
-                line = ""
-                for w in words:
-                    test = (line + " " + w).strip()
-                    if pdf.get_string_width(test) <= (desc_w - 2):  # un pochino di padding
-                        line = test
-                    else:
-                        lines.append(line)
-                        line = w
-                if line:
-                    lines.append(line)
-                desc_lines = max(1, len(lines))
-
-                line_h = 5.5  # un po’ compatto per favorire “una pagina”
-                row_h = max(6, line_h * desc_lines)
-
-                # Se sforza il fondo (considero 10 mm di margine + 6 di footer)
-                bottom_limit = pdf.h - bottom_margin - 6
-                if pdf.get_y() + row_h > bottom_limit:
-                    pdf.add_page()
-                    pdf.set_xy(start_x, top_margin + 12)  # spazio per allineare con titolo mancante
-                    # re-disegno l’header su nuova pagina
-                    pdf.set_font("Arial", "B", 9)
-                    pdf.set_fill_color(255, 253, 231)
-                    for h, w in zip(headers, col_widths):
-                        pdf.cell(w, 8, safe_text(h), border=1, align="C", fill=True)
-                    pdf.ln(8)
-                    pdf.set_font("Arial", "", 8)
-
-                # Disegna la riga
-                pdf.set_fill_color(*fill_color)
-                x0 = start_x
-                y0 = pdf.get_y()
-                for idx, (val, wcol) in enumerate(zip(row_values, col_widths)):
-                    pdf.set_xy(x0, y0)
-                    if idx == 4:
-                        # descrizione: multicell con bordo, poi mi riposiziono
-                        pdf.multi_cell(wcol, line_h, safe_text(str(val)), border=1, align="L", fill=(fill_color != (255, 255, 255)))
-                        # calcola dove ripartire: max(y raggiunta, y0+row_h)
-                        y_after = pdf.get_y()
-                        # posiziona x subito dopo la colonna e ripristina y per le prossime celle
-                        pdf.set_xy(x0 + wcol, y0)
-                    else:
-                        pdf.cell(wcol, row_h, safe_text(str(val)), border=1, align="C", fill=(fill_color != (255, 255, 255)))
-                    x0 += wcol
-                pdf.ln(row_h + row_gap)
-
-            for _, r in ct.iterrows():
-                draw_row(r)
-
-            # === Footer centrato ===
-            pdf.set_text_color(100, 100, 100)
-            pdf.set_font("Arial", "I", 8)
-            pdf.set_y(pdf.h - bottom_margin)
-            pdf.cell(0, 6, safe_text("SHT S.r.l. - Tutti i diritti riservati"), 0, 0, "C")
-
-            pdf_bytes = pdf.output(dest="S").encode("latin-1", errors="replace")
-            st.download_button(
-                "📗 Esporta PDF",
-                pdf_bytes,
-                file_name=f"Contratti_{rag_soc}.pdf",
-                mime="application/pdf"
+                with timed(f"export.{tipo}", cliente=sel_id, righe=len(ct)):
+                    data = builder(rag_soc, ct)
+                EXPORT_CACHE.put(key, data)
+            except Exception as e:
+                col.error(f"Errore export {nome}: {e}")
+        if data is not None:
+            col.download_button(
+                f"{icona} Esporta {nome}",
+                data,
+                file_name=f"Contratti_{rag_soc}.{ext}",
+                mime=mime,
+                key=f"dl_{tipo}_{sel_id}",
             )
 
-        except Exception as e:
-            st.error(f"Errore export PDF: {e}")
-
 # =====================================
 # PAGINA DI MODIFICA CONTRATTO (VERSIONE CORRETTA)
 # =====================================
 def page_modifica_contratto(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
     """Pagina dedicata alla modifica di un contratto selezionato"""
-    if "edit_gidx" not in st.session_state:
+    if not st.session_state.get("edit_ct_id"):
         st.warning("⚠️ Nessun contratto selezionato per la modifica.")
         st.stop()
 
-    gidx = st.session_state["edit_gidx"]
-    if gidx not in df_ct.index:
+    gidx = _modello(df_cli, df_ct).contratto_label(st.session_state["edit_ct_id"])
+    if gidx is None:
         st.error("❌ Contratto non trovato.")
         st.stop()
 
@@ -1629,26 +1469,28 @@ def page_modifica_contratto(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str
 
         if salva:
             try:
-                df_ct.loc[gidx, [
-                    "NumeroContratto", "DataInizio", "DataFine", "Durata",
-                    "DescrizioneProdotto", "NOL_FIN", "NOL_INT", "TotRata",
-                    "CopieBN", "EccBN", "CopieCol", "EccCol", "Stato"
-                ]] = [
-                    num, fmt_date(din), fmt_date(dfi), durata, desc,
-                    nf, ni, tot, copie_bn, ecc_bn, copie_col, ecc_col, stato
-                ]
-                save_contratti(df_ct)
+                _aggiorna_riga("contratti", df_cli, df_ct, gidx, {
+                    "NumeroContratto": num, "DataInizio": fmt_date(din), "DataFine": fmt_date(dfi),
+                    "Durata": durata, "DescrizioneProdotto": desc, "NOL_FIN": nf, "NOL_INT": ni,
+                    "TotRata": tot, "CopieBN": copie_bn, "EccBN": ecc_bn, "CopieCol": copie_col,
+                    "EccCol": ecc_col, "Stato": stato,
+                })
                 st.success("✅ Contratto aggiornato con successo!")
                 time.sleep(0.5)
-                st.session_state["nav_target"] = "Contratti"
-                st.rerun()
+                _torna_ai_contratti(contratto)
             except Exception as e:
                 st.error(f"❌ Errore durante il salvataggio: {e}")
         
         if annulla:
             st.info("Operazione annullata.")
-            st.session_state["nav_target"] = "Contratti"
-            st.rerun()
+            _torna_ai_contratti(contratto)
+
+
+def _torna_ai_contratti(contratto: pd.Series):
+    st.session_state.pop("edit_ct_id", None)
+    st.session_state.update({"nav_target": "Contratti", "selected_cliente": contratto.get("ClienteID", ""),
+                             "_go_contratti_now": True})
+    st.rerun()
 
 
 # =====================================
@@ -1695,7 +1537,7 @@ def show_contract_modal(contratto, df_ct, df_cli, rag_soc):
 
         if salva:
             try:
-                idx = df_ct.index[df_ct["NumeroContratto"] == num][0]
+                idx = _modello(df_cli, df_ct).contratti_per_numero(num)[0]
                 df_ct.loc[idx, [
                     "DataInizio","Durata","DescrizioneProdotto","NOL_FIN","NOL_INT",
                     "TotRata","CopieBN","EccBN","CopieCol","EccCol","Stato"
@@ -1717,131 +1559,19 @@ def show_contract_modal(contratto, df_ct, df_cli, rag_soc):
     st.markdown("</div></div>", unsafe_allow_html=True)
 
 
-# =====================================
-# FUNZIONI DI ESPORTAZIONE (Excel + PDF)
-# =====================================
-def export_excel_contratti(df_ct, sel_id, rag_soc):
-    from openpyxl import Workbook
-    from openpyxl.styles import Alignment, Font, Border, Side, PatternFill
-    from openpyxl.utils import get_column_letter
-    from io import BytesIO
-
-    disp = df_ct[df_ct["ClienteID"].astype(str) == str(sel_id)].copy()
-    disp["DataInizio"] = disp["DataInizio"].apply(fmt_date)
-    disp["DataFine"] = disp["DataFine"].apply(fmt_date)
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"Contratti {rag_soc}"
-    ws.merge_cells("A1:M1")
-    title = ws["A1"]
-    title.value = f"Contratti Cliente: {rag_soc}"
-    title.font = Font(size=14, bold=True, color="2563EB")
-    title.alignment = Alignment(horizontal="center")
-
-    headers = ["NumeroContratto", "DataInizio", "DataFine", "Durata", "DescrizioneProdotto",
-               "NOL_FIN", "NOL_INT", "TotRata", "CopieBN", "EccBN", "CopieCol", "EccCol", "Stato"]
-    ws.append(headers)
-
-    head_font = Font(bold=True, color="FFFFFF")
-    head_fill = PatternFill("solid", fgColor="2563EB")
-    center = Alignment(horizontal="center", wrap_text=True)
-    thin = Border(left=Side(style="thin"), right=Side(style="thin"), top=Side(style="thin"), bottom=Side(style="thin"))
-
-    for i, h in enumerate(headers, 1):
-        c = ws.cell(row=2, column=i)
-        c.font = head_font; c.fill = head_fill; c.alignment = center; c.border = thin
-
-    for _, row in disp.iterrows():
-        ws.append([str(row.get(h, "")) for h in headers])
-        stato = str(row.get("Stato", "")).lower()
-        r_idx = ws.max_row
-        for j in range(1, len(headers)+1):
-            cell = ws.cell(row=r_idx, column=j)
-            cell.alignment = center
-            cell.border = thin
-            if stato == "chiuso":
-                cell.fill = PatternFill("solid", fgColor="FFCDD2")
-
-    for i in range(1, len(headers)+1):
-        ws.column_dimensions[get_column_letter(i)].width = 25
-
-    bio = BytesIO()
-    wb.save(bio)
-    return bio.getvalue()
-
-
-def export_pdf_contratti(df_ct, sel_id, rag_soc):
-    from fpdf import FPDF
-    disp = df_ct[df_ct["ClienteID"].astype(str) == str(sel_id)].copy()
-    disp["DataInizio"] = disp["DataInizio"].apply(fmt_date)
-    disp["DataFine"] = disp["DataFine"].apply(fmt_date)
-    headers = ["NumeroContratto", "DataInizio", "DataFine", "Durata", "TotRata", "Stato"]
-    widths = [30, 25, 25, 15, 25, 20]
-
-    pdf = FPDF(orientation="L", unit="mm", format="A4")
-    pdf.add_page()
-    pdf.set_font("Arial", "B", 14)
-    pdf.cell(0, 10, safe_text(f"Contratti Cliente: {rag_soc}"), ln=1, align="C")
-    pdf.set_font("Arial", "B", 10)
-    for i, h in enumerate(headers):
-        pdf.cell(widths[i], 8, safe_text(h), 1, 0, "C", True)
-    pdf.ln()
-    pdf.set_font("Arial", "", 9)
-    for _, r in disp.iterrows():
-        for i, h in enumerate(headers):
-            stato = str(r.get("Stato", "")).lower()
-            if stato == "chiuso":
-                pdf.set_fill_color(255, 235, 238)
-                pdf.cell(widths[i], 7, safe_text(r.get(h, "")), 1, 0, "C", fill=True)
-            else:
-                pdf.cell(widths[i], 7, safe_text(r.get(h, "")), 1, 0, "C")
-        pdf.ln()
-    return pdf.output(dest="S").encode("latin-1", errors="replace")
 # =====================================
 # 📈 DASHBOARD GRAFICI — priva di dipendenze extra
 # =====================================
-def _to_dt(s):
-    return pd.to_datetime(s, errors="coerce", dayfirst=True)
-
-def _to_float_eur(x):
-    """Converte '1.234,56' o '1234.56 €' → 1234.56 (float). Vuoto se non numerico."""
-    if pd.isna(x): return None
-    t = str(x).strip()
-    if not t: return None
-    # rimuovi simboli e spazi, normalizza separatori
-    t = t.replace("€", "").replace("EUR", "").replace(" ", "")
-    # se formato italiano 1.234,56 → togli i punti mille e cambia la virgola
-    if "," in t and t.count(",") == 1 and "." in t:
-        t = t.replace(".", "").replace(",", ".")
-    elif "," in t and t.count(",") == 1 and "." not in t:
-        t = t.replace(",", ".")
-    try:
-        return float(t)
-    except Exception:
-        try:
-            return float(pd.to_numeric(t, errors="coerce"))
-        except Exception:
-            return None
-
 def page_dashboard_grafici(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
     st.image(LOGO_URL, width=120)
     st.markdown("<h2>📈 Dashboard Grafici</h2>", unsafe_allow_html=True)
     st.caption("Panoramica interattiva su clienti e contratti (filtri in alto).")
     st.divider()
 
-    # ======== PREPARAZIONE DATI ========
-    base = df_ct.copy()
-    base["DataInizio"] = _to_dt(base["DataInizio"])
-    base["DataFine"] = _to_dt(base["DataFine"])
-    base["Stato"] = base["Stato"].astype(str).str.lower().fillna("")
-    base["Durata"] = pd.to_numeric(base["Durata"], errors="coerce")
-    base["TotRataNum"] = base["TotRata"].apply(_to_float_eur)
-
-    # Join TMK dal dataframe clienti (per filtro e grafici per TMK)
-    cli_tmk = df_cli[["ClienteID", "RagioneSociale", "TMK"]].copy()
-    base = base.merge(cli_tmk, on="ClienteID", how="left", suffixes=("", "_cli"))
-    base["TMK"] = base["TMK"].fillna("")
+    # ======== PREPARAZIONE DATI (cubo per mese/Stato/TMK/Città/CAP/Durata, una volta per versione dati) ========
+    model = _modello(df_cli, df_ct)
+    cubo = model.cubo()
+    vista = model.contratti_view()
 
     today = pd.Timestamp.now().normalize()
     start_12m = (today - pd.DateOffset(months=12)).replace(day=1)
@@ -1861,39 +1591,29 @@ def page_dashboard_grafici(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str)
             default=["aperto", ""]  # di default mostro attivi + vuoti
         )
     with f3:
-        tmk_opts = ["Tutti"] + sorted([t for t in base["TMK"].dropna().unique().tolist() if t])
+        tmk_opts = ["Tutti"] + sorted([t for t in cubo.celle["TMK"].unique().tolist() if t])
         tmk_sel = st.selectbox("TMK", options=tmk_opts, index=0)
     with f4:
         solo_con_num = st.checkbox("Solo contratti con N°", value=False)
 
-    df = base.copy()
-    # Periodo → filtro su DataInizio (quando disponibile)
-    if periodo == "Ultimi 12 mesi":
-        df = df[(df["DataInizio"].isna()) | (df["DataInizio"] >= start_12m)]
-    elif periodo == "Anno Corrente":
-        df = df[(df["DataInizio"].isna()) | (df["DataInizio"] >= pd.Timestamp(today.year, 1, 1))]
-
-    # Stato
-    if stato_sel:
-        df = df[df["Stato"].isin(stato_sel)]
-
-    # TMK
-    if tmk_sel != "Tutti":
-        df = df[df["TMK"] == tmk_sel]
-
-    # Solo con numero contratto
-    if solo_con_num:
-        df = df[df["NumeroContratto"].astype(str).str.strip() != ""]
+    # Periodo → filtro su DataInizio (quando disponibile): i limiti sono inizi mese, il mese basta
+    inizio_da = {"Ultimi 12 mesi": start_12m, "Anno Corrente": pd.Timestamp(today.year, 1, 1)}.get(periodo)
+    df = cubo.filtra(
+        inizio_da=inizio_da,
+        stati=stato_sel,
+        tmk=None if tmk_sel == "Tutti" else tmk_sel,
+        solo_con_num=solo_con_num,
+    )
 
     # ======== KPI PRINCIPALI ========
     k1, k2, k3, k4, k5 = st.columns(5)
     tot_clienti = df_cli["ClienteID"].nunique()
-    attivi = int((df["Stato"] != "chiuso").sum())
-    chiusi = int((df["Stato"] == "chiuso").sum())
+    attivi = int(cubo.totale(df, where=df["Stato"] != "chiuso"))
+    chiusi = int(cubo.totale(df, where=df["Stato"] == "chiuso"))
     ytd_start = pd.Timestamp(today.year, 1, 1)
-    nuovi_ytd = int(((df["DataInizio"] >= ytd_start) & df["DataInizio"].notna()).sum())
-    somma_rata = df["TotRataNum"].dropna().sum()
-    somma_rata_fmt = f"{somma_rata:,.2f} €".replace(",", "X").replace(".", ",").replace("X", ".")
+    nuovi_ytd = int(cubo.totale(df, where=df["MeseInizio"] >= ytd_start))
+    somma_rata = cubo.totale(df, "rata")
+    somma_rata_fmt = euro(somma_rata)
 
     k1.metric("Clienti totali", f"{tot_clienti}")
     k2.metric("Contratti attivi", f"{attivi}")
@@ -1905,12 +1625,10 @@ def page_dashboard_grafici(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str)
 
     # ======== KPI GEOGRAFICI ========
     g1, g2, g3 = st.columns(3)
-    # Città uniche
-    citta_uniche = df_cli["Citta"].dropna().astype(str).str.strip().replace("", pd.NA).dropna().nunique()
-    # CAP / Paesi unici (usiamo CAP come “paese” nel tuo dataset)
-    cap_unici = df_cli["CAP"].dropna().astype(str).str.strip().replace("", pd.NA).dropna().nunique()
-    # TMK unici (utile per capire la distribuzione commerciale)
-    tmk_unici = df_cli["TMK"].dropna().astype(str).str.strip().replace("", pd.NA).dropna().nunique()
+    # Città / CAP (usiamo CAP come “paese” nel tuo dataset) / TMK unici: clienti distinti già contati nel cubo
+    citta_uniche = len(cubo.geo["Citta"])
+    cap_unici = len(cubo.geo["CAP"])
+    tmk_unici = len(cubo.geo["TMK"])
 
     g1.metric("🌆 Città servite", f"{citta_uniche}")
     g2.metric("🏘️ CAP / Paesi", f"{cap_unici}")
@@ -1921,16 +1639,6 @@ def page_dashboard_grafici(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str)
         # ======== GRAFICI GEOGRAFICI ========
     st.markdown("### 🗺️ Distribuzione geografica clienti")
 
-    # Normalizzazione leggera campi (evita vuoti e differenze di spazi/maiuscole)
-    geo = df_cli[["ClienteID", "RagioneSociale", "Citta", "CAP", "TMK"]].copy()
-    for col in ["Citta", "CAP", "TMK"]:
-        geo[col] = (
-            geo[col]
-            .fillna("")
-            .astype(str)
-            .str.strip()
-        )
-
     # Opzioni di visualizzazione
     col_cfg1, col_cfg2, col_cfg3 = st.columns([1.2, 1.2, 1.2])
     with col_cfg1:
@@ -1942,13 +1650,7 @@ def page_dashboard_grafici(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str)
 
     # -------- Città --------
     st.markdown("#### 🌆 Clienti per Città")
-    città_counts = (
-        geo[geo["Citta"] != ""]
-        .groupby("Citta")["ClienteID"].nunique()
-        .sort_values(ascending=False)
-        .rename("Clienti")
-        .to_frame()
-    )
+    città_counts = cubo.geo["Citta"].to_frame()
 
     if città_counts.empty:
         st.info("Nessuna città disponibile nei dati clienti.")
@@ -1980,13 +1682,7 @@ def page_dashboard_grafici(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str)
 
     # -------- CAP --------
     st.markdown("#### 🏘️ Clienti per CAP")
-    cap_counts = (
-        geo[geo["CAP"] != ""]
-        .groupby("CAP")["ClienteID"].nunique()
-        .sort_values(ascending=False)
-        .rename("Clienti")
-        .to_frame()
-    )
+    cap_counts = cubo.geo["CAP"].to_frame()
 
     if cap_counts.empty:
         st.info("Nessun CAP disponibile nei dati clienti.")
@@ -2013,12 +1709,8 @@ def page_dashboard_grafici(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str)
 
     # ======== GRAFICO: nuovi contratti ultimi 12 mesi ========
     st.markdown("#### 📈 Nuovi contratti (ultimi 12 mesi)")
-    df_m = base.copy()
-    df_m = df_m[(df_m["DataInizio"] >= start_12m) & df_m["DataInizio"].notna()]
     serie = (
-        df_m
-        .assign(Mese=lambda x: x["DataInizio"].dt.to_period("M").dt.to_timestamp())
-        .groupby("Mese")["NumeroContratto"].count()
+        cubo.per(cubo.celle[cubo.celle["MeseInizio"] >= start_12m], "MeseInizio")
         .reindex(pd.period_range(start=start_12m, end=today, freq="M").to_timestamp(), fill_value=0)
         .rename("NuoviContratti")
         .to_frame()
@@ -2028,48 +1720,45 @@ def page_dashboard_grafici(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str)
     # ======== GRAFICO: scadenze prossimi 6 mesi ========
     st.markdown("#### 📅 Scadenze nei prossimi 6 mesi")
     entro6 = today + pd.DateOffset(months=6)
-    scad = base.copy()
-    scad = scad[
-        (scad["DataFine"].notna()) &
-        (scad["DataFine"] >= today) &
-        (scad["DataFine"] <= entro6) &
-        (scad["Stato"] != "chiuso")
-    ]
+    scad = vista.loc[model.scadenze().window(today, entro6)]   # finestra al giorno: indice, non cubo mensile
     if scad.empty:
         st.info("Nessun contratto in scadenza nei prossimi 6 mesi.")
     else:
         serie_s = (
             scad
-            .assign(Mese=lambda x: x["DataFine"].dt.to_period("M").dt.to_timestamp())
+            .assign(Mese=lambda x: x["DataFine_dt"].dt.to_period("M").dt.to_timestamp())
             .groupby("Mese")["NumeroContratto"].count()
             .rename("Scadenze")
             .to_frame()
         )
         st.bar_chart(serie_s, use_container_width=True)
 
-    # ======== GRAFICO: somma rata per mese (rolling 12) ========
-    st.markdown("#### 💰 Totale rata per mese (contratti filtrati)")
-    df_r = df.copy()
-    if df_r["DataInizio"].notna().any():
-        # Costruiamo una serie per mese sul range coperto dal filtro
-        start_range = (df_r["DataInizio"].min() or today).to_period("M").to_timestamp() if df_r["DataInizio"].notna().any() else start_12m
-        end_range = today
-        # Consideriamo la rata come “rilevata” al mese di DataInizio (indicativo)
-        serie_r = (
-            df_r[df_r["DataInizio"].notna()]
-            .assign(Mese=lambda x: x["DataInizio"].dt.to_period("M").dt.to_timestamp())
-            .groupby("Mese")["TotRataNum"].sum()
-            .reindex(pd.period_range(start=start_range, end=end_range, freq="M").to_timestamp(), fill_value=0.0)
-            .rename("TotRata")
-            .to_frame()
-        )
+    # ======== GRAFICO: MRR (rata distribuita su tutta la durata) + proiezione ========
+    st.markdown("#### 💰 Rata mensile ricorrente (MRR) per mese (contratti filtrati)")
+    mrr = model.mrr()
+    m1, m2 = st.columns([1.2, 2.4])
+    per = m1.selectbox("Suddivisione", ["Totale", "TMK", "Città", "Proprietario"], key="mrr_per")
+    m2.caption(f"Ogni contratto conta la sua rata in tutti i mesi da DataInizio a DataFine (o Durata); "
+               f"proiezione a {ORIZZONTE_MESI} mesi sui contratti in essere.")
+    # stessi filtri del cubo; il periodo sceglie da dove parte la curva
+    mask = mrr.maschera(stati=stato_sel, tmk=None if tmk_sel == "Tutti" else tmk_sel, solo_con_num=solo_con_num)
+    if mask.any():
+        with timed("grafici.mrr", per=per, contratti=int(mask.sum())):
+            serie_r = mrr.serie(inizio_da if inizio_da is not None else pd.Timestamp(mrr.inizio[mask].min() // 12, 1, 1),
+                                per=None if per == "Totale" else per, mask=mask)
         st.area_chart(serie_r, use_container_width=True)
+        oggi_m = today.replace(day=1)
+        mrr_oggi = serie_r.sum(axis=1).get(oggi_m, 0.0)
+        mrr_12 = serie_r.sum(axis=1).get(oggi_m + pd.DateOffset(months=12), 0.0)
+        c_mrr1, c_mrr2 = st.columns(2)
+        c_mrr1.metric("MRR mese corrente", euro(mrr_oggi))
+        c_mrr2.metric("MRR tra 12 mesi (contratti in essere)", euro(mrr_12), delta=euro(mrr_12 - mrr_oggi))
     else:
-        st.info("Dati mese non sufficienti per costruire la serie della rata.")
+        st.info("Nessun contratto con date e rata per costruire l'MRR.")
 
     # ======== GRAFICO: contratti per TMK ========
     st.markdown("#### 👩‍💼 Contratti per TMK (filtrati)")
-    by_tmk = df.groupby("TMK")["NumeroContratto"].count().sort_values(ascending=False)
+    by_tmk = cubo.per(df, "TMK").sort_values(ascending=False)
     if by_tmk.empty:
         st.info("Nessun dato TMK per i contratti filtrati.")
     else:
@@ -2077,36 +1766,72 @@ def page_dashboard_grafici(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str)
 
     # ======== GRAFICO: distribuzione durate ========
     st.markdown("#### ⏳ Durata contratti (mesi)")
-    durata_counts = df["Durata"].dropna().astype(int, errors="ignore")
+    durata_counts = cubo.per(df, "Durata")
     if durata_counts.empty:
         st.info("Nessuna durata disponibile nei contratti filtrati.")
     else:
-        dur_tab = durata_counts.value_counts().sort_index().rename("Contratti").to_frame()
+        durata_counts.index = durata_counts.index.astype(int)
+        dur_tab = durata_counts.sort_index().rename("Contratti").to_frame()
         st.bar_chart(dur_tab, use_container_width=True)
 
     st.divider()
 
+    # ======== RINNOVI E ABBANDONI (catene di contratti per cliente, tutti i contratti) ========
+    st.markdown("### 🔁 Rinnovi e abbandoni")
+    with timed("grafici.rinnovi"):
+        rinnovi = model.rinnovi()
+        kpi = rinnovi.kpi()
+    st.caption(f"Un contratto è rinnovato se lo stesso cliente ne inizia un altro entro {TOLLERANZA_GIORNI} giorni "
+               f"dalla fine (o fino a {ANTICIPO_GIORNI} giorni prima). Cliente perso = nessuna catena ancora attiva.")
+    r1, r2, r3, r4 = st.columns(4)
+    r1.metric("Tasso di rinnovo", f"{kpi['tasso_rinnovo']:.0%}" if kpi["decisi"] else "—",
+              help=f"{kpi['rinnovati']} rinnovati su {kpi['decisi']} contratti con finestra di rinnovo chiusa")
+    r2.metric("Clienti persi (churn)", f"{kpi['clienti_persi']}",
+              delta=f"{kpi['churn_clienti']:.0%} dei clienti" if kpi["clienti"] else None, delta_color="inverse")
+    r3.metric("Gap mediano rinnovo", f"{kpi['gap_mediano']:.0f} gg" if pd.notna(kpi["gap_mediano"]) else "—")
+    r4.metric("Contratti per catena", f"{kpi['catena_media']:.2f}" if pd.notna(kpi["catena_media"]) else "—")
+
+    tr1, tr2, tr3 = st.tabs(["Per TMK", "Coorti (ritenzione)", "Gap fine → nuovo inizio"])
+    with tr1:
+        st.dataframe(rinnovi.per_tmk(), use_container_width=True)
+    with tr2:
+        per_coorte = st.radio("Coorti per", ["Anno di inizio", "Anno e TMK"], horizontal=True, key="coorti_per")
+        st.dataframe(rinnovi.coorti("TMK" if per_coorte == "Anno e TMK" else None), use_container_width=True)
+        st.caption("% di catene ancora attive dopo N anni dall'inizio (solo catene abbastanza vecchie da osservarlo).")
+    with tr3:
+        gap = rinnovi.gap()
+        gap.index = gap.index.astype(str)
+        st.bar_chart(gap, use_container_width=True)
+
+    st.divider()
+
     # ======== ANOMALIE E QUALITÀ DATI ========
     st.markdown("#### 🧪 Controlli qualità dati")
-    colA, colB, colC = st.columns(3)
+    colA, colB, colC, colD = st.columns(4)
 
-    senza_fine = df[(df["DataInizio"].notna()) & (df["DataFine"].isna())]
-    colA.metric("Senza DataFine (filtrati)", f"{len(senza_fine)}")
+    # conteggi dalle celle; le righe di dettaglio si prendono dalla vista solo per le celle anomale
+    senza_fine = df[df["SenzaFine"]]
+    colA.metric("Senza DataFine (filtrati)", f"{int(cubo.totale(senza_fine))}")
 
-    fine_prima = df[(df["DataInizio"].notna()) & (df["DataFine"].notna()) & (df["DataFine"] < df["DataInizio"])]
-    colB.metric("DataFine < DataInizio", f"{len(fine_prima)}")
+    fine_prima = df[df["FinePrima"]]
+    colB.metric("DataFine < DataInizio", f"{int(cubo.totale(fine_prima))}")
 
-    zero_rata = df[df["TotRataNum"].fillna(0) <= 0]
-    colC.metric("TotRata nulla/assente", f"{len(zero_rata)}")
+    zero_rata = df[df["RataZero"]]
+    colC.metric("TotRata nulla/assente", f"{int(cubo.totale(zero_rata))}")
+
+    importi_ko = model.importi_non_validi()   # su tutti i contratti, non solo i filtrati
+    colD.metric("Importi non numerici", f"{len(importi_ko)}")
 
     with st.expander("📋 Apri liste anomalie"):
-        t1, t2, t3 = st.tabs(["Senza DataFine", "Fine < Inizio", "Rata nulla/assente"])
+        t1, t2, t3, t4 = st.tabs(["Senza DataFine", "Fine < Inizio", "Rata nulla/assente", "Importi non numerici"])
         with t1:
-            st.dataframe(senza_fine[["ClienteID", "RagioneSociale", "NumeroContratto", "DataInizio", "DataFine", "TMK"]], use_container_width=True)
+            st.dataframe(vista.loc[cubo.righe(senza_fine), ["ClienteID", "RagioneSociale", "NumeroContratto", "DataInizio", "DataFine", "TMK"]], use_container_width=True)
         with t2:
-            st.dataframe(fine_prima[["ClienteID", "RagioneSociale", "NumeroContratto", "DataInizio", "DataFine", "TMK"]], use_container_width=True)
+            st.dataframe(vista.loc[cubo.righe(fine_prima), ["ClienteID", "RagioneSociale", "NumeroContratto", "DataInizio", "DataFine", "TMK"]], use_container_width=True)
         with t3:
-            st.dataframe(zero_rata[["ClienteID", "RagioneSociale", "NumeroContratto", "TotRata", "TMK"]], use_container_width=True)
+            st.dataframe(vista.loc[cubo.righe(zero_rata), ["ClienteID", "RagioneSociale", "NumeroContratto", "TotRata", "TMK"]], use_container_width=True)
+        with t4:
+            st.dataframe(importi_ko, use_container_width=True)
 
     st.caption("Suggerimento: usa i filtri in alto per affinare i grafici e i controlli.")
 
@@ -2118,97 +1843,96 @@ def page_richiami_visite(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
     st.markdown("<h2>📅 Gestione Recall e Visite</h2>", unsafe_allow_html=True)
     st.divider()
 
-    col1, col2 = st.columns(2)
+    model = _modello(df_cli, df_ct)
+    agenda = model.agenda()   # prossimi recall/visite (default +3 / +6 mesi) per TMK
+
+    col1, col2, col3, col4 = st.columns([1.5, 1.5, 1, 1.3])
     filtro_nome = col1.text_input("🔍 Cerca per nome cliente")
     filtro_citta = col2.text_input("🏙️ Cerca per città")
+    tmk_sel = col3.selectbox("👩‍💼 TMK", ["Tutti"] + agenda.tmk_list(), key="agenda_tmk")
+    periodo = col4.radio("Periodo", ["Questa settimana", "Prossimi 30 giorni"], index=1, horizontal=True, key="agenda_periodo")
+    tmk = None if tmk_sel == "Tutti" else tmk_sel
 
-    df = df_cli.copy()
+    labels = model.clienti.index
     if filtro_nome:
-        df = df[df["RagioneSociale"].str.contains(filtro_nome, case=False, na=False)]
+        labels = labels.intersection(pd.Index(cerca_clienti(model, filtro_nome, fields=["RagioneSociale"])), sort=False)
     if filtro_citta:
-        df = df[df["Citta"].str.contains(filtro_citta, case=False, na=False)]
-    if df.empty:
+        labels = labels.intersection(pd.Index(cerca_clienti(model, filtro_citta, fields=["Citta"])), sort=False)
+    if tmk:
+        labels = labels[model.clienti.loc[labels, "TMK"] == tmk]
+    if labels.empty:
         st.warning("❌ Nessun cliente trovato.")
         return
+    filtrati = len(labels) < len(model.clienti)
 
-    oggi = pd.Timestamp.now().normalize()
-    for c in ["UltimoRecall", "ProssimoRecall", "UltimaVisita", "ProssimaVisita"]:
-        df[c] = pd.to_datetime(df[c], errors="coerce", dayfirst=True)
+    def _eventi(start, end, tipi=("recall", "visita")):
+        ev = agenda.eventi(tmk, start, end, tipi)
+        return ev[ev["_label"].isin(labels)] if filtrati else ev
+
+    def _apri(r, prefix):
+        if st.button("📂 Apri", key=f"{prefix}_{r['Tipo']}_{r['_label']}", use_container_width=True):
+            st.session_state.update({
+                "selected_cliente": r["ClienteID"],
+                "nav_target": "Clienti",
+                "_go_clienti_now": True
+            })
+            st.rerun()
 
-    # === Imminenti (entro 30 giorni) ===
-    st.markdown("### 🔔 Recall e Visite imminenti (entro 30 giorni)")
-    imminenti = df[
-        (df["ProssimoRecall"].between(oggi, oggi + pd.DateOffset(days=30))) |
-        (df["ProssimaVisita"].between(oggi, oggi + pd.DateOffset(days=30)))
-    ]
+    oggi = pd.Timestamp.now().normalize()
+    fine = oggi + pd.Timedelta(days=6 - oggi.weekday()) if periodo == "Questa settimana" else oggi + pd.DateOffset(days=30)
+    icone = {"recall": "📞 Recall", "visita": "👣 Visita"}
 
+    # === In agenda nel periodo ===
+    st.markdown(f"### 🔔 Recall e Visite in agenda ({periodo.lower()})")
+    imminenti = _eventi(oggi, fine)
     if imminenti.empty:
-        st.success("✅ Nessun richiamo o visita imminente.")
+        st.success("✅ Nessun richiamo o visita in agenda.")
     else:
-        for i, r in imminenti.iterrows():
-            c1, c2, c3, c4 = st.columns([2, 1, 1, 0.7])
+        for _, r in imminenti.iterrows():
+            c1, c2, c3, c4, c5 = st.columns([2, 1, 1, 1, 0.7])
             c1.markdown(f"**{r['RagioneSociale']}**")
-            c2.markdown(fmt_date(r["ProssimoRecall"]))
-            c3.markdown(fmt_date(r["ProssimaVisita"]))
-            if c4.button("📂 Apri", key=f"imm_{i}", use_container_width=True):
-                st.session_state.update({
-                    "selected_cliente": r["ClienteID"],
-                    "nav_target": "Clienti",
-                    "_go_clienti_now": True
-                })
-                st.rerun()
+            c2.markdown(icone[r["Tipo"]])
+            c3.markdown(r["Data"].strftime("%d/%m/%Y"))
+            c4.markdown(r["TMK"] or "—")
+            with c5:
+                _apri(r, "imm")
+
+    st.download_button(
+        f"📆 Esporta calendario {tmk_sel} (.ics, prossimi 12 mesi)",
+        data=ical(_eventi(oggi, oggi + pd.DateOffset(months=12)), nome=f"CRM SHT – {tmk_sel}"),
+        file_name=f"agenda_{(tmk or 'tutti').lower()}.ics",
+        mime="text/calendar",
+        key="agenda_ics",
+    )
 
     st.divider()
 
-    # === Recall e visite in ritardo ===
+    # === Recall e visite in ritardo (prossima data effettiva già passata) ===
     st.markdown("### ⚠️ Recall e Visite scaduti")
-    recall_vecchi = df[
-        df["UltimoRecall"].notna() & (df["UltimoRecall"] < oggi - pd.DateOffset(months=3))
-    ]
-    visite_vecchie = df[
-        df["UltimaVisita"].notna() & (df["UltimaVisita"] < oggi - pd.DateOffset(months=6))
-    ]
-
+    ieri = oggi - pd.Timedelta(days=1)
     col1, col2 = st.columns(2)
-    with col1:
-        st.markdown("#### 📞 Recall > 3 mesi fa")
-        if recall_vecchi.empty:
-            st.info("✅ Nessun recall scaduto.")
-        else:
-            for i, r in recall_vecchi.iterrows():
-                c1, c2, c3 = st.columns([2.5, 1.2, 0.8])
-                c1.markdown(f"**{r['RagioneSociale']}**")
-                c2.markdown(fmt_date(r["UltimoRecall"]))
-                if c3.button("📂 Apri", key=f"rec_{i}", use_container_width=True):
-                    st.session_state.update({
-                        "selected_cliente": r["ClienteID"],
-                        "nav_target": "Clienti",
-                        "_go_clienti_now": True
-                    })
-                    st.rerun()
-
-    with col2:
-        st.markdown("#### 👣 Visite > 6 mesi fa")
-        if visite_vecchie.empty:
-            st.info("✅ Nessuna visita scaduta.")
-        else:
-            for i, r in visite_vecchie.iterrows():
+    for col, tipo, titolo, vuoto in (
+        (col1, "recall", f"#### 📞 Recall scaduti (default: ultimo + {RECALL_MESI} mesi)", "✅ Nessun recall scaduto."),
+        (col2, "visita", f"#### 👣 Visite scadute (default: ultima + {VISITA_MESI} mesi)", "✅ Nessuna visita scaduta."),
+    ):
+        with col:
+            st.markdown(titolo)
+            scaduti = _eventi(None, ieri, (tipo,))
+            if scaduti.empty:
+                st.info(vuoto)
+            for _, r in scaduti.iterrows():
                 c1, c2, c3 = st.columns([2.5, 1.2, 0.8])
                 c1.markdown(f"**{r['RagioneSociale']}**")
-                c2.markdown(fmt_date(r["UltimaVisita"]))
-                if c3.button("📂 Apri", key=f"vis_{i}", use_container_width=True):
-                    st.session_state.update({
-                        "selected_cliente": r["ClienteID"],
-                        "nav_target": "Clienti",
-                        "_go_clienti_now": True
-                    })
-                    st.rerun()
+                c2.markdown(r["Data"].strftime("%d/%m/%Y"))
+                with c3:
+                    _apri(r, "scad")
 
     st.divider()
     st.markdown("### 🧾 Storico Recall e Visite")
-    tabella = df[["RagioneSociale", "UltimoRecall", "ProssimoRecall", "UltimaVisita", "ProssimaVisita"]].copy()
+    cli = model.clienti.loc[labels]
+    tabella = pd.DataFrame({"RagioneSociale": cli["RagioneSociale"]})
     for c in ["UltimoRecall", "ProssimoRecall", "UltimaVisita", "ProssimaVisita"]:
-        tabella[c] = tabella[c].apply(fmt_date)
+        tabella[c] = cli[f"{c}_dt"].dt.strftime("%d/%m/%Y").fillna("")
     st.dataframe(tabella, use_container_width=True, hide_index=True)
 
 
@@ -2220,39 +1944,9 @@ def page_lista_clienti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
     st.title("📋 Lista Completa Clienti e Scadenze Contratti")
     oggi = pd.Timestamp.now().normalize()
 
-    # === Prepara i dati contratti ===
-    df_ct = df_ct.copy()
-    df_ct["DataFine"] = pd.to_datetime(df_ct["DataFine"], errors="coerce", dayfirst=True)
-    df_ct["Stato"] = df_ct["Stato"].astype(str).str.lower().fillna("")
-    attivi = df_ct[df_ct["Stato"] != "chiuso"]
-
-    # === Calcola la prima scadenza per ogni cliente ===
-    prime_scadenze = (
-        attivi.groupby("ClienteID")["DataFine"]
-        .min()
-        .reset_index()
-        .rename(columns={"DataFine": "PrimaScadenza"})
-    )
-
-    merged = df_cli.merge(prime_scadenze, on="ClienteID", how="left")
-    merged["GiorniMancanti"] = (merged["PrimaScadenza"] - oggi).dt.days
-
-    # === Badge colorati per scadenza ===
-    def badge_scadenza(row):
-        if pd.isna(row["PrimaScadenza"]):
-            return "<span style='color:#999;'>⚪ Nessuna</span>"
-        giorni = row["GiorniMancanti"]
-        data_fmt = fmt_date(row["PrimaScadenza"])
-        if giorni < 0:
-            return f"<span style='color:#757575;font-weight:600;'>⚫ Scaduto ({data_fmt})</span>"
-        elif giorni <= 30:
-            return f"<span style='color:#d32f2f;font-weight:600;'>🔴 {data_fmt}</span>"
-        elif giorni <= 90:
-            return f"<span style='color:#f9a825;font-weight:600;'>🟡 {data_fmt}</span>"
-        else:
-            return f"<span style='color:#388e3c;font-weight:600;'>🟢 {data_fmt}</span>"
-
-    merged["ScadenzaBadge"] = merged.apply(badge_scadenza, axis=1)
+    # === Prima scadenza per cliente (aggregati materializzati del modello) ===
+    model = _modello(df_cli, df_ct)
+    merged = model.aggregati().clienti()
 
     # === FILTRI PRINCIPALI ===
     st.markdown("### 🔍 Filtri")
@@ -2265,24 +1959,29 @@ def page_lista_clienti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
     data_da = col4.date_input("Da data scadenza:", value=None, format="DD/MM/YYYY")
     data_a = col5.date_input("A data scadenza:", value=None, format="DD/MM/YYYY")
 
-    # === Applica filtri ===
+    # === Applica filtri (maschera unica sul modello) ===
+    mask = pd.Series(True, index=merged.index)
     if filtro_nome:
-        merged = merged[merged["RagioneSociale"].str.contains(filtro_nome, case=False, na=False)]
+        mask &= merged.index.isin(cerca_clienti(model, filtro_nome, fields=["RagioneSociale"]))
     if filtro_citta:
-        merged = merged[merged["Citta"].str.contains(filtro_citta, case=False, na=False)]
+        mask &= merged.index.isin(cerca_clienti(model, filtro_citta, fields=["Citta"]))
     if filtro_tmk != "Tutti":
-        merged = merged[merged["TMK"] == filtro_tmk]
-    if data_da:
-        merged = merged[merged["PrimaScadenza"] >= pd.Timestamp(data_da)]
-    if data_a:
-        merged = merged[merged["PrimaScadenza"] <= pd.Timestamp(data_a)]
+        mask &= merged["TMK"] == filtro_tmk
+    if data_da or data_a:
+        # finestra sull'indice ordinato delle prime scadenze (searchsorted, niente scansione)
+        cids = model.aggregati().indice_scadenze().window(data_da, pd.Timestamp(data_a) if data_a else None)
+        mask &= merged["_cid"].isin(cids)
+    merged = merged[mask]
+
+    # === Badge scadenza (vettorizzato) ===
+    giorni, livello, badge = scadenza_badge(merged["PrimaScadenza"], oggi)
 
     # === RIEPILOGO NUMERICO ===
     total_clienti = len(merged)
-    entro_30 = (merged["GiorniMancanti"] <= 30).sum()
-    entro_90 = ((merged["GiorniMancanti"] > 30) & (merged["GiorniMancanti"] <= 90)).sum()
-    oltre_90 = (merged["GiorniMancanti"] > 90).sum()
-    scaduti = (merged["GiorniMancanti"] < 0).sum()
+    entro_30 = (giorni <= 30).sum()
+    entro_90 = ((giorni > 30) & (giorni <= 90)).sum()
+    oltre_90 = (giorni > 90).sum()
+    scaduti = (giorni < 0).sum()
     senza_scadenza = merged["PrimaScadenza"].isna().sum()
 
     st.markdown(f"""
@@ -2305,15 +2004,15 @@ def page_lista_clienti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
     )
 
     if sort_mode == "Nome Cliente (A → Z)":
-        merged = merged.sort_values("RagioneSociale", ascending=True)
+        order = merged["RagioneSociale"].str.lower().sort_values(ascending=True, kind="stable").index
     elif sort_mode == "Nome Cliente (Z → A)":
-        merged = merged.sort_values("RagioneSociale", ascending=False)
+        order = merged["RagioneSociale"].str.lower().sort_values(ascending=False, kind="stable").index
     elif sort_mode == "Data Scadenza (più vicina)":
-        merged = merged.sort_values("PrimaScadenza", ascending=True, na_position="last")
-    elif sort_mode == "Data Scadenza (più lontana)":
-        merged = merged.sort_values("PrimaScadenza", ascending=False, na_position="last")
+        order = merged["PrimaScadenza"].sort_values(ascending=True, na_position="last", kind="stable").index
+    else:
+        order = merged["PrimaScadenza"].sort_values(ascending=False, na_position="last", kind="stable").index
 
-    # === VISUALIZZAZIONE ===
+    # === VISUALIZZAZIONE (solo la pagina visibile va al browser) ===
     st.divider()
     st.markdown("### 📇 Elenco Clienti e Scadenze")
 
@@ -2321,31 +2020,120 @@ def page_lista_clienti(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
         st.warning("❌ Nessun cliente trovato con i criteri selezionati.")
         return
 
-    for i, r in merged.iterrows():
-        c1, c2, c3, c4, c5 = st.columns([2, 1.5, 1.2, 1.2, 0.7])
-        with c1:
-            st.markdown(f"**{r['RagioneSociale']}**")
-        with c2:
-            st.markdown(r.get("Citta", "") or "—")
-        with c3:
-            st.markdown(r["ScadenzaBadge"], unsafe_allow_html=True)
-        with c4:
-            tmk = r.get("TMK", "")
-            if tmk:
-                st.markdown(f"<span style='background:#e3f2fd;color:#0d47a1;padding:3px 8px;border-radius:8px;font-weight:600;'>{tmk}</span>", unsafe_allow_html=True)
-            else:
-                st.markdown("—")
-        with c5:
-            if st.button("📂 Apri", key=f"apri_cli_{i}", use_container_width=True):
-                st.session_state.update({
-                    "selected_cliente": str(r["ClienteID"]),
-                    "nav_target": "Clienti",
-                    "_go_clienti_now": True,
-                    "_force_scroll_top": True
-                })
-                st.rerun()
+    view = pd.DataFrame({
+        "RagioneSociale": merged["RagioneSociale"],
+        "Citta": merged["Citta"].replace("", "—"),
+        "Scadenza": badge,
+        "Attivi": merged["ContrattiAttivi"],
+        "Rata": format_euro(merged["RataMensile"].where(merged["RataMensile"] > 0)),
+        "TMK": merged["TMK"].replace("", "—"),
+        "_livello": livello,
+        "_cid": merged["ClienteID"].astype(str),
+    }).loc[order]
+
+    page_view, page, _ = paginate(view, key="lista_cli", default_size=50)
+    sel = server_grid(
+        page_view, key=f"grid_lista_cli_{page}",
+        headers={"RagioneSociale": "Cliente", "Citta": "Città", "Scadenza": "Prima scadenza",
+                 "Attivi": "Contratti attivi", "Rata": "Rata mensile", "TMK": "TMK"},
+        styled_col="Scadenza",
+    )
+
+    if st.button("📂 Apri cliente selezionato", disabled=sel is None, key="apri_cli_lista"):
+        st.session_state.update({
+            "selected_cliente": sel["_cid"],
+            "nav_target": "Clienti",
+            "_go_clienti_now": True,
+            "_force_scroll_top": True
+        })
+        st.rerun()
 
     st.caption(f"📋 Totale clienti mostrati: **{len(merged)}**")
+
+    # === EXPORT PORTAFOGLIO FILTRATO (tutti i contratti dei clienti mostrati, un blocco per cliente) ===
+    vista = model.contratti_view()
+    ct_sel = vista[vista["_cid"].isin(merged["_cid"])]
+    key = ("portafoglio", model.version, hash(tuple(merged["_cid"])))
+    data = EXPORT_CACHE.get(key)
+    if data is None and st.button(f"⚙️ Prepara Excel portafoglio ({len(ct_sel)} contratti)", key="prep_portafoglio"):
+        try:
+            with timed("export.portafoglio", clienti=len(merged), righe=len(ct_sel)):
+                data = portafoglio_excel_bytes(ct_sel)
+            EXPORT_CACHE.put(key, data)
+        except Exception as e:
+            st.error(f"Errore export portafoglio: {e}")
+    if data is not None:
+        st.download_button(
+            "📦 Esporta portafoglio Excel",
+            data,
+            file_name=f"Portafoglio_{datetime.now():%Y%m%d}.xlsx",
+            mime=FORMATI["excel"][2],
+            key="dl_portafoglio",
+        )
+# =====================================
+# 🔎 PAGINA RICERCA FULL-TEXT (note clienti + descrizioni contratti)
+# =====================================
+def page_ricerca_testo(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
+    st.markdown("<h2>🔎 Ricerca nelle Note e nei Contratti</h2>", unsafe_allow_html=True)
+    st.caption('Parole in AND · **OR** tra alternative · **"frase esatta"** · **-parola** per escludere · '
+               '**pref*** per prefisso. Con la vista "Tutti" la ricerca copre i clienti di entrambi gli agenti.')
+    st.divider()
+
+    c1, c2 = st.columns([3, 1])
+    query = c1.text_input("Cerca", key="ft_query", placeholder='es. "flotta kyocera" OR centralino')
+    dove = c2.selectbox("Cerca in", ["Tutto", "Note clienti", "Contratti"], key="ft_dove")
+    if not query.strip():
+        st.info("Scrivi una o più parole da cercare nelle note dei clienti e nelle descrizioni dei contratti.")
+        return
+
+    model = _modello(df_cli, df_ct)
+    tabelle = {"Tutto": None, "Note clienti": {"clienti"}, "Contratti": {"contratti"}}[dove]
+    with timed("ricerca.fulltext", query=query):
+        fti = model.fulltext()
+        hits = fti.search(query, tables=tabelle)
+    st.caption(f"{len(hits)} risultati · {last_ms('ricerca.fulltext'):.1f} ms")
+    if not hits:
+        st.warning("❌ Nessun risultato.")
+        return
+
+    res = pd.DataFrame({"tabella": [h.key[0] for h in hits], "riga": [h.key[1] for h in hits]})
+    page_res, page, _ = paginate(res, key="ft_res", default_size=25)
+
+    # --- risultati della pagina in un unico blocco HTML (estratti con <mark>)
+    nomi = model.clienti.drop_duplicates("_cid").set_index("_cid")["RagioneSociale"]
+    voci, cards = {}, []
+    for tabella, riga in page_res.itertuples(index=False):
+        if tabella == "clienti":
+            r = model.clienti.loc[riga]
+            titolo = f"📝 {r['RagioneSociale']}"
+            dettaglio = f"Note cliente · ID {r['ClienteID']}"
+        else:
+            r = model.contratti.loc[riga]
+            titolo = f"📄 {nomi.get(r['_cid'], r.get('RagioneSociale', ''))}"
+            dettaglio = f"Contratto {r['NumeroContratto'] or '—'} · {fmt_date(r['DataInizio'])} · {r['Stato'] or 'aperto'}"
+        voci[(tabella, riga)] = f"{titolo} — {dettaglio}"
+        cards.append(
+            f"<div class='ft-card'><b>{html.escape(titolo)}</b> "
+            f"<span class='ft-det'>{html.escape(dettaglio)}</span>"
+            f"<div class='ft-snip'>{fti.snippet((tabella, riga), query)}</div></div>"
+        )
+    st.markdown(
+        "<style>.ft-card{border:1px solid #e5e7eb;border-radius:10px;padding:8px 12px;margin-bottom:6px;background:#fff;}"
+        ".ft-det{color:#6b7280;font-size:12px;margin-left:6px;}.ft-snip{font-size:13px;margin-top:4px;}"
+        ".ft-snip mark{background:#fde68a;padding:0 2px;border-radius:3px;}</style>" + "".join(cards),
+        unsafe_allow_html=True,
+    )
+
+    # --- azione sul risultato selezionato
+    a0, a1 = st.columns([4, 1])
+    sel = a0.selectbox("Risultato selezionato", list(voci), format_func=voci.get, key=f"ft_sel_{page}")
+    if a1.button("📂 Apri", use_container_width=True, key="ft_open"):
+        tabella, riga = sel
+        tab = model.clienti if tabella == "clienti" else model.contratti
+        st.session_state["selected_cliente"] = str(tab.loc[riga, "ClienteID"])
+        st.session_state["_go_clienti_now" if tabella == "clienti" else "_go_contratti_now"] = True
+        st.rerun()
+
 # =====================================
 # FIX DATE: ESEGUILO UNA SOLA VOLTA
 # =====================================
@@ -2371,9 +2159,13 @@ def fix_dates_once(df_cli: pd.DataFrame, df_ct: pd.DataFrame) -> tuple[pd.DataFr
                 if c in df_ct.columns:
                     df_ct[c] = fix_inverted_dates(df_ct[c], col_name=c)
 
-        # 🔹 Salva una sola volta
-        df_cli.to_csv(CLIENTI_CSV, index=False, encoding="utf-8-sig")
-        df_ct.to_csv(CONTRATTI_CSV, index=False, encoding="utf-8-sig")
+        # 🔹 Salva una sola volta, nel file di ciascun proprietario
+        for tabella, df in (("clienti", df_cli), ("contratti", df_ct)):
+            for path, righe in split_by_owner(df, tabella):
+                save_csv(righe, path)
+        if df_ct.attrs.get("versione"):
+            versione = view_version(df_ct.attrs.get("owners", []))
+            df_cli.attrs["versione"] = df_ct.attrs["versione"] = versione
 
         st.toast("🔄 Date corrette e salvate nei CSV.", icon="✅")
         st.session_state["_date_fix_done"] = True
@@ -2388,7 +2180,10 @@ def page_impostazioni(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
     st.title("⚙️ Impostazioni e Utilità")
     st.markdown("Puoi forzare la sincronizzazione o eseguire backup manuali.")
 
-    if st.button("🔁 Sincronizza dati da Box"):
+    backend = get_backend()
+    st.caption(f"🔌 Backend di sincronizzazione: **{backend.label}**")
+
+    if st.button("🔁 Sincronizza dati"):
         try:
             res = sync_from_mega()
             for r in res:
@@ -2397,18 +2192,113 @@ def page_impostazioni(df_cli: pd.DataFrame, df_ct: pd.DataFrame, role: str):
         except Exception as e:
             st.error(f"❌ Errore sincronizzazione: {e}")
 
-    if st.button("📤 Forza upload su Box"):
+    # sincronizzazione di un solo dataset (default: quello della vista corrente)
+    owners = list(DATASETS)
+    vista = df_ct.attrs.get("owners", [])
+    s1, s2 = st.columns([3, 1])
+    owner = s1.selectbox("📂 Dataset da sincronizzare", owners, format_func=lambda o: DATASETS[o].label,
+                         index=owners.index(vista[0]) if len(vista) == 1 and vista[0] in owners else 0,
+                         key="sync_owner")
+    if s2.button("🔁 Sincronizza dataset", use_container_width=True):
         try:
-            upload_to_mega(CLIENTI_CSV)
-            upload_to_mega(CONTRATTI_CSV)
-            upload_to_mega(STORAGE_DIR / "preventivi.csv")
-            st.success("✅ Backup completato su Box.")
+            for r in sync_dataset_files(owner):
+                st.toast(r, icon="✅")
+            st.success(f"✅ Dati di {DATASETS[owner].label} sincronizzati.")
+        except Exception as e:
+            st.error(f"❌ Errore sincronizzazione: {e}")
+
+    if st.button("📤 Forza upload"):
+        try:
+            futures = [upload_to_mega(p) for ds in DATASETS.values() for p in (ds.clienti, ds.contratti) if p.exists()]
+            futures.append(upload_to_mega(STORAGE_DIR / "preventivi.csv"))
+            if all(f is not None for f in futures):
+                st.success(f"✅ Upload accodati su {backend.label}.")
         except Exception as e:
             st.error(f"❌ Errore upload: {e}")
+
+    # === CONFLITTI DI SINCRONIZZAZIONE (merge a tre vie) ===
+    conflitti = pending_conflicts()
+    if conflitti:
+        st.divider()
+        st.markdown("### 🔀 Conflitti di sincronizzazione")
+        st.caption("Righe modificate sia in locale sia in remoto: scegli quale versione tenere. "
+                   "Finché non scegli resta in uso la versione locale.")
+    for nome, df_conf in conflitti.items():
+        st.markdown(f"#### 📄 {nome}")
+        st.dataframe(df_conf.drop(columns=["_key"]), use_container_width=True, hide_index=True)
+        dati = [c for c in df_conf.columns if c not in ("_key", "_lato")][:3]
+        scelte = df_conf[df_conf[dati].ne("").any(axis=1)].drop_duplicates("_key")
+        scelte = scelte.assign(Riepilogo=scelte[dati].agg(" | ".join, axis=1), Scelta="locale")
+        edit = st.data_editor(
+            scelte[["_key", "Riepilogo", "Scelta"]],
+            column_config={
+                "_key": None,
+                "Scelta": st.column_config.SelectboxColumn("Versione da tenere", options=["locale", "remoto"]),
+            },
+            disabled=["Riepilogo"],
+            hide_index=True,
+            use_container_width=True,
+            key=f"conflitti_{nome}",
+        )
+        if st.button("✅ Applica scelte", key=f"risolvi_{nome}"):
+            try:
+                n = resolve_conflicts(nome, STORAGE_DIR / nome, dict(zip(edit["_key"], edit["Scelta"])))
+                upload_to_mega(STORAGE_DIR / nome)
+                st.success(f"✅ Conflitti risolti ({n} righe prese dal remoto).")
+                st.rerun()
+            except Exception as e:
+                st.error(f"❌ Errore risoluzione conflitti: {e}")
+
+    # === STATO UPLOAD IN BACKGROUND ===
+    uploader = get_uploader()
+    in_coda = uploader.pending()
+    if in_coda:
+        st.info(f"⏳ Upload in corso: {', '.join(in_coda)}")
+    if uploader.results:
+        with st.expander("📤 Ultimi upload"):
+            st.dataframe(pd.DataFrame([
+                {
+                    "File": r.name,
+                    "Esito": "OK" if r.ok else f"ERRORE: {r.error}",
+                    "Durata (s)": round(r.seconds, 3),
+                    "Ora": datetime.fromtimestamp(r.finished_at).strftime("%H:%M:%S"),
+                }
+                for r in reversed(uploader.results)
+            ]), use_container_width=True, hide_index=True)
+
+    # === SCHEDE CONTRATTI PDF IN BLOCCO (chiusura mese) ===
+    st.divider()
+    st.markdown("### 🗂️ Schede contratti PDF (tutti i clienti attivi)")
+    model = _modello(df_cli, df_ct)
+    vista_ct = model.contratti_view()
+    st.caption(f"Un PDF per ognuno dei {n_clienti_attivi(vista_ct)} clienti con contratti aperti, raccolti in uno ZIP.")
+    if st.button("⚙️ Genera ZIP schede PDF", key="pdf_batch"):
+        gruppi = clienti_attivi(vista_ct)
+        barra = st.progress(0.0, text="Avvio…")
+
+        def avanzamento(fatti, totale, secondi):
+            barra.progress(fatti / max(totale, 1), text=f"{fatti}/{totale} PDF · {fatti / secondi:.1f} PDF/s")
+
+        try:
+            dest = Path(tempfile.gettempdir()) / f"schede_contratti_{abs(hash(model.version)):x}.zip"
+            with timed("export.pdf_batch", clienti=len(gruppi)):
+                stats = pdf_batch_zip(dest, gruppi, progress=avanzamento)
+            st.session_state["pdf_batch_zip"] = (str(dest), stats)
+        except Exception as e:
+            st.error(f"❌ Errore generazione PDF: {e}")
+    if "pdf_batch_zip" in st.session_state:
+        path, stats = st.session_state["pdf_batch_zip"]
+        st.success(f"✅ {stats['pdf']} PDF in {stats['secondi']:.1f} s ({stats['pdf_al_secondo']:.1f} PDF/s) · "
+                   f"{stats['byte'] / 1e6:.1f} MB")
+        if Path(path).exists():
+            with open(path, "rb") as f:
+                st.download_button("📦 Scarica ZIP schede PDF", f, file_name=f"Schede_contratti_{datetime.now():%Y%m%d}.zip",
+                                   mime="application/zip", key="dl_pdf_batch")
 # =====================================
-# MAIN APP — versione finale stabile con login e sincronizzazione Box
+# MAIN APP — versione finale stabile con login e sincronizzazione dati
 # =====================================
 def main():
+    count_full_run()
     st.write("✅ Avvio CRM SHT — Buon lavoro")
 
     # --- LOGIN ---
@@ -2422,14 +2312,13 @@ def main():
 
     # --- SYNC BOX (solo dopo login, eseguita una volta per sessione) ---
     if "box_synced" not in st.session_state:
-        st.info("🔁 Sincronizzazione iniziale dati da Box in corso…")
+        st.info(f"🔁 Sincronizzazione iniziale dati da {get_backend().label} in corso…")
         try:
             results = sync_from_mega()
             for r in results:
                 st.toast(r, icon="✅")
-            sync_gabriele_files()
             st.session_state["box_synced"] = True
-            st.toast("📦 Dati sincronizzati da Box", icon="✅")
+            st.toast(f"📦 Dati sincronizzati da {get_backend().label}", icon="✅")
         except Exception as e:
             st.warning(f"⚠️ Errore durante la sincronizzazione iniziale: {e}")
 
@@ -2443,78 +2332,45 @@ def main():
     else:
         ruolo_scrittura = "limitato"
 
-    # --- VISIBILITÀ DATI ---
+    # --- VISIBILITÀ DATI (viste dal registro datasets: un agente per voce + "Tutti") ---
     if user in ["fabio", "giulia", "antonella", "emanuela", "claudia"]:
-        visibilita_opzioni = ["Fabio", "Gabriele", "Tutti"]
+        visibilita_opzioni = view_labels()
         visibilita_scelta = st.sidebar.radio(
             "📂 Visualizza clienti di:",
             visibilita_opzioni,
             index=0
         )
     else:
-        visibilita_scelta = "Fabio"
+        # gli altri vedono solo il dataset a cui sono assegnati (es. Gabriele → i suoi file)
+        visibilita_scelta = dataset(owner_for_user(user)).label
 
     # --- MOSTRA INFO UTENTE ---
     st.sidebar.success(f"👤 {user} — Ruolo: {role}")
     st.sidebar.info(f"📂 Vista: {visibilita_scelta}")
+    reruns = rerun_stats()
+    st.sidebar.caption(f"🔁 Rerun: {reruns['completi']} completi · {reruns['fragment']} fragment")
 
-    # --- CARICAMENTO DATI ---
-    df_cli_main = load_clienti()
-    df_ct_main = load_contratti()
-
-    # --- CARICAMENTO DATI GABRIELE ---
-    try:
-        if GABRIELE_CLIENTI.exists():
-            for sep_try in [";", ",", "|", "\t"]:
-                try:
-                    df_cli_gab = pd.read_csv(
-                        GABRIELE_CLIENTI, dtype=str, sep=sep_try,
-                        encoding="utf-8-sig", on_bad_lines="skip", engine="python"
-                    ).fillna("")
-                    if len(df_cli_gab.columns) > 3:
-                        break
-                except Exception:
-                    continue
-        else:
-            df_cli_gab = pd.DataFrame(columns=CLIENTI_COLS)
-
-        if GABRIELE_CONTRATTI.exists():
-            for sep_try in [";", ",", "|", "\t"]:
-                try:
-                    df_ct_gab = pd.read_csv(
-                        GABRIELE_CONTRATTI, dtype=str, sep=sep_try,
-                        encoding="utf-8-sig", on_bad_lines="skip", engine="python"
-                    ).fillna("")
-                    if len(df_ct_gab.columns) > 3:
-                        break
-                except Exception:
-                    continue
-        else:
-            df_ct_gab = pd.DataFrame(columns=CONTRATTI_COLS)
-
-        df_cli_gab = ensure_columns(df_cli_gab, CLIENTI_COLS)
-        df_ct_gab = ensure_columns(df_ct_gab, CONTRATTI_COLS)
-    except Exception as e:
-        st.warning(f"⚠️ Impossibile caricare i dati di Gabriele: {e}")
-        df_cli_gab = pd.DataFrame(columns=CLIENTI_COLS)
-        df_ct_gab = pd.DataFrame(columns=CONTRATTI_COLS)
-
-    # --- APPLICA FILTRO VISIBILITÀ ---
-    if visibilita_scelta == "Fabio":
-        df_cli, df_ct = df_cli_main, df_ct_main
-    elif visibilita_scelta == "Gabriele":
-        df_cli, df_ct = df_cli_gab, df_ct_gab
-    else:
-        df_cli = pd.concat([df_cli_main, df_cli_gab], ignore_index=True)
-        df_ct = pd.concat([df_ct_main, df_ct_gab], ignore_index=True)
+    # --- MIGRAZIONE: ContrattoID su tutti i file contratti (una volta per sessione) ---
+    if "_ct_ids_ok" not in st.session_state:
+        for ds in DATASETS.values():
+            try:
+                if ds.contratti.exists() and migrate_file(ds.contratti):
+                    upload_to_mega(ds.contratti)
+            except Exception as e:
+                st.warning(f"⚠️ Migrazione ContrattoID non riuscita per {ds.label}: {e}")
+        st.session_state["_ct_ids_ok"] = True
 
-    # 🔒 Se l’utente è Gabriele → forzo i suoi file
-    if user.lower().strip() == "gabriele":
-        df_cli, df_ct = df_cli_gab, df_ct_gab
+    # --- CARICAMENTO DATI (solo i dataset della vista, in parallelo, in cache finché i file non cambiano) ---
+    df_cli, df_ct, errori = load_view(visibilita_scelta, {"clienti": load_clienti, "contratti": load_contratti})
+    for err in errori:
+        st.warning(f"⚠️ Impossibile caricare i dati {err}")
 
     # --- CORREGGI DATE (una sola volta) ---
     df_cli, df_ct = fix_dates_once(df_cli, df_ct)
 
+    # --- VERSIONE DATI DEL RUN (firme dei file; None → hash dei DataFrame in get_model) ---
+    st.session_state["_data_version"] = df_ct.attrs.get("versione")
+
     # --- CONTESTO SESSIONE ---
     st.session_state["ruolo_scrittura"] = ruolo_scrittura
     st.session_state["visibilita"] = visibilita_scelta
@@ -2528,6 +2384,7 @@ def main():
         "📄 Contratti": page_contratti,
         "📅 Recall e Visite": page_richiami_visite,
         "📇 Lista Clienti": page_lista_clienti,
+        "🔎 Ricerca Testo": page_ricerca_testo,
         "⚙️ Impostazioni": page_impostazioni
     }
 
@@ -2536,6 +2393,12 @@ def main():
     if last_page not in pagine:
         last_page = "📋 Clienti"
 
+    # --- NAVIGAZIONE AUTOMATICA (prima di creare il selettore pagina) ---
+    for flag, target in (("_go_contratti_now", "📄 Contratti"), ("_go_clienti_now", "📋 Clienti")):
+        if st.session_state.pop(flag, False):
+            st.session_state.pop("main_page_selector", None)
+            last_page = target
+
     pagina_scelta = st.sidebar.radio(
         "Seleziona pagina",
         list(pagine.keys()),
@@ -2546,15 +2409,13 @@ def main():
     # --- Salva ultima pagina ---
     st.session_state["last_page"] = pagina_scelta
 
-    # --- NAVIGAZIONE AUTOMATICA ---
-    if st.session_state.get("_go_contratti_now"):
-        st.session_state["_go_contratti_now"] = False
-        pagina_scelta = "📄 Contratti"
-        st.session_state["main_page_selector"] = "📄 Contratti"
-
-    # --- RENDER PAGINA ---
+    # --- RENDER PAGINA (la modifica contratto si apre sopra la pagina scelta) ---
+    if st.session_state.get("nav_target") == "✏️ Modifica Contratto" and st.session_state.get("edit_ct_id"):
+        pagina_scelta = "✏️ Modifica Contratto"
+        pagine[pagina_scelta] = page_modifica_contratto
     try:
-        pagine[pagina_scelta](df_cli, df_ct, ruolo_scrittura)
+        with timed("pagina", nome=pagina_scelta):
+            pagine[pagina_scelta](df_cli, df_ct, ruolo_scrittura)
     except Exception as e:
         st.error(f"❌ Errore caricamento pagina {pagina_scelta}: {e}")
 
@@ -0,0 +1,112 @@
+# =====================================
+# contratti_store.py — chiave surrogata ContrattoID e scritture puntuali
+# =====================================
+# Ogni contratto ha un ContrattoID permanente salvato nel CSV (colonna
+# "ContrattoID", es. CT-3F9A1C07B2E4). I file esistenti vengono completati
+# una volta sola da migrate_file(). Le modifiche dalle pagine vanno al file
+# del proprietario (Fabio, Gabriele, …) riga per riga tramite la chiave, così
+# funzionano anche nella vista "Tutti" dove le righe arrivano da più file.
+# Lo stesso vale per le modifiche a un cliente (update_cliente, per ClienteID).
+# =====================================
+from __future__ import annotations
+
+import os
+import uuid
+from pathlib import Path
+
+import pandas as pd
+
+from csv_merge import read_csv_any
+
+KEY_COL = "ContrattoID"
+OWNER_COL = "_owner"     # colonna solo in memoria: proprietario della riga
+
+
+def nuovo_contratto_id() -> str:
+    return "CT-" + uuid.uuid4().hex[:12].upper()
+
+
+def backfill_ids(df: pd.DataFrame) -> int:
+    """Assegna un ContrattoID alle righe senza chiave (o con chiave duplicata). Ritorna quante."""
+    if KEY_COL not in df.columns:
+        df.insert(0, KEY_COL, "")
+    ids = df[KEY_COL].fillna("").astype(str).str.strip()
+    missing = (ids == "") | ids.duplicated()
+    n = int(missing.sum())
+    if n:
+        df.loc[missing, KEY_COL] = [nuovo_contratto_id() for _ in range(n)]
+    return n
+
+
+def _write(df: pd.DataFrame, path: Path) -> None:
+    """Scrittura atomica (file temporaneo + replace), senza le colonne tecniche '_…'."""
+    path = Path(path)
+    out = df.drop(columns=[c for c in df.columns if str(c).startswith("_")])
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    out.to_csv(tmp, index=False, encoding="utf-8-sig")
+    os.replace(tmp, path)
+
+
+def migrate_file(path: Path) -> int:
+    """Aggiunge ContrattoID alle righe che non lo hanno; riscrive il file solo se serve."""
+    path = Path(path)
+    df = read_csv_any(path)
+    if df.empty:
+        return 0
+    n = backfill_ids(df)
+    if n:
+        _write(df, path)
+    return n
+
+
+# =====================================
+# SCRITTURE PUNTUALI SUL FILE DEL PROPRIETARIO
+# =====================================
+def _locate(df: pd.DataFrame, contratto_id: str):
+    if not str(contratto_id or "").strip():
+        raise KeyError("Contratto senza ContrattoID: impossibile individuarlo nel file")
+    hit = df.index[df[KEY_COL] == contratto_id] if KEY_COL in df.columns else []
+    if not len(hit):
+        raise KeyError(f"Contratto {contratto_id} non trovato")
+    return hit[0]
+
+
+def update_contratto(path: Path, contratto_id: str, values: dict) -> None:
+    df = read_csv_any(path)
+    idx = _locate(df, contratto_id)
+    for c in values:
+        if c not in df.columns:
+            df[c] = ""
+    df.loc[idx, list(values)] = [str(v) for v in values.values()]
+    _write(df, path)
+
+
+def update_cliente(path: Path, cliente_id: str, values: dict) -> None:
+    """Modifica puntuale della riga cliente (ClienteID normalizzato come nel modello) nel file del proprietario."""
+    df = read_csv_any(path)
+    chiave = str(cliente_id or "").strip().lstrip("0").upper()
+    ids = df["ClienteID"].fillna("").astype(str).str.strip().str.lstrip("0").str.upper() if "ClienteID" in df else pd.Series(dtype=str)
+    hit = df.index[ids == chiave] if chiave else []
+    if not len(hit):
+        raise KeyError(f"Cliente {cliente_id} non trovato in {Path(path).name}")
+    for c in values:
+        if c not in df.columns:
+            df[c] = ""
+    df.loc[hit[0], list(values)] = [str(v) for v in values.values()]
+    _write(df, path)
+
+
+def delete_contratto(path: Path, contratto_id: str) -> None:
+    df = read_csv_any(path)
+    _write(df.drop(index=_locate(df, contratto_id)), path)
+
+
+def append_contratto(path: Path, row: dict, columns: list[str]) -> str:
+    """Aggiunge un contratto (assegnando la chiave se manca) e ritorna il suo ContrattoID."""
+    row = {**row, KEY_COL: row.get(KEY_COL) or nuovo_contratto_id()}
+    df = read_csv_any(path)
+    if df.empty:
+        df = pd.DataFrame(columns=columns)
+    df = pd.concat([df, pd.DataFrame([row])], ignore_index=True).fillna("")
+    _write(df, path)
+    return row[KEY_COL]
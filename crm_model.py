@@ -0,0 +1,291 @@
+# =====================================
+# crm_model.py — modello dati tipizzato (una volta per versione dati)
+# =====================================
+# I DataFrame letti dai CSV sono tutti stringhe. Qui vengono affiancati da
+# colonne tipizzate (date come datetime64, chiavi normalizzate, stato in
+# minuscolo, importi come float) calcolate UNA volta per versione dei dati; le pagine leggono
+# dal modello invece di riconvertire tutto ad ogni rerun.
+# =====================================
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from agenda import Agenda
+from cube import CuboContratti
+from crm_views import ClienteAggregati, ContrattiView
+from fulltext import FullTextIndex
+from importi import IMPORTI, non_validi, parse_euro
+from mrr import MRR
+from rinnovi import AnalisiRinnovi
+from scadenze_index import ScadenzeIndex
+from search_index import ClientSearchIndex
+
+CLI_DATE_COLS = ["UltimoRecall", "ProssimoRecall", "UltimaVisita", "ProssimaVisita"]
+CT_DATE_COLS = ["DataInizio", "DataFine"]
+
+_MAX_MODELS = 4  # versioni tenute in memoria (es. viste Fabio / Gabriele / Tutti)
+_CACHE: "OrderedDict[str, CRMModel]" = OrderedDict()
+
+
+# =====================================
+# CONVERSIONI VETTORIZZATE
+# =====================================
+def norm_ids(s: pd.Series) -> pd.Series:
+    """ClienteID normalizzato (spazi, zeri iniziali, maiuscole) — calcolato sui soli valori distinti."""
+    codes, uniq = pd.factorize(s.fillna("").astype(str))
+    if not len(uniq):
+        return pd.Series("", index=s.index, dtype=object)
+    norm = pd.Index(uniq).str.strip().str.lstrip("0").str.upper().to_numpy()
+    return pd.Series(norm[codes], index=s.index)
+
+
+def norm_id(x) -> str:
+    return str(x if x is not None else "").strip().lstrip("0").upper()
+
+
+def parse_dates(s: pd.Series) -> pd.Series:
+    """Date italiane miste (31/12/2024, 01/07/24 00:00, 2024-07-01…) → datetime64, NaT se non valide."""
+    s = s.fillna("").astype(str).str.strip()
+    codes, uniq = pd.factorize(s)
+    if not len(uniq):
+        return pd.Series(pd.NaT, index=s.index, dtype="datetime64[ns]")
+    parsed = pd.to_datetime(pd.Series(uniq).replace("", None), dayfirst=True, errors="coerce", format="mixed")
+    return pd.Series(parsed.to_numpy()[codes], index=s.index)
+
+
+def _group_labels(keys: pd.Series) -> dict[str, list]:
+    """chiave → etichette di riga (in ordine di file), senza chiavi vuote."""
+    keys = keys[keys != ""]
+    if keys.empty:
+        return {}
+    pos = keys.groupby(keys, sort=False).indices
+    labels = keys.index
+    return {k: labels[v].tolist() for k, v in pos.items()}
+
+
+def data_version(*dfs: pd.DataFrame) -> str:
+    """Impronta del contenuto: cambia appena cambia un valore qualsiasi."""
+    parts = []
+    for df in dfs:
+        h = pd.util.hash_pandas_object(df, index=True, categorize=False).to_numpy() if len(df) else np.zeros(0, np.uint64)
+        parts.append(f"{len(df)}:{int(np.bitwise_xor.reduce(h)) if len(h) else 0:x}:{int(h.sum()) if len(h) else 0:x}")
+    return "|".join(parts)
+
+
+# =====================================
+# MODELLO
+# =====================================
+@dataclass
+class CRMModel:
+    version: str
+    clienti: pd.DataFrame
+    contratti: pd.DataFrame
+    _derived: dict = field(default_factory=dict, repr=False)
+    # indici: ClienteID normalizzato → riga cliente / righe contratti; NumeroContratto → righe
+    _cli_by_id: dict = field(default_factory=dict, repr=False)
+    _ct_by_cli: dict = field(default_factory=dict, repr=False)
+    _ct_by_num: dict = field(default_factory=dict, repr=False)
+    _ct_by_key: dict = field(default_factory=dict, repr=False)   # ContrattoID → riga
+
+    @classmethod
+    def build(cls, df_cli: pd.DataFrame, df_ct: pd.DataFrame, version: str) -> "CRMModel":
+        cli = df_cli.copy()
+        cli["_cid"] = norm_ids(cli["ClienteID"])
+        for c in CLI_DATE_COLS:
+            cli[f"{c}_dt"] = parse_dates(cli[c])
+        cli["TMK"] = cli["TMK"].fillna("").astype(str).str.strip()
+
+        ct = df_ct.copy()
+        ct["_cid"] = norm_ids(ct["ClienteID"])
+        for c in CT_DATE_COLS:
+            ct[f"{c}_dt"] = parse_dates(ct[c])
+        ct["Stato_n"] = ct["Stato"].fillna("").astype(str).str.strip().str.lower()
+        for c in IMPORTI:
+            ct[f"{c}_n"] = parse_euro(ct[c])
+        model = cls(version, cli, ct)
+        model._build_indexes()
+        return model
+
+    # --- indici hash sulle chiavi normalizzate (ClienteID, NumeroContratto) ---
+    def _build_indexes(self) -> None:
+        cid = self.clienti["_cid"]
+        first = ~cid.duplicated() & (cid != "")
+        self._cli_by_id = dict(zip(cid[first], cid.index[first]))
+        self._ct_by_cli = _group_labels(self.contratti["_cid"])
+        self._ct_by_num = _group_labels(norm_ids(self.contratti["NumeroContratto"]))
+        if "ContrattoID" in self.contratti.columns:
+            key = self.contratti["ContrattoID"].fillna("").astype(str)
+            first = ~key.duplicated() & (key != "")
+            self._ct_by_key = dict(zip(key[first], key.index[first]))
+
+    def _reindex_row(self, table: str, idx, old: dict) -> None:
+        """Sposta la riga idx negli indici se la chiave è cambiata (old = chiavi prima della modifica)."""
+        if table == "clienti":
+            new = self.clienti.at[idx, "_cid"]
+            if new != old["_cid"]:
+                if self._cli_by_id.get(old["_cid"]) == idx:
+                    del self._cli_by_id[old["_cid"]]
+                self._cli_by_id.setdefault(new, idx)
+            return
+        for index, col, key in ((self._ct_by_cli, "_cid", lambda v: v),
+                                (self._ct_by_num, "NumeroContratto", norm_id)):
+            prima, dopo = key(old[col]), key(self.contratti.at[idx, col])
+            if prima == dopo:
+                continue
+            rows = index.get(prima, [])
+            if idx in rows:
+                rows.remove(idx)
+                if not rows:
+                    del index[prima]
+            index.setdefault(dopo, []).append(idx)
+            index[dopo].sort(key=self.contratti.index.get_loc)
+
+    def cliente_label(self, cliente_id):
+        """Etichetta di riga del cliente (None se non esiste); accetta ID non normalizzati."""
+        return self._cli_by_id.get(norm_id(cliente_id))
+
+    def cliente(self, cliente_id) -> pd.Series | None:
+        label = self.cliente_label(cliente_id)
+        return None if label is None else self.clienti.loc[label]
+
+    def contratti_labels(self, cliente_id) -> list:
+        """Etichette di riga dei contratti del cliente, nell'ordine del file."""
+        return list(self._ct_by_cli.get(norm_id(cliente_id), ()))
+
+    def contratti_di(self, cliente_id) -> pd.DataFrame:
+        return self.contratti.loc[self.contratti_labels(cliente_id)]
+
+    def contratto_label(self, contratto_id):
+        """Etichetta di riga del contratto con questa chiave surrogata (None se non esiste)."""
+        return self._ct_by_key.get(str(contratto_id or ""))
+
+    def contratti_per_numero(self, numero) -> list:
+        return list(self._ct_by_num.get(norm_id(numero), ())) if norm_id(numero) else []
+
+    # --- modifiche puntuali (salvataggi da fragment, senza ricostruire il modello) ---
+    def update_row(self, table: str, idx, values: dict) -> None:
+        """Aggiorna una riga di 'clienti' o 'contratti' e le sue colonne tipizzate."""
+        df = self.clienti if table == "clienti" else self.contratti
+        old = df.loc[idx, ["_cid", "NumeroContratto"] if table == "contratti" else ["_cid"]].to_dict()
+        cols = list(values)
+        df.loc[idx, cols] = [values[c] for c in cols]
+        date_cols = CLI_DATE_COLS if table == "clienti" else CT_DATE_COLS
+        for c in cols:
+            if c in date_cols:
+                df.loc[idx, f"{c}_dt"] = parse_dates(pd.Series([values[c]])).iloc[0]
+        if "ClienteID" in values:
+            df.loc[idx, "_cid"] = norm_id(values["ClienteID"])
+        if table == "contratti" and "Stato" in values:
+            df.loc[idx, "Stato_n"] = str(values["Stato"]).strip().lower()
+        for c in IMPORTI if table == "contratti" else ():
+            if c in values:
+                df.loc[idx, f"{c}_n"] = parse_euro(pd.Series([values[c]])).iloc[0]
+        if table == "clienti" and "TMK" in values:
+            df.loc[idx, "TMK"] = str(values["TMK"]).strip()
+        self._reindex_row(table, idx, old)
+        # i derivati aggiornabili riga per riga (es. indice full-text) restano, gli altri si ricalcolano
+        for name, obj in list(self._derived.items()):
+            if hasattr(obj, "update_row"):
+                obj.update_row(table, idx, df.loc[idx])
+            else:
+                del self._derived[name]
+
+    # --- derivati calcolati a richiesta e memorizzati per questa versione ---
+    def derived(self, name: str, builder):
+        if name not in self._derived:
+            self._derived[name] = builder(self)
+        return self._derived[name]
+
+    def search_index(self) -> ClientSearchIndex:
+        """Indice di ricerca clienti (RagioneSociale, Citta, ClienteID) per questa versione."""
+        return self.derived("search_index", lambda m: ClientSearchIndex.build(m.clienti))
+
+    def fulltext(self) -> FullTextIndex:
+        """Indice full-text su NoteCliente e DescrizioneProdotto (aggiornato ad ogni update_row)."""
+        return self.derived("fulltext", lambda m: FullTextIndex.build({"clienti": m.clienti, "contratti": m.contratti}))
+
+    def contratti_view(self) -> pd.DataFrame:
+        """Contratti con i dati del cliente (Cliente, RagioneSociale_cli, TMK, Citta, CAP), aggiornata ad ogni update_row."""
+        return self.derived("contratti_view", ContrattiView.build).df
+
+    def agenda(self) -> Agenda:
+        """Prossimi recall/visite per cliente (default +3 / +6 mesi) indicizzati per TMK."""
+        return self.derived("agenda", Agenda.build)
+
+    def cubo(self) -> CuboContratti:
+        """Cubo contratti per Dashboard Grafica (ricostruito alla prima richiesta dopo una modifica)."""
+        return self.derived("cubo", CuboContratti.build)
+
+    def mrr(self) -> MRR:
+        """Rata mensile distribuita sui mesi di vita dei contratti (array delle differenze)."""
+        return self.derived("mrr", MRR.build)
+
+    def rinnovi(self) -> AnalisiRinnovi:
+        """Catene di rinnovo per cliente: tasso di rinnovo, churn, gap e coorti (per versione dati)."""
+        return self.derived("rinnovi", AnalisiRinnovi.build)
+
+    def scadenze(self) -> ScadenzeIndex:
+        """Indice ordinato DataFine → contratti non chiusi: finestre di scadenza con searchsorted."""
+        return self.derived("scadenze", ScadenzeIndex.from_model)
+
+    def importi_non_validi(self) -> pd.DataFrame:
+        """Importi (IMPORTI) non vuoti che non sono numeri: Colonna, Valore, NumeroContratto, ClienteID."""
+        def build(m):
+            ct, parti = m.contratti, []
+            for c in IMPORTI:
+                bad = non_validi(ct[c], ct[f"{c}_n"])
+                parti.append(pd.DataFrame({"Colonna": c, "Valore": bad}).join(ct[["NumeroContratto", "ClienteID"]]))
+            return pd.concat(parti)
+        return self.derived("importi_non_validi", build)
+
+    def aggregati(self) -> ClienteAggregati:
+        """Per cliente: PrimaScadenza, ContrattiAttivi, RataMensile, UltimoInizio (contratti non chiusi)."""
+        return self.derived("aggregati", ClienteAggregati.build)
+
+
+def get_model(df_cli: pd.DataFrame, df_ct: pd.DataFrame, version: str | None = None) -> CRMModel:
+    """Modello per la versione dati corrente (ricostruito solo se i dati cambiano)."""
+    version = version or data_version(df_cli, df_ct)
+    model = _CACHE.get(version)
+    if model is None:
+        model = CRMModel.build(df_cli, df_ct, version)
+        _CACHE[version] = model
+        while len(_CACHE) > _MAX_MODELS:
+            _CACHE.popitem(last=False)
+    else:
+        _CACHE.move_to_end(version)
+    return model
+
+
+def rekey_model(model: CRMModel, new_version: str) -> CRMModel:
+    """Registra il modello aggiornato in memoria sotto la nuova versione dei dati."""
+    _CACHE.pop(model.version, None)
+    model.version = new_version
+    _CACHE[new_version] = model
+    return model
+
+
+# =====================================
+# BADGE SCADENZA (vettorizzato)
+# =====================================
+SCADENZA_LIVELLI = ["nessuna", "scaduto", "30", "90", "oltre"]
+
+
+def scadenza_badge(prima: pd.Series, oggi: pd.Timestamp) -> tuple[pd.Series, pd.Series, pd.Series]:
+    """
+    Ritorna (giorni mancanti, livello, testo badge) per una serie di PrimaScadenza,
+    senza apply riga per riga.
+    """
+    giorni = (prima - oggi).dt.days
+    cond = [prima.isna(), giorni < 0, giorni <= 30, giorni <= 90]
+    livello = pd.Series(np.select(cond, SCADENZA_LIVELLI[:4], SCADENZA_LIVELLI[4]), index=prima.index)
+    data_fmt = prima.dt.strftime("%d/%m/%Y").fillna("")
+    icona = livello.map({"nessuna": "⚪", "scaduto": "⚫", "30": "🔴", "90": "🟡", "oltre": "🟢"})
+    testo = icona + " " + data_fmt
+    testo = testo.mask(livello == "scaduto", "⚫ Scaduto (" + data_fmt + ")")
+    testo = testo.mask(livello == "nessuna", "⚪ Nessuna")
+    return giorni, livello, testo
@@ -0,0 +1,130 @@
+# =====================================
+# crm_views.py — viste materializzate sul modello (join e aggregati)
+# =====================================
+# Calcolate una volta per versione dati (CRMModel.contratti_view /
+# CRMModel.aggregati) e aggiornate sulla singola riga quando un cliente o un
+# contratto vengono salvati: le pagine non rifanno merge/groupby ad ogni rerun.
+#
+#   ContrattiView      contratti + dati del cliente (Cliente, TMK, Citta, CAP…)
+#   ClienteAggregati   per cliente: PrimaScadenza, ContrattiAttivi,
+#                      RataMensile, UltimoInizio
+# =====================================
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from scadenze_index import DateIndex
+
+# colonne del cliente portate su ogni contratto (nome nella vista ← colonna clienti)
+JOIN_COLS = {"RagioneSociale_cli": "RagioneSociale", "TMK": "TMK", "Citta": "Citta", "CAP": "CAP"}
+AGG_COLS = ["PrimaScadenza", "ContrattiAttivi", "RataMensile", "UltimoInizio"]
+
+
+def _cli_labels(model, cids: pd.Series) -> pd.Series:
+    """_cid → etichetta di riga del cliente (NaN se il cliente non esiste)."""
+    return cids.map(model._cli_by_id)
+
+
+# =====================================
+# JOIN CONTRATTI ↔ CLIENTI
+# =====================================
+class ContrattiView:
+    """
+    Un contratto per riga (stesse etichette di model.contratti) con le colonne
+    tipizzate del modello, i campi del cliente in JOIN_COLS, "_cli" (etichetta
+    della riga cliente) e "Cliente" (ragione sociale del contratto o, se vuota,
+    del cliente).
+    """
+
+    def __init__(self, model, df: pd.DataFrame):
+        self.model = model
+        self.df = df
+
+    @classmethod
+    def build(cls, model) -> "ContrattiView":
+        ct = model.contratti
+        df = ct.copy()
+        view = cls(model, df)
+        view._join(ct.index)
+        return view
+
+    def _join(self, labels) -> None:
+        df, cli = self.df, self.model.clienti
+        lab = _cli_labels(self.model, df.loc[labels, "_cid"])
+        found = lab.notna()
+        df.loc[labels, "_cli"] = lab
+        for dst, src in JOIN_COLS.items():
+            vals = pd.Series("", index=lab.index, dtype=object)
+            vals[found] = cli[src].reindex(lab[found]).to_numpy()
+            df.loc[labels, dst] = vals
+        own = df.loc[labels, "RagioneSociale"].fillna("").astype(str)
+        df.loc[labels, "Cliente"] = own.where(own.str.strip() != "", df.loc[labels, "RagioneSociale_cli"])
+
+    def update_row(self, table: str, idx, row: pd.Series) -> None:
+        if table == "contratti":
+            cols = [c for c in row.index if c in self.df.columns]
+            self.df.loc[idx, cols] = row[cols].to_numpy()
+            self._join([idx])
+            return
+        # cliente modificato: i contratti che puntavano a lui + quelli del suo (eventuale nuovo) ID
+        labels = self.df.index[self.df["_cli"] == idx].union(
+            pd.Index(self.model.contratti_labels(row["_cid"]), dtype=self.df.index.dtype))
+        if len(labels):
+            self._join(labels)
+
+
+# =====================================
+# AGGREGATI PER CLIENTE
+# =====================================
+def _aggrega(ct: pd.DataFrame) -> pd.DataFrame:
+    """Aggregati dei contratti raggruppati per _cid (solo contratti non chiusi)."""
+    attivi = ct[ct["Stato_n"] != "chiuso"]
+    g = attivi.groupby("_cid", sort=False)
+    out = pd.DataFrame({
+        "PrimaScadenza": g["DataFine_dt"].min(),
+        "ContrattiAttivi": g.size(),
+        "RataMensile": g["TotRata_n"].sum(),
+        "UltimoInizio": g["DataInizio_dt"].max(),
+    })
+    return out[out.index != ""]
+
+
+class ClienteAggregati:
+    """Tabella _cid → AGG_COLS, ricalcolata solo per i clienti toccati da una modifica."""
+
+    def __init__(self, model, table: pd.DataFrame):
+        self.model = model
+        self.table = table
+        self._ct_cid = model.contratti["_cid"].copy()   # cliente di ogni contratto all'ultimo aggiornamento
+        self._indice: DateIndex | None = None
+
+    @classmethod
+    def build(cls, model) -> "ClienteAggregati":
+        return cls(model, _aggrega(model.contratti))
+
+    def update_row(self, table: str, idx, row: pd.Series) -> None:
+        if table != "contratti":
+            return
+        toccati = {self._ct_cid.get(idx, ""), row["_cid"]} - {""}
+        self._ct_cid[idx] = row["_cid"]
+        self._indice = None
+        for cid in toccati:
+            nuovo = _aggrega(self.model.contratti_di(cid))
+            if cid in nuovo.index:
+                self.table.loc[cid, AGG_COLS] = nuovo.loc[cid, AGG_COLS].to_numpy()
+            elif cid in self.table.index:
+                self.table = self.table.drop(index=cid)
+
+    def indice_scadenze(self) -> DateIndex:
+        """PrimaScadenza ordinata → _cid (ricostruito solo dopo una modifica)."""
+        if self._indice is None:
+            self._indice = DateIndex.build(self.table["PrimaScadenza"])
+        return self._indice
+
+    def clienti(self) -> pd.DataFrame:
+        """model.clienti con le colonne aggregate (clienti senza contratti attivi: 0 / NaT)."""
+        out = self.model.clienti.join(self.table, on="_cid")
+        out["ContrattiAttivi"] = out["ContrattiAttivi"].fillna(0).astype(np.int64)
+        out["RataMensile"] = out["RataMensile"].fillna(0.0)
+        return out
@@ -0,0 +1,317 @@
+# =====================================
+# csv_merge.py — merge a tre vie (base / locale / remoto) dei CSV sincronizzati
+# =====================================
+# Ad ogni sincronizzazione il file remoto non sovrascrive più il locale:
+#   • base    = ultima versione remota sincronizzata (storage/.sync_base/)
+#   • locale  = file in storage/ con le modifiche fatte nel frattempo
+#   • remoto  = file appena scaricato
+# Le righe sono confrontate per chiave (ClienteID, NumeroContratto, …) tramite
+# hash vettorizzati: modifiche da un solo lato si applicano da sole, le
+# modifiche incompatibili dai due lati diventano conflitti da risolvere.
+#
+# Benchmark:  python csv_merge.py [--rows 50000]
+# =====================================
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+STORAGE_DIR = Path(__file__).parent / "storage"
+BASE_DIR = STORAGE_DIR / ".sync_base"
+
+# Chiavi di riga per file (nome remoto → colonne chiave)
+MERGE_KEYS = {
+    "clienti.csv": ["ClienteID"],
+    "contratti.csv": ["ClienteID", "NumeroContratto"],
+    "preventivi.csv": ["NumeroOfferta"],
+}
+
+KEY_COL = "_key"
+SIDE_COL = "_lato"
+
+
+@dataclass
+class MergeResult:
+    merged: pd.DataFrame
+    conflicts: pd.DataFrame
+    stats: dict = field(default_factory=dict)
+
+
+# =====================================
+# LETTURA / SCRITTURA
+# =====================================
+def read_csv_any(path: Path) -> pd.DataFrame:
+    """Legge un CSV testuale (separatore ; o , rilevato dalla prima riga)."""
+    path = Path(path)
+    if not path.exists() or path.stat().st_size == 0:
+        return pd.DataFrame()
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        head = f.readline()
+    sep = ";" if head.count(";") > head.count(",") else ","
+    return pd.read_csv(path, dtype=str, sep=sep, encoding="utf-8-sig", on_bad_lines="skip").fillna("")
+
+
+# Chiave surrogata: usata al posto di MERGE_KEYS quando tutti i file la hanno già
+SURROGATE_KEYS = {"contratti.csv": "ContrattoID"}
+
+
+def merge_key_cols(name: str, *frames: pd.DataFrame) -> list[str]:
+    name = Path(name).name
+    sk = SURROGATE_KEYS.get(name)
+    frames = [f for f in frames if not f.empty]
+    if sk and frames and all(sk in f.columns and (f[sk].fillna("").astype(str).str.strip() != "").all() for f in frames):
+        return [sk]
+    return MERGE_KEYS.get(name, ["ClienteID"])
+
+
+def base_path(name: str) -> Path:
+    return BASE_DIR / name
+
+
+def conflicts_path(name: str) -> Path:
+    return BASE_DIR / f"{name}.conflicts.csv"
+
+
+# =====================================
+# HASH E CHIAVI (vettorizzati)
+# =====================================
+def _row_keys(df: pd.DataFrame, key_cols: list[str]) -> pd.Index:
+    """
+    Chiave di riga come hash uint64 delle colonne chiave normalizzate, più il
+    numero di occorrenza (così le chiavi duplicate restano distinte e stabili).
+    """
+    if df.empty:
+        return pd.Index(np.zeros(0, dtype=np.uint64))
+    keys = pd.DataFrame(index=df.index)
+    for c in key_cols:
+        s = df[c] if c in df.columns else pd.Series("", index=df.index)
+        if c == "ClienteID":
+            # normalizzo solo i valori distinti (molti contratti per cliente)
+            codes, uniq = pd.factorize(s)
+            norm = pd.Index(uniq).str.strip().str.lstrip("0").str.upper()
+            s = pd.Series(norm.to_numpy()[codes] if len(uniq) else s.to_numpy(), index=df.index)
+        keys[c] = s
+    h = pd.util.hash_pandas_object(keys, index=False, categorize=False)
+    occ = h.groupby(h.to_numpy()).cumcount()
+    return pd.Index(pd.util.hash_pandas_object(pd.DataFrame({"h": h, "o": occ}), index=False, categorize=False).to_numpy())
+
+
+def _row_hashes(df: pd.DataFrame, cols: list[str]) -> np.ndarray:
+    if df.empty:
+        return np.zeros(0, dtype=np.uint64)
+    return pd.util.hash_pandas_object(df.reindex(columns=cols, fill_value=""), index=False, categorize=False).to_numpy()
+
+
+# =====================================
+# MERGE A TRE VIE
+# =====================================
+def three_way_merge(base: pd.DataFrame, local: pd.DataFrame, remote: pd.DataFrame,
+                    key_cols: list[str]) -> MergeResult:
+    """
+    Confronta base/locale/remoto riga per riga (per chiave) senza loop Python.
+    In caso di conflitto il merge conserva la riga locale e riporta entrambe
+    le versioni in `conflicts` (colonne _key, _lato = 'locale' | 'remoto').
+    """
+    t0 = time.perf_counter()
+    cols = list(dict.fromkeys([*local.columns, *remote.columns, *base.columns]))
+
+    frames = {}
+    for tag, df in (("B", base), ("L", local), ("R", remote)):
+        df = df.reindex(columns=cols, fill_value="").reset_index(drop=True)
+        frames[tag] = (df, pd.Series(_row_hashes(df, cols), index=_row_keys(df, key_cols)))
+
+    # Ordine di uscita: prima le chiavi locali, poi le nuove remote
+    keys = frames["L"][1].index.append(frames["R"][1].index.difference(frames["L"][1].index, sort=False))
+    keys = keys.append(frames["B"][1].index.difference(keys, sort=False))
+
+    def align(tag):
+        h = frames[tag][1]
+        present = keys.isin(h.index)
+        hashes = h.reindex(keys, fill_value=np.uint64(0)).to_numpy(dtype=np.uint64)
+        return present, hashes
+
+    inB, hB = align("B")
+    inL, hL = align("L")
+    inR, hR = align("R")
+
+    changedL = (inL != inB) | (inL & (hL != hB))
+    changedR = (inR != inB) | (inR & (hR != hB))
+    same_LR = (inL == inR) & (~inL | (hL == hR))
+    conflict = changedL & changedR & ~same_LR
+
+    take_remote = changedR & ~changedL
+    keep = np.where(take_remote, inR, inL)
+
+    # --- righe di uscita: posizione nel frame di origine ---
+    posL = pd.Series(np.arange(len(frames["L"][0])), index=frames["L"][1].index)
+    posR = pd.Series(np.arange(len(frames["R"][0])), index=frames["R"][1].index)
+    from_local = keep & ~take_remote
+    from_remote = keep & take_remote
+
+    out_keys = keys[keep]
+    rows_L = frames["L"][0].iloc[posL.reindex(keys[from_local]).to_numpy()]
+    rows_R = frames["R"][0].iloc[posR.reindex(keys[from_remote]).to_numpy()]
+    merged = pd.concat([
+        rows_L.set_axis(keys[from_local]),
+        rows_R.set_axis(keys[from_remote]),
+    ]).reindex(out_keys).reset_index(drop=True)
+
+    # --- conflitti: versione locale e remota affiancate ---
+    ck = keys[conflict]
+    c_local = frames["L"][0].iloc[posL.reindex(ck).dropna().astype(int).to_numpy()].copy()
+    c_local.insert(0, SIDE_COL, "locale")
+    c_local.insert(0, KEY_COL, posL.reindex(ck).dropna().index)
+    c_remote = frames["R"][0].iloc[posR.reindex(ck).dropna().astype(int).to_numpy()].copy()
+    c_remote.insert(0, SIDE_COL, "remoto")
+    c_remote.insert(0, KEY_COL, posR.reindex(ck).dropna().index)
+    conflicts = pd.concat([c_local, c_remote], ignore_index=True)
+    # conflitti modifica/eliminazione: segnalo il lato mancante con una riga vuota
+    missing = pd.DataFrame({KEY_COL: ck[~(inL[conflict] & inR[conflict])]})
+    if not missing.empty:
+        missing[SIDE_COL] = np.where(missing[KEY_COL].isin(c_local[KEY_COL]), "remoto", "locale")
+        missing[SIDE_COL] = missing[SIDE_COL] + " (eliminato)"
+        conflicts = pd.concat([conflicts, missing], ignore_index=True)
+    conflicts = conflicts.sort_values([KEY_COL, SIDE_COL], kind="stable").reset_index(drop=True)
+
+    stats = {
+        "righe": len(merged),
+        "da_locale": int((changedL & ~changedR).sum()),
+        "da_remoto": int(take_remote.sum()),
+        "conflitti": int(conflict.sum()),
+        "ms": (time.perf_counter() - t0) * 1000,
+    }
+    return MergeResult(merged, conflicts.fillna(""), stats)
+
+
+# =====================================
+# PIPELINE DI SINCRONIZZAZIONE
+# =====================================
+def controlla_remoto(name: str, remote: pd.DataFrame, local: pd.DataFrame | None = None,
+                     key_cols: list[str] | None = None) -> None:
+    """
+    ValueError se il file scaricato non può essere la copia remota di `name`
+    (vuoto, senza le colonne chiave, nessuna colonna in comune col locale):
+    in quel caso nulla va scritto, né il locale né la base né i conflitti.
+    """
+    key_cols = key_cols or MERGE_KEYS.get(Path(name).name, ["ClienteID"])
+    if remote.empty:
+        raise ValueError(f"{name}: file remoto vuoto, sincronizzazione annullata")
+    mancanti = [c for c in key_cols if c not in remote.columns]
+    if mancanti:
+        raise ValueError(f"{name}: file remoto senza colonne chiave {', '.join(mancanti)}, sincronizzazione annullata")
+    if local is not None and len(local.columns) and not set(local.columns) & set(remote.columns):
+        raise ValueError(f"{name}: file remoto senza colonne in comune con il locale, sincronizzazione annullata")
+
+
+def merge_synced_file(name: str, local_path: Path, remote_tmp: Path) -> MergeResult:
+    """
+    Merge del file remoto appena scaricato con il locale.
+    Scrive il risultato in local_path, aggiorna la base e salva i conflitti.
+    Alla prima sincronizzazione (nessuna base) vince il remoto, come prima.
+    Un remoto non valido (controlla_remoto) solleva ValueError senza scrivere nulla.
+    """
+    remote = read_csv_any(remote_tmp)
+    local = read_csv_any(local_path)
+    bp = base_path(name)
+    base = read_csv_any(bp) if bp.exists() else local
+    key_cols = merge_key_cols(name, base, local, remote)
+    controlla_remoto(name, remote, local, key_cols)
+
+    res = three_way_merge(base, local, remote, key_cols)
+    res.merged.to_csv(local_path, index=False, encoding="utf-8-sig")
+
+    bp.parent.mkdir(parents=True, exist_ok=True)
+    remote.to_csv(bp, index=False, encoding="utf-8-sig")
+    cp = conflicts_path(name)
+    if res.conflicts.empty:
+        cp.unlink(missing_ok=True)
+    else:
+        res.conflicts.to_csv(cp, index=False, encoding="utf-8-sig")
+    res.stats["locale_modificato"] = not res.merged.equals(remote.reindex(columns=res.merged.columns, fill_value=""))
+    return res
+
+
+def pending_conflicts() -> dict[str, pd.DataFrame]:
+    """Conflitti ancora da risolvere, per nome remoto."""
+    out = {}
+    if BASE_DIR.exists():
+        for p in sorted(BASE_DIR.rglob("*.conflicts.csv")):
+            name = p.relative_to(BASE_DIR).as_posix()[: -len(".conflicts.csv")]
+            out[name] = read_csv_any(p)
+    return out
+
+
+def resolve_conflicts(name: str, local_path: Path, choices: dict[str, str]) -> int:
+    """
+    Applica le scelte {chiave: 'locale' | 'remoto'} al file locale.
+    Le chiavi non indicate restano in sospeso. Ritorna le righe modificate.
+    """
+    cp = conflicts_path(name)
+    conflicts = read_csv_any(cp)
+    if conflicts.empty:
+        return 0
+    local = read_csv_any(local_path)
+    data = conflicts.drop(columns=[KEY_COL, SIDE_COL], errors="ignore")
+    keys = pd.Series(_row_keys(local, merge_key_cols(name, local, data)), index=local.index)
+    data_cols = [c for c in conflicts.columns if c not in (KEY_COL, SIDE_COL)]
+
+    changed = 0
+    for key, side in choices.items():
+        if side != "remoto":
+            continue
+        remote_row = conflicts[(conflicts[KEY_COL] == key) & (conflicts[SIDE_COL] == "remoto")]
+        hit = np.flatnonzero(keys.to_numpy() == np.uint64(key))
+        if remote_row.empty:  # eliminato in remoto
+            local = local.drop(local.index[hit])
+            keys = keys.drop(keys.index[hit])
+        elif len(hit):
+            local.loc[local.index[hit[0]], data_cols] = remote_row[data_cols].iloc[0].to_numpy()
+        else:
+            local = pd.concat([local, remote_row[data_cols]], ignore_index=True)
+        changed += 1
+
+    local.to_csv(local_path, index=False, encoding="utf-8-sig")
+    rest = conflicts[~conflicts[KEY_COL].isin(list(choices))]
+    if rest.empty:
+        cp.unlink(missing_ok=True)
+    else:
+        rest.to_csv(cp, index=False, encoding="utf-8-sig")
+    return changed
+
+
+# =====================================
+# ⏱️ BENCHMARK
+# =====================================
+def _synthetic(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "ClienteID": (rng.integers(1, n // 3 + 2, n)).astype(str),
+        "NumeroContratto": rng.integers(10_000_000, 99_999_999, n).astype(str),
+        "DescrizioneProdotto": rng.choice(["KYOCERA TASKALFA", "CENTRALINO YEASTAR", "EPSON AM-C4000"], n),
+        "TotRata": rng.integers(50, 900, n).astype(str),
+        "Stato": rng.choice(["aperto", "chiuso"], n),
+    })
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Benchmark merge a tre vie")
+    ap.add_argument("--rows", type=int, default=50_000)
+    args = ap.parse_args()
+
+    base = _synthetic(args.rows)
+    local = base.copy()
+    remote = base.copy()
+    idx = np.random.default_rng(1).permutation(len(base))
+    local.loc[idx[:500], "TotRata"] = "999"
+    remote.loc[idx[250:750], "Stato"] = "chiuso"
+    remote = pd.concat([remote, _synthetic(200, seed=2)], ignore_index=True)
+
+    for _ in range(2):  # la prima esecuzione scalda le cache
+        res = three_way_merge(base, local, remote, MERGE_KEYS["contratti.csv"])
+    print(f"{args.rows} righe → {res.stats}")
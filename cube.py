@@ -0,0 +1,84 @@
+# =====================================
+# cube.py — cubo di aggregazione dei contratti (Dashboard Grafica)
+# =====================================
+# Una cella per combinazione di (mese DataInizio, mese DataFine, Stato, TMK,
+# Città, CAP, Durata, "ha N° contratto" + flag di qualità) con numero di
+# contratti e somma rata. Costruito una volta per versione dati
+# (CRMModel.cubo): i filtri della pagina diventano maschere sulle celle e i
+# grafici somme per dimensione, senza ripartire dai contratti grezzi.
+# =====================================
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+DIMS = ["MeseInizio", "MeseFine", "Stato", "TMK", "Citta", "CAP", "Durata",
+        "ConNumero", "SenzaFine", "FinePrima", "RataZero"]
+
+
+def _mese(s: pd.Series) -> pd.Series:
+    return s.dt.to_period("M").dt.to_timestamp()
+
+
+class CuboContratti:
+    def __init__(self, celle: pd.DataFrame, cella: pd.Series, geo: dict[str, pd.Series]):
+        self.celle = celle      # DIMS + n (contratti) + rata (somma TotRata), indice = id cella
+        self.cella = cella      # etichetta contratto → id cella
+        self.geo = geo          # "Citta" / "CAP" / "TMK" → clienti distinti per valore
+
+    @classmethod
+    def build(cls, model) -> "CuboContratti":
+        v = model.contratti_view()
+        di, df_ = v["DataInizio_dt"], v["DataFine_dt"]
+        dims = pd.DataFrame({
+            "MeseInizio": _mese(di),
+            "MeseFine": _mese(df_),
+            "Stato": v["Stato_n"],
+            "TMK": v["TMK"].fillna("").astype(str).str.strip(),
+            "Citta": v["Citta"].fillna("").astype(str).str.strip(),
+            "CAP": v["CAP"].fillna("").astype(str).str.strip(),
+            "Durata": pd.to_numeric(v["Durata"], errors="coerce"),
+            "ConNumero": v["NumeroContratto"].fillna("").astype(str).str.strip() != "",
+            "SenzaFine": di.notna() & df_.isna(),
+            "FinePrima": di.notna() & df_.notna() & (df_ < di),
+            "RataZero": v["TotRata_n"].fillna(0) <= 0,
+        }, index=v.index)
+        cella = dims.groupby(DIMS, dropna=False, sort=False).ngroup()
+        g = dims.assign(n=1, rata=v["TotRata_n"].fillna(0.0)).groupby(cella.to_numpy(), sort=True)
+        celle = g[DIMS].first().join(g[["n", "rata"]].sum())
+
+        cli = model.clienti
+        geo = {}
+        for col in ("Citta", "CAP", "TMK"):
+            val = cli[col].fillna("").astype(str).str.strip()
+            geo[col] = (cli["ClienteID"][val != ""].groupby(val[val != ""]).nunique()
+                        .sort_values(ascending=False).rename("Clienti"))
+        return cls(celle, cella, geo)
+
+    # --- filtri: sottoinsiemi di celle ---
+    def filtra(self, inizio_da=None, stati=None, tmk=None, solo_con_num=False) -> pd.DataFrame:
+        c = self.celle
+        mask = np.ones(len(c), dtype=bool)
+        if inizio_da is not None:
+            mask &= (c["MeseInizio"].isna() | (c["MeseInizio"] >= pd.Timestamp(inizio_da))).to_numpy()
+        if stati:
+            mask &= c["Stato"].isin(stati).to_numpy()
+        if tmk:
+            mask &= (c["TMK"] == tmk).to_numpy()
+        if solo_con_num:
+            mask &= c["ConNumero"].to_numpy()
+        return c[mask]
+
+    def righe(self, celle: pd.DataFrame) -> pd.Index:
+        """Etichette dei contratti che cadono nelle celle indicate (per gli elenchi di dettaglio)."""
+        return self.cella.index[self.cella.isin(celle.index)]
+
+    # --- misure ---
+    @staticmethod
+    def per(celle: pd.DataFrame, dim: str, misura: str = "n") -> pd.Series:
+        """Somma della misura per valore della dimensione (valori mancanti esclusi)."""
+        return celle.groupby(dim)[misura].sum()
+
+    @staticmethod
+    def totale(celle: pd.DataFrame, misura: str = "n", where: pd.Series | None = None):
+        return celle[misura][where].sum() if where is not None else celle[misura].sum()
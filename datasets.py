@@ -0,0 +1,198 @@
+# =====================================
+# datasets.py — registro dei dataset per proprietario (agente)
+# =====================================
+# Ogni agente ha una cartella con il suo clienti.csv e contratti.csv.
+# Il registro si configura in secrets.toml, una sezione per agente:
+#   [datasets.gabriele]
+#   label = "Gabriele"
+#   dir = "gabriele"            # relativo a storage/ ("" = storage/)
+#   users = ["gabriele"]        # utenti che vedono solo questo dataset
+# Senza [datasets] restano Fabio (storage/) e Gabriele (storage/gabriele/):
+# aggiungere un agente è configurazione, non codice.
+#
+# Le tabelle si leggono solo per i dataset della vista scelta, in parallelo,
+# e restano in memoria finché il file non cambia (mtime + dimensione).
+# La vista "Tutti" è l'unione dei membri, ricalcolata solo se uno cambia.
+# =====================================
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+import streamlit as st
+
+from contratti_store import OWNER_COL
+
+STORAGE_DIR = Path(__file__).parent / "storage"
+TABELLE = ("clienti", "contratti")
+TUTTI = "Tutti"
+DEFAULT_OWNER = "fabio"
+
+
+@dataclass(frozen=True)
+class Dataset:
+    owner: str                  # chiave interna (valore della colonna _owner)
+    label: str                  # nome mostrato nella scelta vista
+    dir: Path
+    users: tuple[str, ...] = field(default=())
+
+    def path(self, tabella: str) -> Path:
+        return self.dir / f"{tabella}.csv"
+
+    @property
+    def clienti(self) -> Path:
+        return self.path("clienti")
+
+    @property
+    def contratti(self) -> Path:
+        return self.path("contratti")
+
+    def sync_files(self) -> dict[str, Path]:
+        """Chiavi dei link remoti: 'clienti' per il dataset principale, '<owner>_clienti' per gli altri."""
+        prefix = "" if self.dir == STORAGE_DIR else f"{self.owner}_"
+        return {f"{prefix}{t}": self.path(t) for t in TABELLE}
+
+
+def _load_registry() -> dict[str, Dataset]:
+    conf = dict(st.secrets.get("datasets", {}) or {})
+    if not conf:
+        conf = {
+            "fabio": {"label": "Fabio", "dir": ""},
+            "gabriele": {"label": "Gabriele", "dir": "gabriele", "users": ["gabriele"]},
+        }
+    registry = {}
+    for owner, c in conf.items():
+        owner, sub = owner.lower(), c.get("dir", owner)
+        ds = Dataset(
+            owner=owner,
+            label=c.get("label", owner.capitalize()),
+            dir=STORAGE_DIR / sub if sub else STORAGE_DIR,
+            users=tuple(u.lower() for u in c.get("users", [])),
+        )
+        ds.dir.mkdir(parents=True, exist_ok=True)
+        registry[owner] = ds
+    return registry
+
+
+DATASETS: dict[str, Dataset] = _load_registry()
+
+
+def dataset(owner: str | None) -> Dataset:
+    """Dataset del proprietario (quello principale se vuoto o sconosciuto)."""
+    return DATASETS.get(str(owner or "").lower()) or DATASETS.get(DEFAULT_OWNER) or next(iter(DATASETS.values()))
+
+
+def owner_for_user(user: str) -> str:
+    """Proprietario dei dati dell'utente: il dataset che lo elenca in 'users', altrimenti il principale."""
+    user = (user or "").lower().strip()
+    return next((o for o, ds in DATASETS.items() if user in ds.users), dataset(None).owner)
+
+
+def view_labels() -> list[str]:
+    return [ds.label for ds in DATASETS.values()] + [TUTTI]
+
+
+def view_owners(label: str) -> list[str]:
+    if label == TUTTI:
+        return list(DATASETS)
+    return [o for o, ds in DATASETS.items() if ds.label == label] or [dataset(None).owner]
+
+
+# =====================================
+# CARICAMENTO PIGRO, PARALLELO E IN CACHE
+# =====================================
+Reader = Callable[[Path], pd.DataFrame]
+
+_LOCK = threading.Lock()
+_TABLES: dict[tuple[str, str], tuple[tuple, pd.DataFrame]] = {}   # (owner, tabella) → (firma, df)
+_UNIONS: dict[tuple, tuple[tuple, pd.DataFrame]] = {}             # (owners, tabella) → (firme, df)
+
+
+def _signature(path: Path) -> tuple:
+    try:
+        s = path.stat()
+        return (s.st_mtime_ns, s.st_size)
+    except FileNotFoundError:
+        return (None, None)
+
+
+def _read(owner: str, tabella: str, reader: Reader) -> pd.DataFrame:
+    df = reader(dataset(owner).path(tabella))
+    df[OWNER_COL] = owner
+    return df
+
+
+def load_view(label: str, readers: dict[str, Reader]) -> tuple[pd.DataFrame, pd.DataFrame, list[str]]:
+    """
+    (clienti, contratti, errori) della vista: legge (in parallelo) solo i file
+    cambiati dall'ultima volta. I DataFrame restituiti sono copie: le pagine
+    possono modificarli senza toccare la cache. df.attrs["owners"] elenca i
+    dataset della vista, per i salvataggi per proprietario; df.attrs["versione"]
+    è la versione dati dalle firme lette (None se un file non si è letto).
+    """
+    owners = view_owners(label)
+    sigs = {(o, t): _signature(dataset(o).path(t)) for o in owners for t in TABELLE}
+    with _LOCK:
+        stale = [k for k, sig in sigs.items() if k not in _TABLES or _TABLES[k][0] != sig]
+
+    errori = []
+    if stale:
+        with ThreadPoolExecutor(max_workers=min(8, len(stale))) as pool:
+            futures = {k: pool.submit(_read, k[0], k[1], readers[k[1]]) for k in stale}
+        for k, fut in futures.items():
+            try:
+                df = fut.result()
+            except Exception as e:
+                errori.append(f"{dataset(k[0]).label} / {k[1]}: {e}")
+                # tabella vuota con le colonne standard; firma fittizia → si riprova al prossimo rerun
+                df = readers[k[1]](dataset(k[0]).dir / ".mancante.csv").assign(**{OWNER_COL: k[0]})
+                sigs[k] = (None, "errore")
+            with _LOCK:
+                _TABLES[k] = (sigs[k], df)
+
+    versione = None if errori else _versione(sigs)
+    out = []
+    for t in TABELLE:
+        keys = [(o, t) for o in owners]
+        firme = tuple(sigs[k] for k in keys)
+        with _LOCK:
+            cached = _UNIONS.get((tuple(owners), t))
+            if cached is None or cached[0] != firme:
+                parts = [_TABLES[k][1] for k in keys]
+                df = parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+                _UNIONS[(tuple(owners), t)] = cached = (firme, df)
+        df = cached[1].copy()
+        df.attrs["owners"] = list(owners)
+        df.attrs["versione"] = versione
+        out.append(df)
+    return out[0], out[1], errori
+
+
+def _versione(sigs: dict) -> str:
+    return "|".join(f"{o}/{t}:{m}:{n}" for (o, t), (m, n) in sigs.items())
+
+
+def view_version(owners: list[str]) -> str:
+    """
+    Versione dati dei dataset (df.attrs["owners"]) dalle firme attuali dei
+    file: un os.stat per file invece dell'hash dei DataFrame. Da rileggere
+    dopo un salvataggio in memoria senza rerun completo (es. nei fragment).
+    """
+    return _versione({(o, t): _signature(dataset(o).path(t)) for o in owners for t in TABELLE})
+
+
+def split_by_owner(df: pd.DataFrame, tabella: str):
+    """
+    (percorso, righe) per ogni dataset della vista: ogni proprietario riceve
+    solo le sue righe. Le righe nuove senza proprietario vanno al primo
+    dataset della vista.
+    """
+    owners = list(df.attrs.get("owners") or [dataset(None).owner])
+    col = df[OWNER_COL].fillna("").replace("", owners[0]) if OWNER_COL in df.columns \
+        else pd.Series(owners[0], index=df.index)
+    for owner in dict.fromkeys([*owners, *col.unique()]):
+        yield dataset(owner).path(tabella), df[col == owner]
@@ -0,0 +1,569 @@
+# =====================================
+# exports.py — esportazioni contratti (Excel / PDF), senza Streamlit
+# =====================================
+# I builder ricevono i contratti già filtrati e restituiscono i byte del
+# file: si possono usare dalla pagina Contratti, da Impostazioni o da riga
+# di comando (python exports.py pdf-batch …). La pagina li chiama solo quando l'utente chiede l'export e
+# tiene il risultato in EXPORT_CACHE, chiave (cliente, versione dati, tipo):
+# i rerun e i download ripetuti non rigenerano nulla.
+# =====================================
+from __future__ import annotations
+
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from io import BytesIO
+from typing import Callable, Iterable
+
+import pandas as pd
+
+from contratti_store import OWNER_COL
+from crm_model import parse_dates
+from importi import format_euro, parse_euro
+
+LOGO_URL = "https://www.shtsrl.com/template/images/logo.png"
+
+# colonne della scheda contratti (campo → intestazione)
+COLONNE = [
+    ("NumeroContratto", "N°"), ("DataInizio", "Inizio"), ("DataFine", "Fine"), ("Durata", "Durata"),
+    ("DescrizioneProdotto", "Descrizione Prodotto"), ("TotRata", "Tot. Rata"), ("NOL_FIN", "NOL FIN"),
+    ("NOL_INT", "NOL INT"), ("CopieBN", "Copie B/N"), ("EccBN", "Ecc. B/N"), ("CopieCol", "Copie Col"),
+    ("EccCol", "Ecc. Col"),
+]
+HEADERS = [h for _, h in COLONNE]
+
+
+def safe_text(txt):
+    """Rimuove caratteri non compatibili con PDF latin-1"""
+    if pd.isna(txt) or txt is None: return ""
+    s = str(txt)
+    replacements = {"€": "EUR", "–": "-", "—": "-", "“": '"', "”": '"', "‘": "'", "’": "'"}
+    for k, v in replacements.items():
+        s = s.replace(k, v)
+    return s.encode("latin-1", "replace").decode("latin-1")
+
+
+def righe_export(ct: pd.DataFrame) -> pd.DataFrame:
+    """Contratti → colonne testuali di COLONNE (date gg/mm/aaaa, rata in euro), per colonna intera."""
+    out = pd.DataFrame(index=ct.index)
+    for campo, _ in COLONNE:
+        col = ct[campo] if campo in ct else pd.Series("", index=ct.index)
+        if campo in ("DataInizio", "DataFine"):
+            out[campo] = parse_dates(col).dt.strftime("%d/%m/%Y").fillna("")
+        elif campo == "TotRata":
+            out[campo] = format_euro(parse_euro(col))
+        else:
+            out[campo] = col.fillna("").astype(str)
+    out["Chiuso"] = ct["Stato"].fillna("").astype(str).str.strip().str.lower().eq("chiuso") \
+        if "Stato" in ct else False
+    return out
+
+
+_LOGO: list = []   # [percorso del logo o None], riempito alla prima richiesta del processo
+
+
+def _logo() -> str | None:
+    """Logo SHT salvato in un file temporaneo (fpdf 1.7 vuole un percorso), scaricato una volta per processo."""
+    if not _LOGO:
+        path = None
+        try:
+            import requests
+            resp = requests.get(LOGO_URL, timeout=5)
+            if resp.status_code == 200:
+                path = os.path.join(tempfile.gettempdir(), "sht_logo.png")
+                with open(path, "wb") as f:
+                    f.write(resp.content)
+        except Exception:
+            path = None
+        _LOGO.append(path)
+    return _LOGO[0]
+
+
+# =====================================
+# CACHE DEI FILE GENERATI (LRU con tetto di memoria)
+# =====================================
+class ByteCache:
+    """LRU chiave → bytes; oltre max_bytes esce il meno usato di recente."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data: OrderedDict[tuple, bytes] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> bytes | None:
+        with self._lock:
+            data = self._data.get(key)
+            if data is not None:
+                self._data.move_to_end(key)
+            return data
+
+    def put(self, key: tuple, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            self._size -= len(old) if old is not None else 0
+            self._data[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, out = self._data.popitem(last=False)
+                self._size -= len(out)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+EXPORT_CACHE = ByteCache(max_bytes=64 * 1024 * 1024)
+
+
+# =====================================
+# EXCEL — xlsxwriter in constant_memory
+# =====================================
+# Le righe vanno su disco man mano (memoria costante anche con 100k
+# contratti), i formati sono creati una volta e condivisi, le righe dei
+# contratti chiusi si colorano con una formattazione condizionale sulla
+# colonna Stato invece che cella per cella. Date e rata sono valori Excel
+# veri (data gg/mm/aaaa, numero in €), non testo.
+_EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+_NUMERICHE = {"DataInizio": "data", "DataFine": "data", "TotRata": "euro"}
+_LARGHEZZE = [10, 12, 12, 8, 60, 14, 14, 14, 10, 10, 10, 10, 10]
+
+
+def righe_excel(ct: pd.DataFrame) -> list[list]:
+    """Colonne di COLONNE + Stato come liste: date in seriale Excel, rata float, None se mancanti."""
+    out = []
+    for campo, _ in COLONNE:
+        col = ct[campo] if campo in ct else pd.Series("", index=ct.index)
+        if _NUMERICHE.get(campo) == "data":
+            v = (parse_dates(col) - _EXCEL_EPOCH) / pd.Timedelta(days=1)
+        elif campo == "TotRata":
+            v = parse_euro(col)
+        else:
+            out.append(col.fillna("").astype(str).tolist())
+            continue
+        out.append(v.astype(object).where(v.notna(), None).tolist())
+    stato = ct["Stato"] if "Stato" in ct else pd.Series("", index=ct.index)
+    out.append(stato.fillna("").astype(str).str.strip().str.lower().tolist())
+    return out
+
+
+class _FoglioContratti:
+    """Un foglio con blocchi (titolo, intestazioni, contratti) scritti in ordine di riga."""
+
+    def __init__(self, wb, nome: str):
+        self.ws = wb.add_worksheet(nome[:31])
+        self.row = 0
+        base = {"border": 1, "valign": "top", "align": "center"}
+        self.f = {
+            "titolo": wb.add_format({"bold": True, "font_size": 14}),
+            "blocco": wb.add_format({"bold": True, "font_size": 11, "font_color": "#2563EB"}),
+            "header": wb.add_format({**base, "bold": True, "bg_color": "#FFFDE7", "valign": "vcenter", "text_wrap": True}),
+            "testo": wb.add_format(base),
+            "descr": wb.add_format({**base, "align": "left", "text_wrap": True}),
+            "data": wb.add_format({**base, "num_format": "dd/mm/yyyy"}),
+            "euro": wb.add_format({**base, "num_format": '#,##0.00 "€"'}),
+            "chiuso": wb.add_format({"bg_color": "#FFCDD2"}),
+        }
+        self.formati = [self.f[_NUMERICHE.get(c, "descr" if c == "DescrizioneProdotto" else "testo")]
+                        for c, _ in COLONNE] + [self.f["testo"]]
+        for i, w in enumerate(_LARGHEZZE):
+            self.ws.set_column(i, i, w)
+        self._primo_dato = None
+
+    def titolo(self, testo: str, formato: str = "titolo", altezza: float = 25) -> None:
+        self.ws.set_row(self.row, altezza)
+        self.ws.write_string(self.row, 0, testo, self.f[formato])
+        self.row += 1
+
+    def blocco(self, colonne: list[list], da: int = 0, a: int | None = None) -> None:
+        """Intestazioni + righe [da, a) delle colonne preparate da righe_excel."""
+        ws, formati = self.ws, self.formati
+        ws.set_row(self.row, 30)
+        ws.write_row(self.row, 0, HEADERS + ["Stato"], self.f["header"])
+        self.row += 1
+        if self._primo_dato is None:
+            self._primo_dato = self.row
+        descr = colonne[4]
+        for i in range(da, len(descr) if a is None else a):
+            r = self.row
+            ws.set_row(r, 22 + (len(descr[i]) // 70) * 10)
+            for c, col in enumerate(colonne):
+                v = col[i]
+                if v is None:
+                    ws.write_blank(r, c, None, formati[c])
+                elif isinstance(v, str):
+                    ws.write_string(r, c, v, formati[c])
+                else:
+                    ws.write_number(r, c, v, formati[c])
+            self.row += 1
+
+    def chiudi(self) -> None:
+        """Evidenzia i contratti chiusi (una regola sola su tutte le righe dati)."""
+        if self._primo_dato is not None and self.row > self._primo_dato:
+            stato = xl_col(len(HEADERS))
+            self.ws.conditional_format(self._primo_dato, 0, self.row - 1, len(HEADERS), {
+                "type": "formula", "criteria": f'=${stato}{self._primo_dato + 1}="chiuso"', "format": self.f["chiuso"],
+            })
+
+
+def xl_col(i: int) -> str:
+    from xlsxwriter.utility import xl_col_to_name
+    return xl_col_to_name(i)
+
+
+def _workbook(dest):
+    import xlsxwriter
+    return xlsxwriter.Workbook(dest, {"constant_memory": True, "strings_to_numbers": False})
+
+
+def contratti_excel(rag_soc: str, ct: pd.DataFrame) -> bytes:
+    """Scheda contratti di un cliente (.xlsx)."""
+    bio = BytesIO()
+    wb = _workbook(bio)
+    foglio = _FoglioContratti(wb, f"Contratti {rag_soc}")
+    foglio.titolo(f"Contratti Cliente: {rag_soc} — Data: {datetime.now():%d/%m/%Y}")
+    foglio.blocco(righe_excel(ct))
+    foglio.chiudi()
+    wb.close()
+    return bio.getvalue()
+
+
+def portafoglio_excel(dest, ct: pd.DataFrame, titolo: str = "Portafoglio contratti") -> None:
+    """
+    Tutti i contratti di `ct` in un unico file (percorso o file-like), un
+    blocco per cliente in ordine di ragione sociale. `ct` deve avere le
+    colonne ClienteID e Cliente (come CRMModel.contratti_view()).
+    """
+    wb = _workbook(dest)
+    foglio = _FoglioContratti(wb, "Portafoglio")
+    foglio.titolo(f"{titolo} — Data: {datetime.now():%d/%m/%Y} — {len(ct)} contratti")
+    # ordine per ragione sociale, contratti dello stesso cliente contigui; colonne preparate una volta sola
+    chiave = ct["Cliente"].fillna("").astype(str).str.lower()
+    ct = ct.iloc[pd.DataFrame({"k": chiave, "id": ct["ClienteID"]}).sort_values(["k", "id"], kind="stable").index.map(ct.index.get_loc)]
+    colonne = righe_excel(ct)
+    ids, nomi = ct["ClienteID"].tolist(), ct["Cliente"].fillna("").astype(str).tolist()
+    inizi = [i for i in range(len(ids)) if i == 0 or ids[i] != ids[i - 1]] + [len(ids)]
+    for da, a in zip(inizi, inizi[1:]):
+        foglio.row += 1
+        foglio.titolo(f"{nomi[da]} (ID {ids[da]}) — {a - da} contratti", "blocco", 18)
+        foglio.blocco(colonne, da, a)
+    foglio.chiudi()
+    wb.close()
+
+
+def portafoglio_excel_bytes(ct: pd.DataFrame, titolo: str = "Portafoglio contratti") -> bytes:
+    bio = BytesIO()
+    portafoglio_excel(bio, ct, titolo)
+    return bio.getvalue()
+
+
+# =====================================
+# PDF (centrato in pagina, A4 orizzontale, 1 pagina quando possibile)
+# =====================================
+def contratti_pdf(rag_soc: str, ct: pd.DataFrame) -> bytes:
+    from fpdf import FPDF
+
+    data_export = datetime.now().strftime("%d/%m/%Y")
+    righe = righe_export(ct)
+
+    pdf = FPDF("L", "mm", "A4")
+    # Disabilito l'autobreak per evitare pagine “vuote” solo col footer
+    pdf.set_auto_page_break(auto=False)
+    pdf.add_page()
+
+    # Margini più “grafici”
+    left_margin = 12
+    right_margin = 12
+    top_margin = 10
+    bottom_margin = 12
+    pdf.set_margins(left=left_margin, top=top_margin, right=right_margin)
+
+    page_w = pdf.w
+    usable_w = page_w - left_margin - right_margin
+
+    # === Logo SHT centrato ===
+    logo = _logo()
+    if logo:
+        try:
+            # logo di 35mm, centrato
+            logo_w = 35
+            x_logo = left_margin + (usable_w - logo_w) / 2.0
+            pdf.image(logo, x=x_logo, y=8, w=logo_w, type="PNG")
+        except Exception:
+            pass
+
+    # Spazio sotto il logo
+    pdf.set_y(8 + 35 + 4)
+
+    # === Titolo centrato ===
+    pdf.set_font("Arial", "B", 13)
+    pdf.cell(0, 8, safe_text(f"Contratti Cliente: {rag_soc} - {data_export}"), ln=1, align="C")
+    pdf.ln(3)
+
+    # Larghezze pensate per A4 orizzontale, ma calcoliamo lo start centrato
+    col_widths = [10, 20, 20, 15, 110, 25, 20, 20, 22, 22, 22, 22]
+    table_w = sum(col_widths)
+    # Se la tabella è più larga dello spazio utile, la riduciamo in scala uniforme
+    if table_w > usable_w:
+        scale = usable_w / table_w
+        col_widths = [w * scale for w in col_widths]
+        table_w = usable_w
+
+    # X iniziale per centrare
+    start_x = left_margin + (usable_w - table_w) / 2.0
+
+    def header():
+        pdf.set_font("Arial", "B", 9)
+        pdf.set_fill_color(255, 253, 231)
+        for h, w in zip(HEADERS, col_widths):
+            pdf.cell(w, 8, safe_text(h), border=1, align="C", fill=True)
+        pdf.ln(8)
+        pdf.set_font("Arial", "", 8)
+
+    pdf.set_xy(start_x, pdf.get_y())
+    header()
+
+    line_h = 5.5  # un po’ compatto per favorire “una pagina”
+    bottom_limit = pdf.h - bottom_margin - 6   # 10 mm di margine + 6 di footer
+    desc_w = col_widths[4]
+
+    for r in righe.itertuples(index=False):
+        valori = [safe_text(getattr(r, c)) for c, _ in COLONNE]
+        fill = r.Chiuso
+
+        # righe necessarie alla descrizione, misurate con la larghezza reale del font
+        lines, line = [], ""
+        for w in valori[4].split():
+            test = (line + " " + w).strip()
+            if pdf.get_string_width(test) <= (desc_w - 2):  # un pochino di padding
+                line = test
+            else:
+                lines.append(line)
+                line = w
+        if line:
+            lines.append(line)
+        row_h = max(6, line_h * max(1, len(lines)))
+
+        if pdf.get_y() + row_h > bottom_limit:
+            pdf.add_page()
+            pdf.set_xy(start_x, top_margin + 12)  # spazio per allineare con titolo mancante
+            header()
+
+        # Disegna la riga
+        pdf.set_fill_color(*((255, 230, 230) if fill else (255, 255, 255)))
+        x0 = start_x
+        y0 = pdf.get_y()
+        for idx, (val, wcol) in enumerate(zip(valori, col_widths)):
+            pdf.set_xy(x0, y0)
+            if idx == 4:
+                # descrizione: multicell con bordo, poi mi riposiziono dopo la colonna
+                pdf.multi_cell(wcol, line_h, val, border=1, align="L", fill=fill)
+                pdf.set_xy(x0 + wcol, y0)
+            else:
+                pdf.cell(wcol, row_h, val, border=1, align="C", fill=fill)
+            x0 += wcol
+        pdf.ln(row_h)
+
+    # === Footer centrato ===
+    pdf.set_text_color(100, 100, 100)
+    pdf.set_font("Arial", "I", 8)
+    pdf.set_y(pdf.h - bottom_margin)
+    pdf.cell(0, 6, safe_text("SHT S.r.l. - Tutti i diritti riservati"), 0, 0, "C")
+
+    return pdf.output(dest="S").encode("latin-1", errors="replace")
+
+
+# =====================================
+# PDF IN BLOCCO (un PDF per cliente, in parallelo, dentro uno ZIP)
+# =====================================
+# I PDF si generano in un pool di processi (fpdf è puro Python: i thread non
+# scalano) e vanno nello ZIP appena pronti: in memoria restano solo i
+# contratti da elaborare e al più `finestra` PDF in volo.
+Progresso = Callable[[int, int, float], None]   # (fatti, totale, secondi)
+
+
+def _chiave_attivi(vista: pd.DataFrame) -> tuple[pd.Series, pd.Series]:
+    """(chiave cliente, contratto non chiuso) per riga della vista."""
+    chiave = vista["ClienteID"].astype(str)
+    if OWNER_COL in vista and vista[OWNER_COL].nunique() > 1:
+        chiave = vista[OWNER_COL].astype(str) + "-" + chiave
+    stato = vista["Stato"].fillna("").astype(str).str.strip().str.lower()
+    return chiave, stato != "chiuso"
+
+
+def n_clienti_attivi(vista: pd.DataFrame) -> int:
+    """Quanti gruppi restituirebbe clienti_attivi(vista), senza costruirli."""
+    chiave, aperto = _chiave_attivi(vista)
+    return int(chiave[aperto].nunique())
+
+
+def clienti_attivi(vista: pd.DataFrame) -> list[tuple[str, str, pd.DataFrame]]:
+    """
+    (ID, ragione sociale, contratti) per ogni cliente con almeno un
+    contratto non chiuso, in ordine di ragione sociale. `vista` come
+    CRMModel.contratti_view() (colonne ClienteID, Cliente, Stato); con più
+    dataset nella vista l'ID diventa "<owner>-<ClienteID>".
+    """
+    chiave, aperto = _chiave_attivi(vista)
+    sel = vista[chiave.isin(chiave[aperto].unique())]
+    gruppi = [(k, str(g["Cliente"].iloc[0]), g[[c for c, _ in COLONNE] + ["Stato"]])
+              for k, g in sel.groupby(chiave[sel.index], sort=False)]
+    return sorted(gruppi, key=lambda x: x[1].lower())
+
+
+def _nome_file(cid: str, rag_soc: str) -> str:
+    nome = re.sub(r"[^\w\-]+", "_", rag_soc, flags=re.UNICODE).strip("_")[:60] or "cliente"
+    return f"Contratti_{nome}_{cid}.pdf"
+
+
+def _pdf_job(cid: str, rag_soc: str, ct: pd.DataFrame) -> tuple[str, bytes]:
+    return _nome_file(cid, rag_soc), contratti_pdf(rag_soc, ct)
+
+
+def _init_worker(logo: str | None) -> None:
+    _LOGO[:] = [logo]
+
+
+def pdf_batch_zip(dest, gruppi: Iterable[tuple[str, str, pd.DataFrame]], workers: int | None = None,
+                  progress: Progresso | None = None) -> dict:
+    """
+    Scrive in `dest` (percorso o file-like) uno ZIP con il PDF contratti di
+    ogni (ClienteID, ragione sociale, contratti). Restituisce pdf, secondi,
+    pdf_al_secondo e byte dello ZIP.
+    """
+    gruppi = list(gruppi)
+    totale = len(gruppi)
+    workers = workers or max(1, min(8, os.cpu_count() or 1))
+    finestra = workers * 4
+    t0 = time.perf_counter()
+    fatti = 0
+    import multiprocessing
+    with zipfile.ZipFile(dest, "w", compression=zipfile.ZIP_DEFLATED) as zf, \
+            ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                initializer=_init_worker, initargs=(_logo(),)) as pool:
+        coda, in_volo = iter(gruppi), set()
+        while True:
+            for g in coda:
+                in_volo.add(pool.submit(_pdf_job, *g))
+                if len(in_volo) >= finestra:
+                    break
+            if not in_volo:
+                break
+            pronti, in_volo = wait(in_volo, return_when=FIRST_COMPLETED)
+            for fut in pronti:
+                nome, data = fut.result()
+                zf.writestr(nome, data)
+                fatti += 1
+            if progress:
+                progress(fatti, totale, time.perf_counter() - t0)
+    secondi = time.perf_counter() - t0
+    size = os.path.getsize(dest) if isinstance(dest, (str, os.PathLike)) else dest.tell()
+    return {"pdf": fatti, "secondi": secondi, "pdf_al_secondo": fatti / secondi if secondi else 0.0, "byte": size}
+
+
+# tipo export → (builder, estensione, mime)
+FORMATI = {
+    "excel": (contratti_excel, "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "pdf": (contratti_pdf, "pdf", "application/pdf"),
+}
+
+
+# =====================================
+# RIGA DI COMANDO / BENCHMARK
+# =====================================
+def _contratti_finti(n: int, clienti: int) -> pd.DataFrame:
+    import numpy as np
+    rng = np.random.default_rng(0)
+    inizio = pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 5 * 365, n), unit="D")
+    cid = rng.integers(1, clienti + 1, n).astype(str)
+    return pd.DataFrame({
+        "ClienteID": cid,
+        "Cliente": pd.Series(cid).radd("Cliente "),
+        "NumeroContratto": np.arange(n).astype(str),
+        "DataInizio": inizio.strftime("%d/%m/%Y"),
+        "DataFine": (inizio + pd.DateOffset(months=60)).strftime("%d/%m/%Y"),
+        "Durata": "60",
+        "DescrizioneProdotto": np.where(rng.random(n) < 0.3, "Multifunzione A3 colore con finisher e cassetti aggiuntivi " * 2, "Stampante A4"),
+        "TotRata": pd.Series(rng.integers(2000, 50000, n) / 100).map(lambda v: f"{v:.2f}".replace(".", ",")),
+        "NOL_FIN": "BNP", "NOL_INT": "", "CopieBN": "1000", "EccBN": "0.008", "CopieCol": "200", "EccCol": "0.06",
+        "Stato": np.where(rng.random(n) < 0.2, "chiuso", "aperto"),
+    })
+
+
+def _leggi_cli(tabella: str, cartella, owner: str) -> pd.DataFrame:
+    """CSV di un dataset per il CLI: colonne usate da CRMModel/clienti_attivi completate, proprietario in OWNER_COL."""
+    from crm_model import CLI_DATE_COLS, CT_DATE_COLS
+    from csv_merge import read_csv_any
+    from importi import IMPORTI
+
+    df = read_csv_any(cartella / f"{tabella}.csv").fillna("")
+    if tabella == "clienti":
+        colonne = ["ClienteID", "RagioneSociale", "TMK", "Citta", "CAP", *CLI_DATE_COLS]
+    else:
+        colonne = ["ClienteID", "RagioneSociale", "Stato", *CT_DATE_COLS, *[c for c, _ in COLONNE], *IMPORTI]
+    for c in colonne:
+        if c not in df.columns:
+            df[c] = ""
+    return df.assign(**{OWNER_COL: owner})
+
+
+if __name__ == "__main__":
+    import argparse
+    import resource
+
+    ap = argparse.ArgumentParser(description="Esportazioni contratti")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("bench-excel", help="benchmark export Excel del portafoglio")
+    b.add_argument("--rows", type=int, default=100_000)
+    b.add_argument("--clienti", type=int, default=5_000)
+    p = sub.add_parser("pdf-batch", help="ZIP con il PDF contratti di ogni cliente attivo")
+    p.add_argument("--out", required=True, help="file .zip da scrivere")
+    p.add_argument("--dir", action="append", help="cartella con clienti.csv e contratti.csv (ripetibile, default: tutti i dataset del registro)")
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--finti", type=int, default=0, help="usa N contratti sintetici invece dei CSV (benchmark)")
+    args = ap.parse_args()
+
+    if args.cmd == "bench-excel":
+        ct = _contratti_finti(args.rows, args.clienti)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "portafoglio.xlsx")
+            t0 = time.perf_counter()
+            portafoglio_excel(path, ct)
+            dt = time.perf_counter() - t0
+            size = os.path.getsize(path)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"portafoglio {args.rows} contratti / {ct['ClienteID'].nunique()} clienti: "
+              f"{dt:.1f} s ({args.rows / dt:,.0f} righe/s) · file {size / 1e6:.1f} MB · picco RSS {rss:.0f} MB")
+
+    if args.cmd == "pdf-batch":
+        if args.finti:
+            vista = _contratti_finti(args.finti, max(1, args.finti // 5))
+        else:
+            from crm_model import CRMModel
+            from pathlib import Path
+            if args.dir:
+                sorgenti = {Path(d).resolve().name: Path(d) for d in args.dir}
+            else:
+                from datasets import DATASETS   # registro dei dataset, come nell'app
+                sorgenti = {o: ds.dir for o, ds in DATASETS.items()}
+            cli = pd.concat([_leggi_cli("clienti", d, o) for o, d in sorgenti.items()], ignore_index=True)
+            ct = pd.concat([_leggi_cli("contratti", d, o) for o, d in sorgenti.items()], ignore_index=True)
+            vista = CRMModel.build(cli, ct, "cli").contratti_view()
+
+        def stampa(fatti, totale, secondi):
+            print(f"\r{fatti}/{totale} PDF · {fatti / secondi:.1f} PDF/s", end="", flush=True)
+
+        stats = pdf_batch_zip(args.out, clienti_attivi(vista), args.workers, stampa)
+        print(f"\n{stats['pdf']} PDF in {stats['secondi']:.1f} s ({stats['pdf_al_secondo']:.1f} PDF/s) "
+              f"→ {args.out} ({stats['byte'] / 1e6:.1f} MB)")
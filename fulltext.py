@@ -0,0 +1,295 @@
+# =====================================
+# fulltext.py — indice full-text su NoteCliente e DescrizioneProdotto
+# =====================================
+# Indice invertito (parola → array numpy di documenti e frequenze della
+# parola) costruito una volta per versione dati (CRMModel.fulltext) e
+# aggiornato sul singolo documento quando una nota o un contratto vengono
+# salvati. L'indice non memorizza posizioni: le frasi "…" si verificano sul
+# testo normalizzato dei documenti che contengono tutte le parole.
+#
+# Sintassi delle query:
+#   kyocera centralino        → entrambe le parole (AND implicito, anche "AND")
+#   kyocera OR ricoh          → almeno una delle due (anche "|")
+#   "flotta kyocera"          → frase esatta
+#   -chiuso                   → esclude i documenti con la parola
+#   centr*                    → prefisso (l'ultima parola digitata lo è sempre)
+#
+# Benchmark:  python fulltext.py [--docs 100000]
+# =====================================
+from __future__ import annotations
+
+import html
+import re
+from bisect import bisect_left
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from search_index import normalize_text
+
+# Campi indicizzati: tabella del modello → colonna di testo
+FULLTEXT_FIELDS = {"clienti": "NoteCliente", "contratti": "DescrizioneProdotto"}
+
+_WORD = re.compile(r"[^\W_]+")
+_QUERY_TOKEN = re.compile(r'"[^"]*"?|\S+')
+
+
+def spans(text: str) -> list[tuple[str, int, int]]:
+    """Parole normalizzate con la loro posizione (inizio, fine) nel testo originale."""
+    out = []
+    for m in _WORD.finditer(text or ""):
+        for tok in normalize_text(m.group()).split():
+            out.append((tok, m.start(), m.end()))
+    return out
+
+
+@dataclass
+class Hit:
+    key: tuple          # (tabella, etichetta di riga nel modello)
+    score: float
+
+
+# =====================================
+# PARSER QUERY → gruppi OR di termini in AND
+# =====================================
+@dataclass
+class Term:
+    words: list[str]        # una parola, o più parole per una frase
+    prefix: bool = False
+    negate: bool = False
+
+
+def parse_query(query: str) -> list[list[Term]]:
+    groups: list[list[Term]] = [[]]
+    raw = _QUERY_TOKEN.findall(query or "")
+    for i, tok in enumerate(raw):
+        if tok in ("OR", "|"):
+            groups.append([])
+            continue
+        if tok == "AND":
+            continue
+        negate = tok.startswith("-") and len(tok) > 1
+        tok = tok[1:] if negate else tok
+        if tok.startswith('"'):
+            words = normalize_text(tok.strip('"')).split()
+            if words:
+                groups[-1].append(Term(words, negate=negate))
+            continue
+        # l'ultima parola (se non seguita da spazio) è in digitazione → prefisso
+        prefix = tok.endswith("*") or (i == len(raw) - 1 and not query.endswith(" "))
+        for w in normalize_text(tok).split():
+            groups[-1].append(Term([w], prefix=prefix, negate=negate))
+    return [g for g in groups if any(not t.negate for t in g)]
+
+
+# =====================================
+# INDICE
+# =====================================
+class FullTextIndex:
+    """
+    Postings per parola = array numpy di id documento (crescenti) e frequenze.
+    Gli aggiornamenti non riscrivono gli array: il documento modificato riceve
+    un nuovo id (il vecchio viene marcato come non più valido) e le sue parole
+    finiscono in una coda che viene unita agli array alla prima query che le usa.
+    Le frasi si verificano sul testo normalizzato dei soli documenti candidati.
+    """
+
+    def __init__(self):
+        self.keys: list[tuple] = []            # id → (tabella, etichetta di riga)
+        self.key_id: dict[tuple, int] = {}     # documento vivo → id
+        self.texts: list[str] = []             # testo originale (per gli estratti)
+        self.norm: list[str] = []              # testo normalizzato " parola parola "
+        self.alive = np.zeros(0, dtype=bool)
+        self.postings: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        self._pending: dict[str, list[tuple[int, int]]] = {}
+        self._vocab: list[str] | None = None   # ordinato, per i prefissi
+
+    @classmethod
+    def build(cls, tables: dict[str, pd.DataFrame]) -> "FullTextIndex":
+        idx = cls()
+        keys, texts = [], []
+        for table, col in FULLTEXT_FIELDS.items():
+            df = tables.get(table)
+            if df is None or col not in df.columns:
+                continue
+            testi = df[col].fillna("").astype(str)
+            testi = testi[testi.str.strip() != ""]
+            keys += [(table, label) for label in testi.index]
+            texts += testi.tolist()
+
+        norm = [normalize_text(t) for t in texts]
+        idx.keys, idx.texts = keys, texts
+        idx.norm = [f" {n} " for n in norm]
+        idx.key_id = {k: i for i, k in enumerate(keys)}
+        idx.alive = np.ones(len(keys), dtype=bool)
+
+        # coppie (parola, documento) → frequenze, raggruppate per parola
+        words = pd.Series(norm, dtype=object).str.split().explode().dropna()
+        if len(words):
+            codes, vocab = pd.factorize(words, sort=True)
+            doc = words.index.to_numpy(dtype=np.int64)
+            pair, tf = np.unique(codes.astype(np.int64) * len(keys) + doc, return_counts=True)
+            wcode, wdoc = pair // len(keys), (pair % len(keys)).astype(np.int32)
+            bounds = np.searchsorted(wcode, np.arange(len(vocab) + 1))
+            tf = tf.astype(np.int32)
+            idx.postings = {w: (wdoc[bounds[i]:bounds[i + 1]], tf[bounds[i]:bounds[i + 1]])
+                            for i, w in enumerate(vocab)}
+        return idx
+
+    def __len__(self) -> int:
+        return len(self.key_id)
+
+    # --- aggiornamento incrementale ---
+    def remove_doc(self, key: tuple) -> None:
+        i = self.key_id.pop(key, None)
+        if i is not None:
+            self.alive[i] = False
+
+    def set_doc(self, key: tuple, text: str) -> None:
+        self.remove_doc(key)
+        norm = normalize_text(text)
+        if not norm:
+            return
+        i = len(self.keys)
+        self.keys.append(key)
+        self.texts.append(text)
+        self.norm.append(f" {norm} ")
+        self.key_id[key] = i
+        self.alive = np.append(self.alive, True)
+        for w, tf in pd.Series(norm.split()).value_counts(sort=False).items():
+            if w not in self.postings and w not in self._pending:
+                self._vocab = None
+            self._pending.setdefault(w, []).append((i, int(tf)))
+
+    def update_row(self, table: str, label, row: pd.Series) -> None:
+        """Chiamato da CRMModel.update_row dopo il salvataggio di una riga."""
+        col = FULLTEXT_FIELDS.get(table)
+        if col and col in row.index:
+            self.set_doc((table, label), str(row[col] if pd.notna(row[col]) else ""))
+
+    # --- ricerca ---
+    def _posting(self, w: str) -> tuple[np.ndarray, np.ndarray]:
+        extra = self._pending.pop(w, None)
+        if extra:
+            docs, tf = self.postings.get(w, (np.zeros(0, np.int32), np.zeros(0, np.int32)))
+            add = np.array(extra, dtype=np.int32)
+            self.postings[w] = (np.concatenate([docs, add[:, 0]]), np.concatenate([tf, add[:, 1]]))
+        return self.postings[w]
+
+    def _words_for(self, w: str, prefix: bool) -> list[str]:
+        if not prefix:
+            return [w] if w in self.postings or w in self._pending else []
+        if self._vocab is None:
+            self._vocab = sorted(set(self.postings) | set(self._pending))
+        lo = bisect_left(self._vocab, w)
+        hi = bisect_left(self._vocab, w + "\uffff", lo)
+        return self._vocab[lo:hi]
+
+    def _word_scores(self, w: str) -> np.ndarray:
+        docs, tf = self._posting(w)
+        idf = np.log1p(max(len(self.key_id), 1) / max(len(docs), 1))
+        return np.bincount(docs, weights=tf * idf, minlength=len(self.keys))
+
+    def _term_scores(self, term: Term) -> np.ndarray:
+        """Peso tf·idf di ogni documento per il termine (0 = assente)."""
+        n = len(self.keys)
+        if len(term.words) == 1:
+            score = np.zeros(n, dtype=np.float64)
+            for w in self._words_for(term.words[0], term.prefix):
+                score += self._word_scores(w)
+            return score
+
+        # frase: documenti con tutte le parole, poi verifica sul testo normalizzato
+        score = None
+        for w in term.words:
+            if not self._words_for(w, False):
+                return np.zeros(n, dtype=np.float64)
+            ws = self._word_scores(w)
+            score = ws if score is None else np.where((score > 0) & (ws > 0), score + ws, 0)
+        frase = " " + " ".join(term.words) + " "
+        cand = np.flatnonzero(score)
+        ok = np.fromiter((frase in self.norm[i] for i in cand), dtype=bool, count=len(cand))
+        score[cand[~ok]] = 0
+        return score
+
+    def search(self, query: str, tables=None, limit: int | None = None) -> list[Hit]:
+        n = len(self.keys)
+        total = np.zeros(n, dtype=np.float64)
+        for group in parse_query(query):
+            positive = [t for t in group if not t.negate]
+            g_score = self._term_scores(positive[0])
+            for term in positive[1:]:
+                if not g_score.any():
+                    break
+                t_score = self._term_scores(term)
+                g_score = np.where((g_score > 0) & (t_score > 0), g_score + t_score, 0)
+            for term in group:
+                if term.negate and g_score.any():
+                    g_score[self._term_scores(Term(term.words, term.prefix)) > 0] = 0
+            np.maximum(total, g_score, out=total)
+        total[~self.alive] = 0
+        if tables is not None:
+            total[[i for i in np.flatnonzero(total) if self.keys[i][0] not in tables]] = 0
+        found = np.flatnonzero(total)
+        if limit and len(found) > limit:
+            found = found[np.argpartition(-total[found], limit - 1)[:limit]]
+        found = found[np.argsort(-total[found], kind="stable")]
+        return [Hit(self.keys[i], float(total[i])) for i in found]
+
+    # --- estratto con evidenziazione ---
+    def snippet(self, key: tuple, query: str, width: int = 160) -> str:
+        """HTML: finestra di testo attorno alla prima occorrenza, parole trovate in <mark>."""
+        i = self.key_id.get(key)
+        text = self.texts[i] if i is not None else ""
+        terms = [t for g in parse_query(query) for t in g if not t.negate]
+        exact = {w for t in terms for w in t.words if not t.prefix}
+        prefixes = tuple(t.words[0] for t in terms if t.prefix)
+        marks = [(a, b) for tok, a, b in spans(text) if tok in exact or (prefixes and tok.startswith(prefixes))]
+
+        start = max(0, marks[0][0] - width // 3) if marks else 0
+        end = min(len(text), start + width)
+        out, cur = [], start
+        for a, b in marks:
+            if a < start or b > end:
+                continue
+            out.append(html.escape(text[cur:a]))
+            out.append(f"<mark>{html.escape(text[a:b])}</mark>")
+            cur = b
+        out.append(html.escape(text[cur:end]))
+        return ("…" if start > 0 else "") + "".join(out) + ("…" if end < len(text) else "")
+
+
+# =====================================
+# BENCHMARK
+# =====================================
+if __name__ == "__main__":
+    import argparse
+    import random
+    import time
+
+    ap = argparse.ArgumentParser(description="Benchmark indice full-text")
+    ap.add_argument("--docs", type=int, default=100_000)
+    args = ap.parse_args()
+
+    rnd = random.Random(0)
+    parole = ("stampante multifunzione kyocera ricoh canon centralino voip flotta noleggio colore "
+              "bianco nero a3 a4 toner assistenza rinnovo cliente chiamare lunedì ufficio sede "
+              "contratto scaduto installazione rete wifi").split()
+    testi = [" ".join(rnd.choices(parole, k=rnd.randint(4, 30))) for _ in range(args.docs)]
+    df = pd.DataFrame({"DescrizioneProdotto": testi})
+
+    t0 = time.perf_counter()
+    fti = FullTextIndex.build({"contratti": df})
+    print(f"build {args.docs} documenti: {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+    t0 = time.perf_counter()
+    for i in range(100):
+        fti.update_row("contratti", i, pd.Series({"DescrizioneProdotto": "nuova flotta kyocera"}))
+    print(f"update singolo documento: {(time.perf_counter() - t0) * 10:.3f} ms")
+
+    for q in ["kyocera", "flotta kyocera", '"flotta kyocera"', "kyocera OR centralino", "centr", "toner -ricoh"]:
+        t0 = time.perf_counter()
+        res = fti.search(q, limit=50)
+        ms = (time.perf_counter() - t0) * 1000
+        print(f"{q!r:26} {len(fti.search(q)):7} risultati  {ms:.1f} ms")
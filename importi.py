@@ -0,0 +1,61 @@
+# =====================================
+# importi.py — importi in euro: parsing e formattazione per colonne intere
+# =====================================
+# Nei CSV gli importi arrivano in formati misti: '1.234,56', '1234.56 €',
+# 'EUR 12,5', '0.00848'. Il separatore decimale è l'ultimo tra ',' e '.'
+# se compare una sola volta; gli altri sono separatori delle migliaia.
+# Tutto lavora sui valori distinti con l'accessor .str (niente apply riga per riga).
+#
+# NOL_FIN / NOL_INT non sono importi (contengono la società: 'BNP 65',
+# 'GRENKE', '*') e restano testo.
+# =====================================
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+IMPORTI = ("TotRata", "EccBN", "EccCol")   # colonne contratti convertite in <col>_n dal modello
+
+
+def parse_euro(s: pd.Series) -> pd.Series:
+    """Importi italiani/misti → float64, NaN se vuoti o non numerici."""
+    codes, uniq = pd.factorize(s.fillna("").astype(str))
+    if not len(uniq):
+        return pd.Series(np.nan, index=s.index, dtype=float)
+    t = pd.Series(uniq).str.replace(r"€|EUR|\s|'", "", regex=True, case=False)
+    n_c, n_d = t.str.count(","), t.str.count(r"\.")
+    last_c, last_d = t.str.rfind(","), t.str.rfind(".")
+    # separatore decimale: l'ultimo dei due, purché compaia una volta sola
+    dec_c = (n_c == 1) & (last_c > last_d)
+    dec_d = (n_d == 1) & (last_d > last_c)
+    t = t.mask(dec_c, t.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    t = t.mask(dec_d, t.str.replace(",", "", regex=False))
+    t = t.mask(~dec_c & ~dec_d, t.str.replace(r"[.,]", "", regex=True))
+    return pd.Series(pd.to_numeric(t, errors="coerce").to_numpy(dtype=float)[codes], index=s.index)
+
+
+def non_validi(raw: pd.Series, parsed: pd.Series) -> pd.Series:
+    """Valori originali non vuoti che parse_euro non ha riconosciuto ('*', '?', '-' valgono come vuoti)."""
+    txt = raw.fillna("").astype(str).str.strip()
+    return txt[~txt.str.fullmatch(r"[*?\-/]*") & parsed.isna()]
+
+
+def format_euro(v: pd.Series, decimali: int = 2, simbolo: bool = True, vuoto: str = "") -> pd.Series:
+    """float → '1.234,56 €' per un'intera colonna (NaN → `vuoto`)."""
+    ok = v.notna()
+    out = pd.Series(vuoto, index=v.index, dtype=object)
+    if not ok.any():
+        return out
+    num = np.char.mod(f"%.{decimali}f", v[ok].to_numpy(dtype=float))
+    parti = pd.Series(num, index=v.index[ok]).str.partition(".")
+    t = parti[0].str.replace(r"(\d)(?=(\d{3})+$)", r"\1.", regex=True)
+    if decimali > 0:
+        t = t + "," + parti[2]
+    out[ok] = t + " €" if simbolo else t
+    return out
+
+
+def euro(x, decimali: int = 2) -> str:
+    """Un singolo importo (numero o testo) formattato come format_euro."""
+    v = x if isinstance(x, (int, float, np.number)) else parse_euro(pd.Series([x])).iloc[0]
+    return format_euro(pd.Series([v], dtype=float), decimali).iloc[0]
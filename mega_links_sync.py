@@ -1,122 +1,122 @@
 # =====================================
-# mega_links_sync.py — sincronizzazione sicura da MEGA via link pubblici
+# mega_links_sync.py — sincronizzazione dati tramite backend configurabile
+# =====================================
+# Backend scelto da secrets.toml:
+#   [sync]
+#   backend = "local"              # "local" (cartella / share di rete) oppure "mega"
+#   root = "/mnt/share/crm"        # solo per backend "local"
+# In assenza di [sync] si usano i link pubblici MEGA (sola lettura).
 # =====================================
 import streamlit as st
-import pandas as pd
-import requests
+import tempfile
 from pathlib import Path
 
+from csv_merge import controlla_remoto, merge_synced_file, read_csv_any
+from datasets import DATASETS
+from sync_backends import AsyncUploader, LocalDirBackend, MegaLinkBackend, SyncBackend
+
 STORAGE_DIR = Path(__file__).parent / "storage"
 STORAGE_DIR.mkdir(parents=True, exist_ok=True)
 
 # === Lettura dei link da secrets.toml ===
 MEGA_CONF = st.secrets.get("mega", {})
+SYNC_CONF = st.secrets.get("sync", {})
 
-MEGA_LINKS = {
-    "clienti": MEGA_CONF.get("clienti_url", ""),
-    "contratti": MEGA_CONF.get("contratti_url", ""),
-    "preventivi": MEGA_CONF.get("preventivi_url", ""),
-    "gabriele_clienti": MEGA_CONF.get("gabriele_clienti_url", ""),
-    "gabriele_contratti": MEGA_CONF.get("gabriele_contratti_url", ""),
+# File sincronizzati: chiave link MEGA → percorso locale
+# (clienti/contratti di ogni dataset del registro: "clienti", "gabriele_clienti", …)
+SYNC_FILES = {
+    **{key: path for ds in DATASETS.values() for key, path in ds.sync_files().items()},
+    "preventivi": STORAGE_DIR / "preventivi.csv",
 }
 
-# Cartelle locali
-GABRIELE_DIR = STORAGE_DIR / "gabriele"
-GABRIELE_DIR.mkdir(parents=True, exist_ok=True)
-PREVENTIVI_DIR = STORAGE_DIR / "preventivi"
-PREVENTIVI_DIR.mkdir(parents=True, exist_ok=True)
+# Link pubblici: <chiave>_url in [mega] (es. clienti_url, gabriele_contratti_url)
+MEGA_LINKS = {key: MEGA_CONF.get(f"{key}_url", "") for key in SYNC_FILES}
+
+
+def remote_name(path: Path) -> str:
+    """Nome remoto = percorso relativo a storage/ (es. 'gabriele/clienti.csv')."""
+    return Path(path).resolve().relative_to(STORAGE_DIR.resolve()).as_posix()
+
+
+# =====================================
+# 🔌 BACKEND E CODA DI UPLOAD (una istanza per processo)
+# =====================================
+@st.cache_resource
+def get_backend() -> SyncBackend:
+    if str(SYNC_CONF.get("backend", "")).lower() == "local" and SYNC_CONF.get("root"):
+        return LocalDirBackend(SYNC_CONF["root"])
+    links = {remote_name(path): MEGA_LINKS.get(key, "") for key, path in SYNC_FILES.items()}
+    return MegaLinkBackend(links)
+
+
+@st.cache_resource
+def get_uploader() -> AsyncUploader:
+    return AsyncUploader(max_workers=2)
 
 
 # =====================================
-# 📥 Download file CSV da MEGA (via link pubblico)
+# 🔀 DOWNLOAD + MERGE CON LE MODIFICHE LOCALI
 # =====================================
-def _mega_link_to_download_url(link: str) -> str:
-    """Converte link MEGA (https://mega.nz/file/xxx#chiave) in link diretto API"""
-    if not link or "#" not in link:
-        return ""
-    parts = link.split("#")
-    file_id = parts[0].split("/")[-1]
-    key = parts[1]
-    return f"https://mega.nz/file/{file_id}#{key}"
-
-
-def download_from_mega(link: str, dest: Path) -> bool:
-    """Scarica un file da MEGA via link pubblico (simulato, no-login)"""
-    if not link:
-        st.warning(f"⚠️ Link MEGA non trovato per {dest.name}")
-        return False
-    try:
-        # MEGA non supporta download diretto pubblico → uso il redirect di megadownloader API
-        api_url = f"https://api.allorigins.win/get?url={link}"
-        r = requests.get(api_url, timeout=15)
-        if r.status_code != 200:
-            raise Exception(f"HTTP {r.status_code}")
-        # Scrivo comunque un placeholder se non scarica il file
-        if "content" not in r.json():
-            raise Exception("Contenuto non accessibile")
-        with open(dest, "wb") as f:
-            f.write(r.json()["contents"].encode("utf-8"))
-        st.toast(f"📥 File aggiornato da MEGA: {dest.name}", icon="✅")
-        return True
-    except Exception as e:
-        st.warning(f"⚠️ Download simulato per {dest.name}: {e}")
-        return False
+def sync_and_merge(name: str, path: Path) -> str:
+    """
+    Scarica il file remoto in un temporaneo e lo unisce al locale (merge a tre vie).
+    Se il locale conteneva modifiche non ancora caricate, rimette in coda l'upload.
+    """
+    backend = get_backend()
+    if backend.stat(name) is None:
+        return "remoto assente"
+    with tempfile.TemporaryDirectory() as tmp:
+        remote_tmp = Path(tmp) / Path(name).name
+        if not backend.get(name, remote_tmp):
+            return "download fallito"
+        if not path.exists():
+            controlla_remoto(name, read_csv_any(remote_tmp))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            remote_tmp.replace(path)
+            merge_synced_file(name, path, path)  # registra la base
+            return "OK"
+        res = merge_synced_file(name, path, remote_tmp)
+
+    if res.stats.get("locale_modificato") and backend.writable:
+        get_uploader().submit(backend, path, name)
+    esito = f"OK ({res.stats['da_remoto']} dal remoto, {res.stats['da_locale']} locali"
+    if res.stats["conflitti"]:
+        esito += f", ⚠️ {res.stats['conflitti']} conflitti"
+    return esito + ")"
 
 
 # =====================================
 # 🔄 SINCRONIZZAZIONE COMPLETA
 # =====================================
-def sync_from_mega():
-    """Scarica automaticamente tutti i CSV principali da MEGA"""
+def _sync_files(files: dict[str, Path]) -> list[str]:
     results = []
-    mapping = {
-        "clienti": STORAGE_DIR / "clienti.csv",
-        "contratti": STORAGE_DIR / "contratti.csv",
-        "preventivi": STORAGE_DIR / "preventivi.csv",
-        "gabriele_clienti": GABRIELE_DIR / "clienti.csv",
-        "gabriele_contratti": GABRIELE_DIR / "contratti.csv",
-    }
-    for key, path in mapping.items():
-        link = MEGA_LINKS.get(key)
-        if not link:
-            results.append(f"⚠️ Nessun link per {key}")
-            continue
-        ok = download_from_mega(link, path)
-        results.append(f"📂 {key}: {'OK' if ok else 'ERRORE'}")
+    for key, path in files.items():
+        try:
+            esito = sync_and_merge(remote_name(path), path)
+        except Exception as e:
+            esito = f"ERRORE: {e}"
+        results.append(f"📂 {key}: {esito}")
     return results
 
 
-def sync_gabriele_files():
-    """Scarica solo i file di Gabriele"""
-    return [
-        download_from_mega(MEGA_LINKS.get("gabriele_clienti"), GABRIELE_DIR / "clienti.csv"),
-        download_from_mega(MEGA_LINKS.get("gabriele_contratti"), GABRIELE_DIR / "contratti.csv"),
-    ]
+def sync_from_mega():
+    """Scarica tutti i CSV principali dal backend e li unisce alle modifiche locali"""
+    return _sync_files(SYNC_FILES)
 
 
-# =====================================
-# 📤 UPLOAD (manuale)
-# =====================================
-def upload_to_mega(path: Path):
-    """Simula upload (non supportato via link pubblico)"""
-    st.warning(f"⚙️ Upload su MEGA non disponibile via link pubblico.\n"
-               f"Puoi ricaricare manualmente il file aggiornato:\n➡️ {path.name}")
+def sync_dataset_files(owner: str):
+    """Scarica e unisce solo i file di un dataset del registro (es. 'gabriele')"""
+    return _sync_files(DATASETS[owner].sync_files())
 
 
 # =====================================
-# 📤 SALVATAGGIO PREVENTIVI
+# 📤 UPLOAD (asincrono, dopo ogni salvataggio)
 # =====================================
-def save_preventivo_to_mega(file_path: Path, nome_cliente: str, autore: str = "fabio"):
-    """
-    Simula salvataggio preventivo su MEGA.
-    Copia locale + istruzioni per upload manuale.
-    """
-    dest_dir = PREVENTIVI_DIR / autore.lower()
-    dest_dir.mkdir(parents=True, exist_ok=True)
-    dest_file = dest_dir / file_path.name
-    try:
-        file_path.replace(dest_file)
-        st.toast(f"📦 Preventivo salvato localmente: {dest_file.name}", icon="✅")
-        st.info("➡️ Caricalo su MEGA manualmente nella cartella OFFERTE.")
-    except Exception as e:
-        st.warning(f"⚠️ Salvataggio preventivo non riuscito: {e}")
+def upload_to_mega(path: Path):
+    """Accoda l'upload del file sul backend; ritorna il Future (o None se il backend è in sola lettura)."""
+    backend = get_backend()
+    if not backend.writable:
+        st.warning(f"⚙️ Upload su {backend.label} non disponibile (backend in sola lettura).\n"
+                   f"Puoi ricaricare manualmente il file aggiornato:\n➡️ {Path(path).name}")
+        return None
+    return get_uploader().submit(backend, Path(path), remote_name(path))
@@ -0,0 +1,84 @@
+# =====================================
+# perf.py — misura dei tempi di rendering
+# =====================================
+# Uso:
+#   with timed("contratti.tabella"):
+#       ...
+# Il tempo finisce nel log "crm.perf" e in st.session_state["_perf"],
+# così le pagine possono mostrarlo e confrontarlo tra un rerun e l'altro.
+# =====================================
+from __future__ import annotations
+
+import functools
+import logging
+import time
+from contextlib import contextmanager
+
+import streamlit as st
+
+log = logging.getLogger("crm.perf")
+if not log.handlers:
+    _h = logging.StreamHandler()
+    _h.setFormatter(logging.Formatter("%(asctime)s [perf] %(message)s"))
+    log.addHandler(_h)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+
+@contextmanager
+def timed(label: str, **extra):
+    """Cronometra il blocco e registra il risultato (ms) sotto `label`."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        dettagli = " ".join(f"{k}={v}" for k, v in extra.items())
+        log.info("%s: %.1f ms %s", label, ms, dettagli)
+        st.session_state.setdefault("_perf", {})[label] = ms
+
+
+def last_ms(label: str) -> float | None:
+    """Ultimo tempo registrato per `label` in questa sessione."""
+    return st.session_state.get("_perf", {}).get(label)
+
+
+# =====================================
+# CONTATORE RERUN: completi vs fragment
+# =====================================
+def count_full_run():
+    """Da chiamare all'inizio di main(): ogni esecuzione di main è un rerun completo."""
+    stats = st.session_state.setdefault("_reruns", {"completi": 0, "fragment": 0})
+    stats["completi"] += 1
+    st.session_state["_fragments_seen"] = set()
+
+
+def counted_fragment(fn):
+    """
+    Come st.fragment, ma conta le riesecuzioni parziali: la prima esecuzione
+    del fragment dentro un rerun completo non conta, le successive sì.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        seen = st.session_state.setdefault("_fragments_seen", set())
+        if fn.__name__ in seen:
+            st.session_state.setdefault("_reruns", {"completi": 0, "fragment": 0})["fragment"] += 1
+        seen.add(fn.__name__)
+        return fn(*args, **kwargs)
+
+    return st.fragment(wrapper)
+
+
+def rerun_fragment():
+    """
+    Riesegue solo il fragment corrente; se il fragment sta girando dentro un
+    rerun completo (dove scope="fragment" non è ammesso) riesegue l'app.
+    """
+    try:
+        st.rerun(scope="fragment")
+    except st.errors.StreamlitAPIException:
+        st.rerun()
+
+
+def rerun_stats() -> dict:
+    return dict(st.session_state.get("_reruns", {"completi": 0, "fragment": 0}))
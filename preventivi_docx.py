@@ -0,0 +1,475 @@
+# =====================================
+# preventivi_docx.py — generazione preventivi Word dai template
+# =====================================
+# I template (storage/templates/*.docx, ~500 KB) vengono letti e
+# interpretati da python-docx UNA volta per processo (finché il file non
+# cambia); ogni preventivo è una deepcopy del documento in cache con i
+# segnaposto <<CAMPO>> sostituiti. Un segnaposto può essere spezzato su più
+# run ('<<', 'CITTA', '>>'): il testo viene ricomposto nel primo run e tolto
+# dagli altri, mantenendo la formattazione del primo.
+#
+# Segnaposto: CLIENTE, INDIRIZZO, CITTA, NUMERO_OFFERTA, DATA e, se il
+# template li prevede, i campi extra passati in `campi` (es. DURATA, CANONE).
+# Nessuna chiamata Streamlit: usabile anche da processi separati.
+#
+# Percorso veloce (default, ZipTemplate): il .docx è trattato come ZIP. Le
+# posizioni dei segnaposto in word/document.xml, header*.xml e footer*.xml
+# si indicizzano una volta; ogni preventivo riscrive solo quelle parti e
+# copia byte per byte (già compressi) tutti gli altri membri, immagini comprese.
+#
+# Benchmark:  python preventivi_docx.py [--n 30] [--batch 300]
+# =====================================
+from __future__ import annotations
+
+import bisect
+import copy
+import html
+import re
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+TEMPLATES_DIR = Path(__file__).parent / "storage" / "templates"
+TEMPLATE_OPTIONS = {
+    "Offerta A4": "Offerta_A4.docx",
+    "Offerta A3": "Offerta_A3.docx",
+    "Centralino": "Offerta_Centralino.docx",
+    "Varie": "Offerta_Varie.docx",
+}
+SEGNAPOSTO = re.compile(r"<<([A-Z_]+)>>")
+
+
+def campi_preventivo(nome_cliente: str, num_off: str, cliente=None, **extra) -> dict[str, str]:
+    """Valori dei segnaposto: dati cliente (riga clienti, opzionale), numero offerta, data + extra."""
+    c = cliente if cliente is not None else {}
+    citta = " ".join(str(c.get(k, "") or "").strip() for k in ("CAP", "Citta")).strip()
+    campi = {
+        "CLIENTE": nome_cliente,
+        "INDIRIZZO": str(c.get("Indirizzo", "") or "").strip(),
+        "CITTA": citta,
+        "NUMERO_OFFERTA": num_off,
+        "DATA": datetime.now().strftime("%d/%m/%Y"),
+    }
+    campi.update({k.upper(): str(v) for k, v in extra.items()})
+    return campi
+
+
+def template_path(template: str) -> Path:
+    """Percorso del template da etichetta (TEMPLATE_OPTIONS) o nome file."""
+    return TEMPLATES_DIR / TEMPLATE_OPTIONS.get(template, template)
+
+
+# =====================================
+# STATISTICHE DI LATENZA (per template)
+# =====================================
+@dataclass
+class Latenza:
+    n: int = 0
+    totale_ms: float = 0.0
+    ultimo_ms: float = 0.0
+    max_ms: float = 0.0
+
+    def aggiungi(self, ms: float) -> None:
+        self.n += 1
+        self.totale_ms += ms
+        self.ultimo_ms = ms
+        self.max_ms = max(self.max_ms, ms)
+
+    @property
+    def media_ms(self) -> float:
+        return self.totale_ms / self.n if self.n else 0.0
+
+
+@dataclass
+class _Statistiche:
+    per_template: dict[str, Latenza] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def registra(self, template: str, ms: float) -> None:
+        with self.lock:
+            self.per_template.setdefault(template, Latenza()).aggiungi(ms)
+
+
+LATENZE = _Statistiche()
+
+
+# =====================================
+# CACHE DEI TEMPLATE INTERPRETATI
+# =====================================
+_CACHE: dict[Path, tuple[tuple, object]] = {}   # percorso → (firma file, Document)
+_LOCK = threading.Lock()
+
+
+def _firma(path: Path) -> tuple:
+    s = path.stat()
+    return (s.st_mtime_ns, s.st_size)
+
+
+def documento_template(path: Path):
+    """Document python-docx del template, interpretato una volta per processo e versione del file."""
+    from docx import Document
+
+    firma = _firma(path)
+    with _LOCK:
+        hit = _CACHE.get(path)
+        if hit is None or hit[0] != firma:
+            hit = (firma, Document(str(path)))
+            _CACHE[path] = hit
+        return hit[1]
+
+
+# =====================================
+# SOSTITUZIONE SEGNAPOSTO
+# =====================================
+def _paragrafi(doc):
+    """Tutti i paragrafi: corpo, tabelle (anche annidate), intestazioni e piè di pagina."""
+    def da_contenitore(c):
+        yield from c.paragraphs
+        for t in c.tables:
+            for row in t.rows:
+                for cell in row.cells:
+                    yield from da_contenitore(cell)
+
+    yield from da_contenitore(doc)
+    for s in doc.sections:
+        for hf in (s.header, s.first_page_header, s.even_page_header,
+                   s.footer, s.first_page_footer, s.even_page_footer):
+            if not hf.is_linked_to_previous:
+                yield from da_contenitore(hf)
+
+
+def _sostituisci_paragrafo(p, campi: dict[str, str]) -> int:
+    """Sostituisce i segnaposto del paragrafo anche se spezzati tra run; restituisce quanti."""
+    runs = p.runs
+    testi = [r.text for r in runs]
+    testo = "".join(testi)
+    if "<<" not in testo:
+        return 0
+    n = 0
+    for m in reversed(list(SEGNAPOSTO.finditer(testo))):
+        if m.group(1) not in campi:
+            continue
+        # run che contengono inizio e fine del segnaposto
+        inizio, fine, pos = None, None, 0
+        for i, t in enumerate(testi):
+            if inizio is None and m.start() < pos + len(t):
+                inizio, off_inizio = i, m.start() - pos
+            if m.end() <= pos + len(t):
+                fine, off_fine = i, m.end() - pos
+                break
+            pos += len(t)
+        if inizio == fine:
+            testi[inizio] = testi[inizio][:off_inizio] + campi[m.group(1)] + testi[inizio][off_fine:]
+        else:
+            testi[inizio] = testi[inizio][:off_inizio] + campi[m.group(1)]
+            for i in range(inizio + 1, fine):
+                testi[i] = ""
+            testi[fine] = testi[fine][off_fine:]
+        n += 1
+    for r, t in zip(runs, testi):
+        if r.text != t:
+            r.text = t
+    return n
+
+
+def compila(doc, campi: dict[str, str]) -> int:
+    """Compila in place i segnaposto del documento; restituisce il numero di sostituzioni."""
+    return sum(_sostituisci_paragrafo(p, campi) for p in _paragrafi(doc))
+
+
+# =====================================
+# PERCORSO VELOCE: SOSTITUZIONE A LIVELLO DI ZIP / XML
+# =====================================
+_WT = re.compile(r"(<w:t(?:\s[^>]*)?>)([^<]*)(</w:t>)")
+_TOKEN = re.compile(r"&[^;&<]+;|.", re.S)   # un carattere o un'entità XML
+_PARTI = re.compile(r"word/(document|header\d*|footer\d*)\.xml$")
+
+
+def _xml_escape(s: str) -> str:
+    return s.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+class _ParteXML:
+    """
+    Una parte XML divisa in pezzi fissi e frammenti di segnaposto. Il testo
+    dei <w:t> di ogni paragrafo è ricomposto (entità sciolte) per trovare i
+    <<CAMPO>> anche se spezzati su più nodi; ogni frammento ricorda il testo
+    originale, usato se il campo non viene passato.
+    """
+
+    def __init__(self, xml: str):
+        nodi = list(_WT.finditer(xml))
+        testo, dove, token = [], [], []      # carattere sciolto, (nodo, token), token per nodo
+        fine_prec = 0
+        for k, m in enumerate(nodi):
+            if "</w:p>" in xml[fine_prec:m.start()]:
+                testo.append("\n")            # i segnaposto non attraversano i paragrafi
+                dove.append(None)
+            tk = _TOKEN.findall(m.group(2))
+            token.append(tk)
+            for j, t in enumerate(tk):
+                testo.append(html.unescape(t))
+                dove.append((k, j))
+            fine_prec = m.end()
+        inizi = [0]
+        for c in testo:
+            inizi.append(inizi[-1] + len(c))
+        piatto = "".join(testo)
+
+        # nodo → [(token da, token a, campo, primo frammento?)]
+        frammenti: dict[int, list] = {}
+        self.campi = set()
+        for m in SEGNAPOSTO.finditer(piatto):
+            a = bisect.bisect_right(inizi, m.start()) - 1
+            b = bisect.bisect_left(inizi, m.end()) - 1
+            (k1, t1), (k2, t2) = dove[a], dove[b]
+            for k in range(k1, k2 + 1):
+                da = t1 if k == k1 else 0
+                fino = t2 + 1 if k == k2 else len(token[k])
+                frammenti.setdefault(k, []).append((da, fino, m.group(1), k == k1))
+            self.campi.add(m.group(1))
+
+        # piano di rendering: stringhe fisse + (campo, primo, originale)
+        piano, pos = [], 0
+        for k in sorted(frammenti):
+            m = nodi[k]
+            piano.append(xml[pos:m.start()])
+            piano.append('<w:t xml:space="preserve">')
+            tk, cur = token[k], 0
+            for da, fino, campo, primo in frammenti[k]:
+                piano.append("".join(tk[cur:da]))
+                piano.append((campo, primo, "".join(tk[da:fino])))
+                cur = fino
+            piano.append("".join(tk[cur:]) + m.group(3))
+            pos = m.end()
+        piano.append(xml[pos:])
+        self.piano = piano
+
+    def render(self, campi: dict[str, str]) -> bytes:
+        out = []
+        for p in self.piano:
+            if type(p) is str:
+                out.append(p)
+            else:
+                campo, primo, originale = p
+                if campo in campi:
+                    out.append(_xml_escape(campi[campo]) if primo else "")
+                else:
+                    out.append(originale)
+        return "".join(out).encode("utf-8")
+
+
+def _dos_time(dt: tuple) -> tuple[int, int]:
+    y, mo, d, h, mi, s = dt
+    return (h << 11) | (mi << 5) | (s // 2), ((y - 1980) << 9) | (mo << 5) | d
+
+
+class ZipTemplate:
+    """Template .docx in memoria: membri compressi copiati così come sono, parti con segnaposto indicizzate."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.data = self.path.read_bytes()
+        self.parti: dict[str, _ParteXML] = {}
+        with zipfile.ZipFile(self.path) as zf:
+            self.infos = zf.infolist()
+            for zi in self.infos:
+                if _PARTI.match(zi.filename):
+                    parte = _ParteXML(zf.read(zi).decode("utf-8"))
+                    if parte.campi:
+                        self.parti[zi.filename] = parte
+        # membro intatto → intervallo [header locale … fine dati] nel file originale
+        self.grezzi: dict[str, tuple[int, int]] = {}
+        for zi in self.infos:
+            off = zi.header_offset
+            n_nome, n_extra = struct.unpack("<HH", self.data[off + 26:off + 30])
+            fine = off + 30 + n_nome + n_extra + zi.compress_size
+            if zi.flag_bits & 0x08:   # data descriptor dopo i dati
+                fine += 16 if self.data[fine:fine + 4] == b"PK\x07\x08" else 12
+            self.grezzi[zi.filename] = (off, fine)
+
+    @property
+    def campi(self) -> set[str]:
+        return set().union(*(p.campi for p in self.parti.values())) if self.parti else set()
+
+    def render(self, campi: dict[str, str]) -> bytes:
+        out, centrale = bytearray(), []
+        for zi in self.infos:
+            offset = len(out)
+            nome = zi.filename.encode("utf-8" if zi.flag_bits & 0x800 else "cp437")
+            parte = self.parti.get(zi.filename)
+            if parte is None:
+                a, b = self.grezzi[zi.filename]
+                out += self.data[a:b]
+                crc, csize, usize, flag, metodo = zi.CRC, zi.compress_size, zi.file_size, zi.flag_bits, zi.compress_type
+            else:
+                corpo = parte.render(campi)
+                comp = zlib.compressobj(6, zlib.DEFLATED, -15)
+                dati = comp.compress(corpo) + comp.flush()
+                crc, csize, usize = zlib.crc32(corpo), len(dati), len(corpo)
+                flag, metodo = zi.flag_bits & ~0x08, zipfile.ZIP_DEFLATED
+                t, d = _dos_time(zi.date_time)
+                out += struct.pack("<IHHHHHIIIHH", 0x04034B50, zi.extract_version, flag, metodo, t, d,
+                                   crc, csize, usize, len(nome), 0) + nome + dati
+            t, d = _dos_time(zi.date_time)
+            centrale.append(struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014B50, (zi.create_system << 8) | zi.create_version, zi.extract_version,
+                flag, metodo, t, d, crc, csize, usize, len(nome), len(zi.extra), len(zi.comment),
+                0, zi.internal_attr, zi.external_attr, offset) + nome + zi.extra + zi.comment)
+        cd_offset = len(out)
+        cd = b"".join(centrale)
+        out += cd
+        out += struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, len(centrale), len(centrale), len(cd), cd_offset, 0)
+        return bytes(out)
+
+
+_ZIP_CACHE: dict[Path, tuple[tuple, ZipTemplate]] = {}
+
+
+def zip_template(path: Path) -> ZipTemplate:
+    """ZipTemplate del file, indicizzato una volta per processo e versione del file."""
+    firma = _firma(path)
+    with _LOCK:
+        hit = _ZIP_CACHE.get(path)
+        if hit is None or hit[0] != firma:
+            hit = (firma, ZipTemplate(path))
+            _ZIP_CACHE[path] = hit
+        return hit[1]
+
+
+# =====================================
+# API
+# =====================================
+def campi_template(template: str) -> set[str]:
+    """Segnaposto presenti nel template (etichetta o nome file), dall'indice in cache."""
+    return zip_template(template_path(template)).campi
+
+
+def render_preventivo(template: str, campi: dict[str, str], motore: str = "zip") -> bytes:
+    """Byte del .docx compilato: motore "zip" (veloce) o "docx" (python-docx, deepcopy del template)."""
+    path = template_path(template)
+    if motore == "zip":
+        return zip_template(path).render(campi)
+    from io import BytesIO
+    doc = copy.deepcopy(documento_template(path))
+    compila(doc, campi)
+    bio = BytesIO()
+    doc.save(bio)
+    return bio.getvalue()
+
+
+def genera_preventivo_word(template: str, nome_cliente: str, num_off: str, out_path: Path,
+                           cliente=None, motore: str = "zip", **extra) -> Path:
+    """
+    Crea il preventivo `out_path` dal template (etichetta di TEMPLATE_OPTIONS
+    o nome file) e ne restituisce il percorso. `cliente` (riga clienti)
+    fornisce indirizzo e città; `extra` altri segnaposto del template.
+    """
+    t0 = time.perf_counter()
+    data = render_preventivo(template, campi_preventivo(nome_cliente, num_off, cliente, **extra), motore)
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    out_path.write_bytes(data)
+    LATENZE.registra(template, (time.perf_counter() - t0) * 1000)
+    return out_path
+
+
+# =====================================
+# GENERAZIONE IN BLOCCO (offerte di rinnovo)
+# =====================================
+@dataclass
+class Lavoro:
+    """Un preventivo da generare: numero offerta, cliente e segnaposto extra."""
+    num_off: str
+    nome_cliente: str
+    cliente: dict | None = None
+    extra: dict = field(default_factory=dict)
+
+    @property
+    def nome_file(self) -> str:
+        return f"{self.num_off}.docx"
+
+
+def _nome_zip(lavoro: Lavoro) -> str:
+    nome = re.sub(r"[^\w\-]+", "_", lavoro.nome_cliente, flags=re.UNICODE).strip("_")[:60] or "cliente"
+    return f"{lavoro.num_off}_{nome}.docx"
+
+
+def genera_batch_zip(dest, template: str, lavori: list[Lavoro], salva_in: Path | None = None,
+                     workers: int | None = None, progress=None) -> dict:
+    """
+    Genera un preventivo per ogni lavoro (render in parallelo su thread: il
+    percorso ZIP passa quasi tutto il tempo in zlib, che rilascia il GIL) e
+    li scrive nello ZIP `dest`; con `salva_in` salva anche ogni .docx come
+    <num_off>.docx. Restituisce preventivi, secondi, al_secondo e byte.
+    """
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+
+    t0 = time.perf_counter()
+    zip_template(template_path(template))          # indicizzazione una volta, fuori dai thread
+    if salva_in is not None:
+        Path(salva_in).mkdir(parents=True, exist_ok=True)
+
+    def render(lv: Lavoro) -> bytes:
+        return render_preventivo(template, campi_preventivo(lv.nome_cliente, lv.num_off, lv.cliente, **lv.extra))
+
+    fatti = 0
+    workers = workers or max(1, min(8, os.cpu_count() or 1))
+    # i .docx sono già compressi: nello ZIP esterno vanno senza ricompressione
+    with zipfile.ZipFile(dest, "w", compression=zipfile.ZIP_STORED) as zf, ThreadPoolExecutor(workers) as pool:
+        for lv, data in zip(lavori, pool.map(render, lavori)):
+            zf.writestr(_nome_zip(lv), data)
+            if salva_in is not None:
+                (Path(salva_in) / lv.nome_file).write_bytes(data)
+            fatti += 1
+            if progress and (fatti % 25 == 0 or fatti == len(lavori)):
+                progress(fatti, len(lavori), time.perf_counter() - t0)
+    secondi = time.perf_counter() - t0
+    if lavori:
+        LATENZE.registra(template, secondi * 1000 / len(lavori))
+    size = os.path.getsize(dest) if isinstance(dest, (str, os.PathLike)) else dest.tell()
+    return {"preventivi": fatti, "secondi": secondi, "al_secondo": fatti / secondi if secondi else 0.0, "byte": size}
+
+
+# =====================================
+# BENCHMARK
+# =====================================
+if __name__ == "__main__":
+    import argparse
+    from io import BytesIO
+
+    from docx import Document
+
+    ap = argparse.ArgumentParser(description="Benchmark preventivi: python-docx vs sostituzione nello ZIP")
+    ap.add_argument("--n", type=int, default=30, help="preventivi per template e motore")
+    ap.add_argument("--batch", type=int, default=300, help="offerte nello ZIP di genera_batch_zip")
+    args = ap.parse_args()
+
+    cliente = {"Indirizzo": "Via Roma 1", "CAP": "20094", "Citta": "Corsico"}
+    for label in TEMPLATE_OPTIONS:
+        campi = campi_preventivo("Rossi & Figli <S.r.l.>", "OFF-2026-001", cliente)
+        tempi = {}
+        for motore in ("docx", "zip"):
+            t0 = time.perf_counter()
+            render_preventivo(label, campi, motore)          # prima volta: lettura + indicizzazione
+            primo = (time.perf_counter() - t0) * 1000
+            t0 = time.perf_counter()
+            for _ in range(args.n):
+                data = render_preventivo(label, campi, motore)
+            tempi[motore] = ((time.perf_counter() - t0) * 1000 / args.n, primo, len(data))
+            testo = [p.text for p in Document(BytesIO(data)).paragraphs]
+            assert not any("<<" in t for t in testo) and any("Rossi & Figli <S.r.l.>" in t for t in testo)
+        (d, d0, dn), (z, z0, zn) = tempi["docx"], tempi["zip"]
+        print(f"{label:12s} python-docx {d:6.1f} ms (primo {d0:5.0f}) · zip {z:5.2f} ms (primo {z0:4.0f}) "
+              f"· x{d / z:.0f} · {dn // 1024} KB vs {zn // 1024} KB")
+
+    lavori = [Lavoro(f"OFF-2026-{i:03d}", f"Cliente {i}", cliente, {"CONTRATTO": f"C{i}"}) for i in range(1, args.batch + 1)]
+    r = genera_batch_zip(BytesIO(), "Offerta A4", lavori)
+    print(f"batch: {r['preventivi']} offerte in {r['secondi']:.2f} s ({r['al_secondo']:.0f}/s), "
+          f"ZIP {r['byte'] / 1e6:.1f} MB")
@@ -0,0 +1,244 @@
+# =====================================
+# preventivi_store.py — archivio dei preventivi (storage/preventivi.csv)
+# =====================================
+# Un preventivo per riga: NumeroOfferta (OFF-AAAA-NNN), ClienteID, Cliente,
+# Autore, Template, NomeFile, Percorso, DataCreazione e, per le offerte di
+# rinnovo, NumeroContratto / ContrattoID del contratto rinnovato.
+#
+# PreventiviStore tiene l'archivio in memoria (uno per processo, riletto solo
+# se il file cambia: mtime + dimensione, es. dopo una sincronizzazione) con:
+#   • indice ClienteID → righe, per l'elenco preventivi del cliente;
+#   • numero massimo per anno, calcolato una volta alla lettura;
+#   • contatore per anno persistito in preventivi_seq.json: alloca() non
+#     scandisce più le offerte dell'anno;
+#   • esistenza e dimensione del .docx di ogni riga (_esiste, _byte), lette
+#     con uno stat alla lettura/aggiunta: l'elenco non apre i file, i byte si
+#     leggono solo quando l'utente chiede il download.
+# Le scritture passano da transazione(): lock di processo + lock sul file
+# preventivi.csv.lock (fcntl, dove disponibile), così due sessioni non
+# assegnano lo stesso numero. I nuovi preventivi sono accodati al CSV in una
+# sola scrittura; solo l'eliminazione riscrive il file (atomica).
+#
+# File vecchi (BOM, colonne Cliente/Autore assenti) sono letti completando
+# le colonne mancanti; l'intestazione viene aggiornata alla prima aggiunta.
+# =====================================
+from __future__ import annotations
+
+import csv
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from crm_model import norm_id, norm_ids
+from csv_merge import read_csv_any
+
+try:
+    import fcntl
+except ImportError:      # Windows: resta solo il lock di processo
+    fcntl = None
+
+STORAGE_DIR = Path(__file__).parent / "storage"
+PREVENTIVI_FILE = STORAGE_DIR / "preventivi.csv"
+COLONNE = ["NumeroOfferta", "ClienteID", "Cliente", "Autore", "Template", "NomeFile", "Percorso", "DataCreazione",
+           "NumeroContratto", "ContrattoID"]
+
+_LOCK = threading.RLock()
+
+
+def numero_offerta(anno: int, n: int) -> str:
+    return f"OFF-{anno:04d}-{n:03d}"
+
+
+@contextmanager
+def transazione(path: Path = PREVENTIVI_FILE):
+    """Accesso esclusivo all'archivio (thread e processi) per allocazioni e scritture."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _LOCK, open(path.with_suffix(path.suffix + ".lock"), "a") as lf:
+        if fcntl:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+
+def _firma(path: Path) -> tuple | None:
+    try:
+        s = path.stat()
+    except FileNotFoundError:
+        return None
+    return (s.st_mtime_ns, s.st_size)
+
+
+def _stat_file(df: pd.DataFrame) -> pd.DataFrame:
+    """Aggiunge _byte (dimensione, -1 se il file manca) ed _esiste per il Percorso di ogni riga."""
+    byte = []
+    for p in df["Percorso"]:
+        try:
+            byte.append(os.stat(p).st_size if p else -1)
+        except OSError:
+            byte.append(-1)
+    df["_byte"] = np.array(byte, dtype=np.int64)
+    df["_esiste"] = df["_byte"] >= 0
+    return df
+
+
+def _progressivi(numeri: pd.Series) -> pd.DataFrame:
+    """Anno e progressivo di OFF-AAAA-NNN (anche il vecchio formato OFF-AAAA-CLIENTE-NNN)."""
+    parti = numeri.str.extract(r"^OFF-(\d{4})-(?:.*-)?(\d+)$").dropna()
+    return pd.DataFrame({"anno": parti[0].astype(int), "n": parti[1].astype(int)})
+
+
+# =====================================
+# ARCHIVIO INDICIZZATO
+# =====================================
+class PreventiviStore:
+    def __init__(self, path: Path = PREVENTIVI_FILE):
+        self.path = Path(path)
+        self.seq_path = self.path.with_name(self.path.stem + "_seq.json")
+        self._carica()
+
+    def _carica(self) -> None:
+        df = read_csv_any(self.path)
+        for c in COLONNE:
+            if c not in df.columns:
+                df[c] = ""
+        self.df = _stat_file(df.reset_index(drop=True))
+        cid = norm_ids(self.df["ClienteID"])
+        self._per_cliente = {k: list(v) for k, v in cid.groupby(cid, sort=False).indices.items()}
+        prog = _progressivi(self.df["NumeroOfferta"])
+        self._max_anno = prog.groupby("anno")["n"].max().to_dict() if len(prog) else {}
+        self._firma = _firma(self.path)
+
+    def aggiorna(self) -> "PreventiviStore":
+        """Rilegge il file se è cambiato fuori da questo store (sincronizzazione, altro processo)."""
+        if _firma(self.path) != self._firma:
+            self._carica()
+        return self
+
+    # --- letture ---
+    def __len__(self) -> int:
+        return len(self.df)
+
+    def di_cliente(self, cliente_id, autore: str | None = None) -> pd.DataFrame:
+        """Preventivi del cliente (solo dell'autore, se indicato), dal più recente."""
+        out = self.df.iloc[self._per_cliente.get(norm_id(cliente_id), [])]
+        if autore is not None:
+            out = out[out["Autore"].str.lower().str.strip() == autore.lower().strip()]
+        creato = pd.to_datetime(out["DataCreazione"], format="mixed", dayfirst=True, errors="coerce")
+        return out.iloc[np.argsort(-creato.fillna(pd.Timestamp(0)).to_numpy().astype("int64"), kind="stable")]
+
+    def _seq(self) -> dict:
+        try:
+            return json.loads(self.seq_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _ultimo(self, anno: int, seq: dict | None = None) -> int:
+        """Ultimo progressivo dell'anno: massimo tra contatore persistito e archivio (righe sincronizzate)."""
+        seq = self._seq() if seq is None else seq
+        return max(int(seq.get(str(anno), 0)), self._max_anno.get(anno, 0))
+
+    def prossimo(self, anno: int | None = None) -> str:
+        """Anteprima del prossimo numero offerta (non lo riserva)."""
+        anno = anno or datetime.now().year
+        return numero_offerta(anno, self._ultimo(anno) + 1)
+
+    # --- scritture ---
+    def alloca(self, n: int = 1, anno: int | None = None) -> list[str]:
+        """Riserva n numeri offerta consecutivi dell'anno (contatore persistito, sotto lock)."""
+        anno = anno or datetime.now().year
+        with transazione(self.path):
+            self.aggiorna()
+            seq = self._seq()
+            ultimo = self._ultimo(anno, seq)
+            seq[str(anno)] = ultimo + n
+            tmp = self.seq_path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(seq, indent=1), encoding="utf-8")
+            os.replace(tmp, self.seq_path)
+        return [numero_offerta(anno, ultimo + i) for i in range(1, n + 1)]
+
+    def aggiungi(self, righe: list[dict]) -> int:
+        """
+        Accoda le righe al CSV in una sola scrittura e aggiorna gli indici.
+        Se l'intestazione del file non ha tutte le COLONNE (file vecchi) il
+        file viene riscritto una volta con le colonne complete.
+        """
+        if not righe:
+            return 0
+        with transazione(self.path):
+            self.aggiorna()
+            colonne = self._prepara_file()
+            nuove = pd.DataFrame([{c: str(r.get(c, "") or "") for c in colonne} for r in righe], columns=colonne)
+            with open(self.path, "a", encoding="utf-8", newline="") as f:
+                csv.writer(f, lineterminator="\n").writerows(nuove.itertuples(index=False, name=None))
+
+            base = len(self.df)
+            self.df = pd.concat([self.df, _stat_file(nuove.copy())], ignore_index=True)
+            for i, k in enumerate(norm_ids(nuove["ClienteID"])):
+                self._per_cliente.setdefault(k, []).append(base + i)
+            for anno, n in _progressivi(nuove["NumeroOfferta"]).itertuples(index=False):
+                self._max_anno[anno] = max(self._max_anno.get(anno, 0), n)
+            self._firma = _firma(self.path)
+        return len(righe)
+
+    def _prepara_file(self) -> list[str]:
+        """Colonne del file su disco (creato o completato se serve), con a capo finale."""
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            with open(self.path, "w", encoding="utf-8-sig", newline="") as f:
+                csv.writer(f, lineterminator="\n").writerow(COLONNE)
+            return list(COLONNE)
+        with open(self.path, encoding="utf-8-sig", newline="") as f:
+            colonne = next(csv.reader(f), [])
+        if any(c not in colonne for c in COLONNE):
+            colonne = colonne + [c for c in COLONNE if c not in colonne]
+            self._riscrivi(colonne)
+            return colonne
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            a_capo = f.read(1) in (b"\n", b"\r")
+        if not a_capo:
+            with open(self.path, "a", encoding="utf-8", newline="") as f:
+                f.write("\n")
+        return colonne
+
+    def _riscrivi(self, colonne: list[str]) -> None:
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        self.df.reindex(columns=colonne, fill_value="").to_csv(tmp, index=False, encoding="utf-8-sig")
+        os.replace(tmp, self.path)
+
+    def elimina(self, numero: str) -> dict | None:
+        """Toglie il preventivo dall'archivio (riscrittura atomica) e ne restituisce la riga."""
+        with transazione(self.path):
+            self.aggiorna()
+            hit = np.flatnonzero(self.df["NumeroOfferta"].to_numpy() == numero)
+            if not len(hit):
+                return None
+            riga = self.df.iloc[hit[0]].drop(["_byte", "_esiste"]).to_dict()
+            with open(self.path, encoding="utf-8-sig", newline="") as f:
+                colonne = next(csv.reader(f), [])
+            self.df = self.df.drop(index=hit[0])
+            self._riscrivi(colonne + [c for c in COLONNE if c not in colonne])
+            self._carica()
+        return riga
+
+
+_STORES: dict[Path, PreventiviStore] = {}
+
+
+def get_store(path: Path = PREVENTIVI_FILE) -> PreventiviStore:
+    """Store condiviso del processo per il file, riletto solo se il file è cambiato."""
+    path = Path(path)
+    with _LOCK:
+        store = _STORES.get(path)
+        if store is None:
+            store = _STORES[path] = PreventiviStore(path)
+        return store.aggiorna()
@@ -0,0 +1,231 @@
+# =====================================
+# rinnovi.py — catene di rinnovo e abbandoni (churn) per cliente
+# =====================================
+# Un contratto è "rinnovato" se lo stesso cliente ha un contratto che inizia
+# entro TOLLERANZA giorni dalla sua fine (o fino ad ANTICIPO giorni prima,
+# per i rinnovi firmati in anticipo). La fine è DataFine o, se manca,
+# DataInizio + Durata mesi.
+#
+# Un solo ordinamento per (cliente, inizio) e un searchsorted trovano per ogni
+# contratto il primo contratto successivo dello stesso cliente (niente cicli
+# per cliente: anche con più linee in parallelo il successore è quello che
+# parte dopo la fine, non semplicemente il prossimo per data di inizio).
+# Le catene (contratto → rinnovo → rinnovo…) si ricavano dai puntatori al
+# predecessore con pointer jumping. Costruito una volta per versione dati
+# (CRMModel.rinnovi).
+#
+#   esito del contratto: rinnovato · rientro (ritorno oltre la tolleranza) ·
+#                        perso · in corso (finestra di rinnovo non ancora chiusa)
+#
+# Benchmark:  python rinnovi.py [--rows 1000000]
+# =====================================
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+TOLLERANZA_GIORNI = 90
+ANTICIPO_GIORNI = 180
+_OFF = 1_000_000          # giorni: chiave (cliente, giorno) = codice * 2*_OFF + giorno + _OFF
+
+
+def _giorni(s: pd.Series) -> np.ndarray:
+    """datetime64 → giorni dal 1970 (float, NaN se NaT)."""
+    d = s.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]")
+    return np.where(np.isnat(d), np.nan, d.view(np.int64).astype(float))
+
+
+def _date(g: np.ndarray) -> np.ndarray:
+    """Giorni dal 1970 → datetime64[ns] (NaN → NaT)."""
+    d = np.nan_to_num(g).astype(np.int64).astype("datetime64[D]").astype("datetime64[ns]")
+    return np.where(np.isnan(g), np.datetime64("NaT", "ns"), d) if g.dtype.kind == "f" else d
+
+
+class AnalisiRinnovi:
+    def __init__(self, contratti: pd.DataFrame, catene: pd.DataFrame, oggi: pd.Timestamp, tolleranza: int):
+        self.contratti = contratti  # per contratto: _cid, TMK, Inizio, Fine, Gap, Esito, Catena
+        self.catene = catene        # per catena: _cid, TMK, Inizio, Fine, Contratti, Attiva
+        self.oggi = oggi
+        self.tolleranza = tolleranza
+
+    @classmethod
+    def from_frame(cls, v: pd.DataFrame, tolleranza: int = TOLLERANZA_GIORNI, anticipo: int = ANTICIPO_GIORNI,
+                   oggi=None) -> "AnalisiRinnovi":
+        oggi = pd.Timestamp(oggi if oggi is not None else pd.Timestamp.now()).normalize()
+        oggi_d = (oggi - pd.Timestamp("1970-01-01")).days
+        inizio = _giorni(v["DataInizio_dt"])
+        fine = _giorni(v["DataFine_dt"])
+        codes, uniq = pd.factorize(v["Durata"])
+        durata = np.append(pd.to_numeric(pd.Series(uniq, dtype=object), errors="coerce").to_numpy(dtype=float),
+                           np.nan)[codes]
+        da_durata = np.isnan(fine) & (durata > 0)
+        if da_durata.any():
+            fine_d = (v["DataInizio_dt"][da_durata]
+                      + pd.to_timedelta(np.round(durata[da_durata] * 30.4375), unit="D"))
+            fine[da_durata] = _giorni(fine_d)
+
+        codes, uniq = pd.factorize(v["_cid"])
+        ok = ~np.isnan(inizio) & (codes >= 0) & np.append(pd.Index(uniq).astype(str) != "", False)[codes]
+        cid_code, _cid_uniq = pd.factorize(codes[ok])
+        _cid_uniq = pd.Index(uniq).astype(str)[_cid_uniq]
+        ini, fin = inizio[ok].astype(np.int64), fine[ok]
+        chiuso = (v["Stato_n"].to_numpy() == "chiuso")[ok]
+
+        # un solo ordinamento per (cliente, inizio)
+        ordine = np.lexsort((ini, cid_code))
+        cid_code, ini, fin, chiuso = cid_code[ordine], ini[ordine], fin[ordine], chiuso[ordine]
+        etichette = v.index.to_numpy()[ok][ordine]
+        n = len(ini)
+        chiave = cid_code * (2 * _OFF) + ini + _OFF
+
+        # successore: primo contratto dello stesso cliente che inizia da (fine - anticipo) in poi, e dopo questo
+        ha_fine = ~np.isnan(fin)
+        da = np.maximum(np.nan_to_num(fin, nan=0).astype(np.int64) - anticipo, ini + 1)
+        pos = np.searchsorted(chiave, cid_code * (2 * _OFF) + da + _OFF, side="left")
+        pos_ok = np.minimum(pos, n - 1) if n else pos
+        succ = ha_fine & (pos < n) & (cid_code[pos_ok] == cid_code) if n else np.zeros(0, dtype=bool)
+        gap = np.where(succ, ini[pos_ok] - np.nan_to_num(fin), np.nan)
+        rinnovato = succ & (gap <= tolleranza)
+        decidibile = ha_fine & (np.nan_to_num(fin) + tolleranza < oggi_d)
+        esito = np.select([rinnovato, decidibile & succ, decidibile], ["rinnovato", "rientro", "perso"], "in corso")
+        esito = np.where(~ha_fine & chiuso, "senza fine", esito)
+
+        # catene: predecessore di ogni contratto (un rinnovo punta al suo successore) + pointer jumping
+        pred = np.arange(n)
+        pred[pos_ok[rinnovato]] = np.flatnonzero(rinnovato)
+        radice = pred.copy()
+        while True:
+            nuova = radice[radice]
+            if np.array_equal(nuova, radice):
+                break
+            radice = nuova
+        catena = pd.factorize(radice)[0]
+
+        # testo come Categorical (strip sui soli valori distinti): raggruppamenti su codici interi
+        tmk_raw = v["TMK"] if "TMK" in v.columns else pd.Series("", index=v.index)
+        t_codes, t_uniq = pd.factorize(tmk_raw.fillna("").astype(str))
+        t_nomi = pd.Index(t_uniq).str.strip()
+        t2, t_cat = pd.factorize(t_nomi)
+        tmk = pd.Categorical.from_codes(t2[t_codes][ok][ordine], categories=t_cat) if len(t_cat) \
+            else pd.Categorical([""] * n)
+        cids = pd.Categorical.from_codes(cid_code, categories=pd.Index(_cid_uniq)) if n else pd.Categorical([])
+        contratti = pd.DataFrame({
+            "_cid": cids, "TMK": tmk,
+            "Inizio": _date(ini), "Fine": _date(fin),
+            "Gap": gap, "Esito": esito, "Catena": catena,
+        }, index=pd.Index(etichette, name=v.index.name))
+
+        # una catena è attiva se almeno un suo contratto è aperto senza fine o nella finestra di rinnovo
+        vivo = (~ha_fine & ~chiuso) | (ha_fine & (np.nan_to_num(fin) + tolleranza >= oggi_d))
+        g = pd.DataFrame({"Catena": catena, "cid": cid_code, "tmk": tmk.codes, "ini": ini, "fin": fin,
+                          "vivo": vivo}).groupby("Catena", sort=True)
+        primo = g[["cid", "tmk"]].first()
+        catene = pd.DataFrame({
+            "_cid": pd.Categorical.from_codes(primo["cid"].to_numpy(), categories=cids.categories),
+            "TMK": pd.Categorical.from_codes(primo["tmk"].to_numpy(), categories=tmk.categories),
+            "Inizio": _date(g["ini"].min().to_numpy()),
+            "Fine": _date(g["fin"].max().to_numpy().astype(float)),
+            "Contratti": g.size().to_numpy(), "Attiva": g["vivo"].any().to_numpy(),
+        })
+        return cls(contratti, catene, oggi, tolleranza)
+
+    @classmethod
+    def build(cls, model) -> "AnalisiRinnovi":
+        return cls.from_frame(model.contratti_view())
+
+    # --- indicatori ---
+    def kpi(self) -> dict:
+        e = self.contratti["Esito"]
+        rinnovati = int((e == "rinnovato").sum())
+        decisi = rinnovati + int(e.isin(["rientro", "perso"]).sum())
+        clienti = self.catene.groupby("_cid", observed=True)["Attiva"].any()
+        gap = self.contratti.loc[e == "rinnovato", "Gap"]
+        return {
+            "decisi": decisi,
+            "rinnovati": rinnovati,
+            "tasso_rinnovo": rinnovati / decisi if decisi else np.nan,
+            "clienti": len(clienti),
+            "clienti_persi": int((~clienti).sum()),
+            "churn_clienti": float((~clienti).mean()) if len(clienti) else np.nan,
+            "gap_mediano": float(gap.median()) if len(gap) else np.nan,
+            "catena_media": float(self.catene["Contratti"].mean()) if len(self.catene) else np.nan,
+        }
+
+    def per_tmk(self) -> pd.DataFrame:
+        """Per TMK: contratti con esito deciso, rinnovati, tasso di rinnovo e gap mediano (giorni)."""
+        c = self.contratti
+        tmk = c["TMK"].cat.rename_categories(lambda t: t or "(vuoto)")
+        deciso = c["Esito"].isin(["rinnovato", "rientro", "perso"])
+        rinnovato = c["Esito"] == "rinnovato"
+        out = pd.DataFrame({"Decisi": deciso.groupby(tmk, observed=True).sum(),
+                            "Rinnovati": rinnovato.groupby(tmk, observed=True).sum()})
+        out = out[out["Decisi"] > 0]
+        out["Tasso rinnovo %"] = (out["Rinnovati"] / out["Decisi"] * 100).round(1)
+        out["Gap mediano (gg)"] = c.loc[rinnovato, "Gap"].groupby(tmk[rinnovato], observed=True).median().reindex(out.index)
+        out.index = out.index.astype(str)
+        return out.sort_values("Decisi", ascending=False)
+
+    def gap(self, bins=(-ANTICIPO_GIORNI, -30, 0, 30, 60, TOLLERANZA_GIORNI, 365, 10_000)) -> pd.Series:
+        """Distribuzione dei giorni tra fine di un contratto e inizio del successivo (rinnovi e rientri)."""
+        g = self.contratti["Gap"].dropna()
+        cut = pd.cut(g, bins=list(bins), include_lowest=True)
+        return cut.value_counts(sort=False).rename("Contratti")
+
+    def coorti(self, per: str | None = None, anni: int = 5) -> pd.DataFrame:
+        """
+        Ritenzione delle catene per anno di inizio (e TMK se per="TMK"): quota
+        di catene ancora attive dopo 1..`anni` anni, contando solo le catene
+        abbastanza vecchie da poterlo osservare.
+        """
+        c = self.catene
+        inizio = c["Inizio"].to_numpy(dtype="datetime64[D]")
+        # le catene attive valgono vive per sempre; quelle chiuse fino alla loro Fine (NaT = mai)
+        fine = np.where(c["Attiva"].to_numpy(), np.datetime64("2262-01-01"), c["Fine"].to_numpy(dtype="datetime64[D]"))
+        oggi = np.datetime64(self.oggi.date())
+        df = pd.DataFrame({"Anno": c["Inizio"].dt.year.to_numpy()})
+        chiavi = ["Anno"]
+        if per == "TMK":
+            df["TMK"] = c["TMK"].cat.rename_categories(lambda t: t or "(vuoto)").astype(str).to_numpy()
+            chiavi.append("TMK")
+        for k in range(1, anni + 1):
+            soglia = inizio + np.timedelta64(round(365.25 * k), "D")
+            osservabile = soglia <= oggi
+            df[f"o{k}"] = osservabile
+            df[f"v{k}"] = osservabile & (fine >= soglia)
+        g = df.groupby(chiavi).sum()
+        out = pd.DataFrame({"Catene": df.groupby(chiavi).size()})
+        for k in range(1, anni + 1):
+            tot = g[f"o{k}"]
+            out[f"{k} anno" if k == 1 else f"{k} anni"] = (g[f"v{k}"] / tot.where(tot > 0) * 100).round(1)
+        return out
+
+
+# =====================================
+# BENCHMARK
+# =====================================
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    ap = argparse.ArgumentParser(description="Benchmark catene di rinnovo")
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    n = args.rows
+    clienti = max(1, n // 4)
+    cid = rng.integers(0, clienti, n)
+    inizio = pd.Timestamp("2012-01-01") + pd.to_timedelta(rng.integers(0, 12 * 365, n), unit="D")
+    durata = rng.choice([12, 24, 36, 60], n)
+    v = pd.DataFrame({
+        "_cid": cid.astype(str), "DataInizio_dt": inizio,
+        "DataFine_dt": (inizio + pd.to_timedelta(durata * 30, unit="D")).where(rng.random(n) > 0.1),
+        "Durata": durata.astype(str), "Stato_n": np.where(rng.random(n) < 0.4, "chiuso", "aperto"),
+        "TMK": rng.choice(["", "ANNA", "LUCA"], n),
+    })
+    t0 = time.perf_counter()
+    a = AnalisiRinnovi.from_frame(v)
+    print(f"catene su {n} contratti: {(time.perf_counter() - t0) * 1000:.0f} ms · {len(a.catene)} catene")
+    t0 = time.perf_counter()
+    k, tmk, coorti = a.kpi(), a.per_tmk(), a.coorti("TMK")
+    print(f"kpi + TMK + coorti: {(time.perf_counter() - t0) * 1000:.0f} ms · tasso rinnovo {k['tasso_rinnovo']:.1%}")
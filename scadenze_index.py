@@ -0,0 +1,145 @@
+# =====================================
+# scadenze_index.py — indice temporale ordinato sulle scadenze
+# =====================================
+# Array datetime64 ordinato (come int64) + etichette di riga allineate.
+# Una finestra [da, a] è una coppia di searchsorted invece di una maschera
+# booleana su tutta la tabella. Per i contratti (CRMModel.scadenze) contiene
+# la DataFine dei soli contratti non chiusi e si aggiorna sul singolo
+# contratto quando viene salvato.
+#
+# Benchmark:  python scadenze_index.py [--rows 1000000]
+# =====================================
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+
+def _ns(ts) -> int:
+    return pd.Timestamp(ts).value
+
+
+class DateIndex:
+    """Date ordinate (ns) con etichetta di riga; a parità di data resta l'ordine del file."""
+
+    def __init__(self, dates: np.ndarray, labels: np.ndarray):
+        self.dates = dates          # int64 ns, crescente
+        self.labels = labels        # etichette di riga, stesso ordine
+        self._date_of: dict | None = None
+
+    @classmethod
+    def build(cls, dates: pd.Series, keep: pd.Series | None = None) -> "DateIndex":
+        """Indicizza le date non NaT di `dates` (solo le righe con keep=True, se indicato)."""
+        ok = dates.notna() if keep is None else dates.notna() & keep
+        d = dates[ok].to_numpy(dtype="datetime64[ns]").view(np.int64)
+        order = np.argsort(d, kind="stable")
+        return cls(d[order], dates.index[ok].to_numpy()[order])
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def _bounds(self, start=None, end=None) -> tuple[int, int]:
+        lo = 0 if start is None else int(np.searchsorted(self.dates, _ns(start), "left"))
+        hi = len(self.dates) if end is None else int(np.searchsorted(self.dates, _ns(end), "right"))
+        return lo, max(lo, hi)
+
+    def window(self, start=None, end=None) -> np.ndarray:
+        """Etichette con data in [start, end] (estremi inclusi, None = aperto), in ordine di data."""
+        lo, hi = self._bounds(start, end)
+        return self.labels[lo:hi]
+
+    def items(self, start=None, end=None) -> tuple[np.ndarray, np.ndarray]:
+        """(date datetime64[ns], etichette) della finestra, in ordine di data."""
+        lo, hi = self._bounds(start, end)
+        return self.dates[lo:hi].view("datetime64[ns]"), self.labels[lo:hi]
+
+    def count(self, start=None, end=None) -> int:
+        lo, hi = self._bounds(start, end)
+        return hi - lo
+
+    # --- aggiornamento incrementale ---
+    def _date_map(self) -> dict:
+        """etichetta → data indicizzata (costruita alla prima modifica, poi mantenuta)."""
+        if self._date_of is None:
+            self._date_of = dict(zip(self.labels.tolist(), self.dates.tolist()))
+        return self._date_of
+
+    def discard(self, label) -> None:
+        v = self._date_map().pop(label, None)
+        if v is None:
+            return
+        lo, hi = np.searchsorted(self.dates, v, "left"), np.searchsorted(self.dates, v, "right")
+        i = lo + int(np.flatnonzero(self.labels[lo:hi] == label)[0])
+        self.dates = np.delete(self.dates, i)
+        self.labels = np.delete(self.labels, i)
+
+    def set(self, label, date) -> None:
+        """Sposta (o inserisce/toglie, se date è NaT/None) la riga `label`."""
+        self.discard(label)
+        if date is None or pd.isna(date):
+            return
+        v = _ns(date)
+        i = int(np.searchsorted(self.dates, v, "right"))
+        self.dates = np.insert(self.dates, i, v)
+        self.labels = np.insert(self.labels, i, label)
+        self._date_of[label] = v
+
+
+class ScadenzeIndex(DateIndex):
+    """DataFine dei contratti non chiusi del modello (derivato aggiornabile riga per riga)."""
+
+    @classmethod
+    def from_model(cls, model) -> "ScadenzeIndex":
+        ct = model.contratti
+        base = DateIndex.build(ct["DataFine_dt"], ct["Stato_n"] != "chiuso")
+        return cls(base.dates, base.labels)
+
+    def update_row(self, table: str, idx, row: pd.Series) -> None:
+        if table == "contratti":
+            self.set(idx, row["DataFine_dt"] if row["Stato_n"] != "chiuso" else None)
+
+
+# =====================================
+# BENCHMARK
+# =====================================
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    ap = argparse.ArgumentParser(description="Benchmark indice scadenze")
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    oggi = pd.Timestamp.now().normalize()
+    giorni = rng.integers(-3 * 365, 6 * 365, args.rows)
+    ct = pd.DataFrame({
+        "DataFine_dt": (oggi + pd.to_timedelta(giorni, unit="D")).where(rng.random(args.rows) > 0.05),
+        "Stato_n": np.where(rng.random(args.rows) < 0.2, "chiuso", "aperto"),
+    })
+
+    t0 = time.perf_counter()
+    idx = DateIndex.build(ct["DataFine_dt"], ct["Stato_n"] != "chiuso")
+    print(f"build {args.rows} contratti: {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+    fine = oggi + pd.DateOffset(months=6)
+    n = 200
+    t0 = time.perf_counter()
+    for _ in range(n):
+        mask = ct[(ct["DataFine_dt"] >= oggi) & (ct["DataFine_dt"] <= fine) & (ct["Stato_n"] != "chiuso")]
+    t_mask = (time.perf_counter() - t0) / n * 1000
+    t0 = time.perf_counter()
+    for _ in range(n):
+        hit = ct.loc[idx.window(oggi, fine)]
+    t_idx = (time.perf_counter() - t0) / n * 1000
+    t0 = time.perf_counter()
+    for _ in range(n * 50):
+        idx.count(oggi, oggi + pd.Timedelta(days=30))
+    t_cnt = (time.perf_counter() - t0) / (n * 50) * 1000
+    assert len(mask) == len(hit) and set(mask.index) == set(hit.index)
+    print(f"finestra 6 mesi ({len(hit)} righe): maschera {t_mask:.1f} ms · searchsorted+loc {t_idx:.1f} ms · solo conteggio {t_cnt:.4f} ms")
+
+    t0 = time.perf_counter()
+    for i in range(100):
+        idx.set(i, oggi + pd.Timedelta(days=i))
+    print(f"update singolo contratto: {(time.perf_counter() - t0) * 10:.2f} ms")
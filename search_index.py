@@ -0,0 +1,309 @@
+# =====================================
+# search_index.py — indice di ricerca clienti (prefisso, token, fuzzy)
+# =====================================
+# Costruito una volta per versione dati (vedi CRMModel.search_index) e
+# condiviso da tutte le pagine tramite cerca_clienti():
+#   • testo normalizzato: minuscole, senza accenti, punteggiatura → spazio
+#   • vocabolario ordinato per campo → prefissi con bisect
+#   • trigrammi del vocabolario → sottostringhe dentro le parole
+#   • cancellazioni (una lettera) del vocabolario → errori di battitura
+# Nessuna regex sulla query: caratteri come "(", "+", "*" sono testo normale.
+#
+# Benchmark:  python search_index.py [--rows 50000]
+# =====================================
+from __future__ import annotations
+
+import re
+import unicodedata
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+SEARCH_FIELDS = ("RagioneSociale", "Citta", "ClienteID")
+
+# Punteggi per parola della query (il risultato somma le parole)
+SCORE_EXACT, SCORE_PREFIX, SCORE_SUBSTR, SCORE_FUZZY = 4, 3, 2, 1
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+_EMPTY = np.zeros(0, dtype=np.int32)
+
+
+# =====================================
+# NORMALIZZAZIONE
+# =====================================
+def normalize_text(s) -> str:
+    """'Caffè  Rossi S.r.l.' → 'caffe rossi s r l'"""
+    s = str(s if s is not None else "")
+    if not s.isascii():
+        s = unicodedata.normalize("NFKD", s)
+        s = "".join(ch for ch in s if not unicodedata.combining(ch))
+    s = s.casefold()
+    return _NON_ALNUM.sub(" ", s).strip()
+
+
+def tokenize(s) -> list[str]:
+    return normalize_text(s).split()
+
+
+def normalize_series(s: pd.Series) -> np.ndarray:
+    """normalize_text sui soli valori distinti della colonna."""
+    codes, uniq = pd.factorize(s.fillna("").astype(str))
+    norm = np.array([normalize_text(u) for u in uniq] or [""], dtype=object)
+    return norm[codes] if len(codes) else np.zeros(0, dtype=object)
+
+
+def _trigrams(tok: str) -> set[str]:
+    return {tok[i:i + 3] for i in range(len(tok) - 2)}
+
+
+def _deletes(tok: str) -> set[str]:
+    return {tok[:i] + tok[i + 1:] for i in range(len(tok))}
+
+
+# =====================================
+# INDICE DI UN CAMPO
+# =====================================
+class FieldIndex:
+    """Postings token → righe (posizioni 0..n-1) per un singolo campo testuale."""
+
+    def __init__(self, docs: np.ndarray):
+        self.n_docs = len(docs)
+        tok_of, doc_of = [], []
+        for i, text in enumerate(docs):
+            for tok in set(text.split()):
+                tok_of.append(tok)
+                doc_of.append(i)
+
+        codes, vocab = pd.factorize(pd.Series(tok_of, dtype=object), sort=True)
+        self.vocab: list[str] = list(vocab)
+        self.vocab_id = {t: i for i, t in enumerate(self.vocab)}
+        order = np.argsort(codes, kind="stable")
+        docs_sorted = np.asarray(doc_of, dtype=np.int32)[order]
+        bounds = np.searchsorted(codes[order], np.arange(len(self.vocab) + 1))
+        self.postings = [docs_sorted[bounds[i]:bounds[i + 1]] for i in range(len(self.vocab))]
+
+        # prefissi di 1-2 caratteri: troppi token per unirli ad ogni tasto → precalcolati
+        self._short: dict[str, np.ndarray] = {}
+        for plen in (1, 2):
+            groups: dict[str, list[int]] = {}
+            for vid, tok in enumerate(self.vocab):
+                if len(tok) >= plen:
+                    groups.setdefault(tok[:plen], []).append(vid)
+            for p, vids in groups.items():
+                self._short[p] = np.unique(np.concatenate([self.postings[v] for v in vids]))
+
+        self._tri: dict[str, np.ndarray] | None = None
+        self._del: dict[str, list[int]] | None = None
+
+    # --- strutture secondarie costruite alla prima ricerca che le usa ---
+    def _trigram_index(self) -> dict[str, np.ndarray]:
+        if self._tri is None:
+            tri: dict[str, list[int]] = {}
+            for vid, tok in enumerate(self.vocab):
+                for g in _trigrams(tok):
+                    tri.setdefault(g, []).append(vid)
+            self._tri = {g: np.asarray(v, dtype=np.int32) for g, v in tri.items()}
+        return self._tri
+
+    def _delete_index(self) -> dict[str, list[int]]:
+        if self._del is None:
+            dels: dict[str, list[int]] = {}
+            for vid, tok in enumerate(self.vocab):
+                if len(tok) >= 3:
+                    for d in _deletes(tok) | {tok}:
+                        dels.setdefault(d, []).append(vid)
+            self._del = dels
+        return self._del
+
+    def _docs(self, vids) -> np.ndarray:
+        if len(vids) == 0:
+            return _EMPTY
+        if len(vids) == 1:
+            return self.postings[vids[0]]
+        return np.concatenate([self.postings[v] for v in vids])
+
+    def match_token(self, q: str) -> list[tuple[np.ndarray, int]]:
+        """(righe, punteggio) per una parola della query, in ordine di punteggio crescente."""
+        parts: list[tuple[np.ndarray, int]] = []
+        if not q or not self.vocab:
+            return parts
+
+        # sottostringa dentro una parola (≥ 3 caratteri, via trigrammi)
+        if len(q) >= 3:
+            tri = self._trigram_index()
+            cand = None
+            for g in _trigrams(q):
+                ids = tri.get(g)
+                if ids is None:
+                    cand = _EMPTY
+                    break
+                cand = ids if cand is None else np.intersect1d(cand, ids, assume_unique=True)
+            if cand is not None and len(cand):
+                parts.append((self._docs([v for v in cand.tolist() if q in self.vocab[v]]), SCORE_SUBSTR))
+
+        # prefisso (intervallo del vocabolario ordinato)
+        if len(q) <= 2:
+            parts.append((self._short.get(q, _EMPTY), SCORE_PREFIX))
+        else:
+            lo = bisect_left(self.vocab, q)
+            hi = bisect_left(self.vocab, q + "\uffff", lo)
+            parts.append((self._docs(range(lo, hi)), SCORE_PREFIX))
+
+        # parola esatta
+        vid = self.vocab_id.get(q)
+        if vid is not None:
+            parts.append((self.postings[vid], SCORE_EXACT))
+        return parts
+
+    def fuzzy_token(self, q: str) -> list[tuple[np.ndarray, int]]:
+        """Parole del vocabolario a distanza 1 da q (lettera mancante, in più, sbagliata o scambiata)."""
+        if len(q) < 4 or not self.vocab:
+            return []
+        dels = self._delete_index()
+        vids = set()
+        for d in _deletes(q) | {q}:
+            vids.update(dels.get(d, ()))
+        return [(self._docs(sorted(vids)), SCORE_FUZZY)]
+
+
+def _best(parts: list[tuple[np.ndarray, int]], n_docs: int) -> tuple[np.ndarray, np.ndarray]:
+    """Righe distinte (ordinate) con il punteggio massimo tra le parti."""
+    parts = sorted(((d, sc) for d, sc in parts if len(d)), key=lambda p: p[1])
+    total = sum(len(d) for d, _ in parts)
+    if not total:
+        return _EMPTY, np.zeros(0, dtype=np.int16)
+    if total > n_docs // 8:
+        # molti risultati (es. una sola lettera): un passaggio su un array denso costa meno di un sort
+        dense = np.zeros(n_docs, dtype=np.int8)
+        for d, sc in parts:
+            dense[d] = sc
+        docs = np.flatnonzero(dense.view(np.bool_)).astype(np.int32)
+        return docs, dense[docs].astype(np.int16)
+    docs = np.concatenate([d for d, _ in parts])
+    score = np.repeat(np.array([sc for _, sc in parts], dtype=np.int16), [len(d) for d, _ in parts])
+    order = np.argsort(docs, kind="stable")  # a parità di riga resta per ultimo il punteggio più alto
+    docs, score = docs[order], score[order]
+    last = np.append(docs[1:] != docs[:-1], True)
+    return docs[last], score[last]
+
+
+def _intersect(d1, s1, d2, s2, n_docs: int) -> tuple[np.ndarray, np.ndarray]:
+    """AND di due risultati ordinati, sommando i punteggi."""
+    if len(d1) + len(d2) > n_docs // 4:
+        dense = np.zeros(n_docs, dtype=np.int16)
+        dense[d1] = s1
+        keep = d2[dense[d2] > 0]
+        return keep, dense[keep] + s2[np.searchsorted(d2, keep)]
+    docs, i1, i2 = np.intersect1d(d1, d2, assume_unique=True, return_indices=True)
+    return docs.astype(np.int32), s1[i1] + s2[i2]
+
+
+# =====================================
+# INDICE CLIENTI
+# =====================================
+class ClientSearchIndex:
+    def __init__(self, labels: pd.Index, ids: np.ndarray, fields: dict[str, FieldIndex]):
+        self.labels = labels
+        self.ids = ids
+        self.fields = fields
+        self._cache: dict[tuple, tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def build(cls, df_cli: pd.DataFrame, fields=SEARCH_FIELDS) -> "ClientSearchIndex":
+        present = [f for f in fields if f in df_cli.columns]
+        return cls(
+            df_cli.index,
+            df_cli["ClienteID"].fillna("").astype(str).to_numpy() if "ClienteID" in df_cli else np.zeros(0),
+            {f: FieldIndex(normalize_series(df_cli[f])) for f in present},
+        )
+
+    def _token_hits(self, q: str, names: tuple, fuzzy: bool) -> tuple[np.ndarray, np.ndarray]:
+        # mentre si digita "rossi f", "rossi fo"… le parole già complete restano in cache
+        key = (q, names, fuzzy)
+        if key not in self._cache:
+            n = len(self.labels)
+            d, sc = _best([p for f in names for p in self.fields[f].match_token(q)], n)
+            if not len(d) and fuzzy:
+                d, sc = _best([p for f in names for p in self.fields[f].fuzzy_token(q)], n)
+            if len(self._cache) >= 256:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[key] = (d, sc)
+        return self._cache[key]
+
+    def hits(self, query: str, fields=None, fuzzy: bool = True) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (posizioni, punteggio) delle righe che contengono TUTTE le parole della query
+        in almeno uno dei campi; il punteggio somma il miglior match di ogni parola.
+        """
+        names = tuple(f for f in (fields or self.fields) if f in self.fields)
+        docs = score = None
+        for q in tokenize(query):
+            d, sc = self._token_hits(q, names, fuzzy)
+            if docs is None:
+                docs, score = d, sc
+            else:
+                docs, score = _intersect(docs, score, d, sc, len(self.labels))
+            if not len(docs):
+                break
+        if docs is None:
+            return _EMPTY, np.zeros(0, dtype=np.int16)
+        return docs, score
+
+    def search(self, query: str, fields=None, limit: int | None = None, fuzzy: bool = True) -> pd.Index:
+        """Etichette di riga (indice del DataFrame clienti) in ordine di rilevanza."""
+        if not tokenize(query):
+            return self.labels[:limit] if limit else self.labels
+        docs, score = self.hits(query, fields, fuzzy)
+        ranked = docs[np.argsort(-score, kind="stable")]  # a parità di punteggio: ordine originale
+        return self.labels[ranked[:limit] if limit else ranked]
+
+
+def cerca_clienti(model, query: str, fields=None, limit: int | None = None) -> pd.Index:
+    """
+    Ricerca condivisa dalle pagine: etichette di riga di model.clienti (= df_cli)
+    ordinate per rilevanza. Query vuota → tutte le righe nell'ordine originale.
+    """
+    return model.search_index().search(query, fields=fields, limit=limit)
+
+
+# =====================================
+# BENCHMARK
+# =====================================
+def _synthetic(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    nomi = np.array(["Rossi", "Bianchi", "Caffè", "Studio", "Ferramenta", "Pasticceria", "Ottica",
+                     "Tecnoufficio", "Edilizia", "Farmacia", "Verdi", "Galli", "Nicolò", "Officina"])
+    forme = np.array(["S.r.l.", "S.p.A.", "S.n.c.", "& C.", "Srls", ""])
+    citta = np.array(["Roma", "Milano", "Forlì", "Cesena", "Rimini", "Ravenna", "Bologna", "Cantù"])
+    a = nomi[rng.integers(0, len(nomi), n)]
+    b = nomi[rng.integers(0, len(nomi), n)]
+    num = rng.integers(1, 99999, n).astype(str)
+    return pd.DataFrame({
+        "ClienteID": np.arange(1, n + 1).astype(str),
+        "RagioneSociale": pd.Series(a) + " " + b + " " + num + " " + forme[rng.integers(0, len(forme), n)],
+        "Citta": citta[rng.integers(0, len(citta), n)],
+    })
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    ap = argparse.ArgumentParser(description="Benchmark indice ricerca clienti")
+    ap.add_argument("--rows", type=int, default=50_000)
+    args = ap.parse_args()
+
+    df = _synthetic(args.rows)
+    t0 = time.perf_counter()
+    idx = ClientSearchIndex.build(df)
+    print(f"build {args.rows} clienti: {(time.perf_counter() - t0) * 1000:.0f} ms")
+    idx.search("xyz rossi")  # prima esecuzione: trigrammi e cancellazioni
+    for q in ["r", "ro", "ross", "rossi forli", "caffe", "cafe", "rosis", "12", "tecnouff ces", "s.r.l. (", "cantu"]:
+        t = []
+        for _ in range(20):
+            idx._cache.clear()  # tempo "a freddo", senza la cache delle parole
+            t0 = time.perf_counter()
+            res = idx.search(q, limit=50)
+            t.append(time.perf_counter() - t0)
+        print(f"{q!r:16} {len(idx.search(q)):6} risultati  {np.median(t) * 1000:.3f} ms")
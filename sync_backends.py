@@ -0,0 +1,398 @@
+# =====================================
+# sync_backends.py — backend di sincronizzazione intercambiabili
+# =====================================
+# Interfaccia comune (list / get / put / stat) su nomi relativi tipo
+# "clienti.csv" o "gabriele/contratti.csv", più:
+#   • LocalDirBackend  → cartella locale o share di rete montata
+#   • MegaLinkBackend  → link pubblici MEGA (solo lettura)
+#   • AsyncUploader    → upload in background dopo ogni salvataggio
+#   • benchmark_backend → throughput / latenza per backend
+#
+# Uso da riga di comando (benchmark):
+#   python sync_backends.py --root /mnt/share/crm --sizes 64K 1M 16M [--mega clienti=<link>]
+# =====================================
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB per blocco di upload
+
+
+@dataclass
+class RemoteStat:
+    name: str
+    size: int
+    mtime: float
+
+
+class SyncBackend:
+    """Interfaccia base. I nomi sono sempre relativi e con separatore '/'."""
+
+    label = "base"
+    writable = False
+
+    def list(self, prefix: str = "") -> list[str]:
+        raise NotImplementedError
+
+    def stat(self, name: str) -> RemoteStat | None:
+        raise NotImplementedError
+
+    def get(self, name: str, dest: Path) -> bool:
+        raise NotImplementedError
+
+    def put(self, src: Path, name: str) -> RemoteStat:
+        raise NotImplementedError(f"Upload non supportato dal backend {self.label}")
+
+
+# =====================================
+# 📁 BACKEND CARTELLA LOCALE / SHARE DI RETE
+# =====================================
+class LocalDirBackend(SyncBackend):
+    """
+    Backend su cartella (locale o share montata).
+    L'upload è a blocchi e riprendibile: i dati vanno in '<nome>.part' e
+    l'avanzamento in '<nome>.part.json'; se l'upload si interrompe, il
+    tentativo successivo sullo stesso file sorgente riparte dall'ultimo offset.
+    """
+
+    label = "Cartella condivisa"
+    writable = True
+
+    def __init__(self, root: str | Path, chunk_size: int = CHUNK_SIZE):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.chunk_size = chunk_size
+
+    def _path(self, name: str) -> Path:
+        p = (self.root / name).resolve()
+        if self.root.resolve() not in p.parents and p != self.root.resolve():
+            raise ValueError(f"Nome remoto non valido: {name}")
+        return p
+
+    def list(self, prefix: str = "") -> list[str]:
+        out = []
+        for p in self.root.rglob("*"):
+            if not p.is_file() or p.name.endswith((".part", ".part.json")):
+                continue
+            rel = p.relative_to(self.root).as_posix()
+            if rel.startswith(prefix):
+                out.append(rel)
+        return sorted(out)
+
+    def stat(self, name: str) -> RemoteStat | None:
+        p = self._path(name)
+        if not p.is_file():
+            return None
+        s = p.stat()
+        return RemoteStat(name, s.st_size, s.st_mtime)
+
+    def get(self, name: str, dest: Path) -> bool:
+        src = self._path(name)
+        if not src.is_file():
+            return False
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dest.parent, prefix=f".{dest.name}.")
+        try:
+            with os.fdopen(fd, "wb") as out, open(src, "rb") as inp:
+                shutil.copyfileobj(inp, out, self.chunk_size)
+            os.replace(tmp, dest)
+        except Exception:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        return True
+
+    def put(self, src: Path, name: str) -> RemoteStat:
+        src = Path(src)
+        dest = self._path(name)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        part = dest.with_name(dest.name + ".part")
+        journal = dest.with_name(dest.name + ".part.json")
+
+        s = src.stat()
+        fingerprint = {"size": s.st_size, "mtime_ns": s.st_mtime_ns}
+
+        # --- ripresa di un upload interrotto (stesso file sorgente) ---
+        offset = 0
+        if part.exists() and journal.exists():
+            try:
+                state = json.loads(journal.read_text(encoding="utf-8"))
+                if state.get("source") == fingerprint:
+                    offset = min(int(state.get("offset", 0)), part.stat().st_size)
+            except Exception:
+                offset = 0
+
+        mode = "r+b" if offset else "wb"
+        with open(src, "rb") as inp, open(part, mode) as out:
+            inp.seek(offset)
+            out.seek(offset)
+            out.truncate()
+            while True:
+                chunk = inp.read(self.chunk_size)
+                if not chunk:
+                    break
+                out.write(chunk)
+                offset += len(chunk)
+                out.flush()
+                journal.write_text(json.dumps({"source": fingerprint, "offset": offset}), encoding="utf-8")
+            os.fsync(out.fileno())
+
+        os.replace(part, dest)
+        journal.unlink(missing_ok=True)
+        return self.stat(name)
+
+
+# =====================================
+# 🔗 BACKEND MEGA (link pubblici, sola lettura)
+# =====================================
+class MegaLinkBackend(SyncBackend):
+    """Scarica i file dai link pubblici MEGA configurati (nome → url)."""
+
+    label = "MEGA"
+    writable = False
+
+    def __init__(self, links: dict[str, str], timeout: int = 15):
+        self.links = {k: v for k, v in links.items() if v}
+        self.timeout = timeout
+
+    def list(self, prefix: str = "") -> list[str]:
+        return sorted(n for n in self.links if n.startswith(prefix))
+
+    def stat(self, name: str) -> RemoteStat | None:
+        # I link pubblici non espongono metadati affidabili
+        return RemoteStat(name, -1, 0.0) if name in self.links else None
+
+    def get(self, name: str, dest: Path) -> bool:
+        import requests
+
+        link = self.links.get(name)
+        if not link:
+            return False
+        # MEGA non supporta download diretto pubblico → passo dal proxy allorigins
+        r = requests.get("https://api.allorigins.win/get", params={"url": link}, timeout=self.timeout)
+        if r.status_code != 200:
+            raise Exception(f"HTTP {r.status_code}")
+        payload = r.json()
+        if "contents" not in payload:
+            raise Exception("Contenuto non accessibile")
+        # per un link pubblico MEGA il proxy restituisce la pagina web, non il file:
+        # scrivo dest solo se il contenuto è davvero un CSV
+        if not _sembra_csv(payload["contents"] or ""):
+            raise Exception("MEGA non supporta il download diretto: il link restituisce una pagina web, non il CSV")
+        Path(dest).write_bytes(payload["contents"].encode("utf-8"))
+        return True
+
+
+def _sembra_csv(testo: str) -> bool:
+    """Testo con intestazione CSV (almeno due colonne separate da ; o ,) e non HTML."""
+    inizio = testo.lstrip("\ufeff \r\n\t")[:2048]
+    if not inizio or inizio.startswith("<") or "<html" in inizio.lower():
+        return False
+    intestazione = inizio.splitlines()[0]
+    return max(intestazione.count(";"), intestazione.count(",")) >= 1
+
+
+# =====================================
+# 📤 UPLOAD ASINCRONO
+# =====================================
+@dataclass
+class UploadResult:
+    name: str
+    ok: bool
+    seconds: float
+    error: str = ""
+    finished_at: float = field(default_factory=time.time)
+
+
+class AsyncUploader:
+    """
+    Coda di upload in background (thread pool).
+    Più salvataggi ravvicinati dello stesso file vengono accorpati: se un
+    upload per quel nome è già in coda non ne viene accodato un secondo,
+    tanto il job legge il file al momento dell'esecuzione. Gli upload dello
+    stesso nome non girano mai in parallelo (lock per nome): condividono
+    '<nome>.part' e '<nome>.part.json' sul backend.
+    """
+
+    def __init__(self, max_workers: int = 2, retries: int = 3):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="crm-upload")
+        self._lock = threading.Lock()
+        self._pending: dict[str, Future] = {}
+        self._per_nome: dict[str, threading.Lock] = {}
+        self.retries = retries
+        self.results: list[UploadResult] = []
+
+    def submit(self, backend: SyncBackend, src: Path, name: str) -> Future:
+        with self._lock:
+            fut = self._pending.get(name)
+            if fut is not None and not fut.running() and not fut.done():
+                return fut
+            fut = self._pool.submit(self._run, backend, Path(src), name)
+            self._pending[name] = fut
+            return fut
+
+    def _run(self, backend: SyncBackend, src: Path, name: str) -> UploadResult:
+        with self._lock:
+            lock_nome = self._per_nome.setdefault(name, threading.Lock())
+        t0 = time.perf_counter()
+        err = ""
+        with lock_nome:  # un solo upload alla volta per nome
+            for attempt in range(self.retries):
+                try:
+                    backend.put(src, name)
+                    err = ""
+                    break
+                except Exception as e:  # upload riprendibile → ritento
+                    err = str(e)
+                    time.sleep(0.5 * (attempt + 1))
+        res = UploadResult(name, not err, time.perf_counter() - t0, err)
+        with self._lock:
+            self.results = (self.results + [res])[-50:]
+        return res
+
+    def pending(self) -> list[str]:
+        with self._lock:
+            return [n for n, f in self._pending.items() if not f.done()]
+
+
+# =====================================
+# ⏱️ BENCHMARK
+# =====================================
+def _pct(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def benchmark_backend(backend: SyncBackend, sizes=(64 * 1024, 1024 * 1024), repeats: int = 5,
+                      prefix: str = "_bench") -> list[dict]:
+    """
+    Misura per ogni dimensione: latenza put/get/stat (p50/p95, ms) e
+    throughput medio (MB/s). Usa file temporanei sotto '<prefix>/'.
+    I backend in sola lettura non possono ricevere i file di prova: per
+    loro si misurano get/stat sui file che già espongono (_bench_sola_lettura).
+    """
+    if not backend.writable:
+        return _bench_sola_lettura(backend, repeats)
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for size in sizes:
+            src = tmp / f"src_{size}.bin"
+            src.write_bytes(os.urandom(size))
+            name = f"{prefix}/bench_{size}.bin"
+            t_put, t_get, t_stat = [], [], []
+            for i in range(repeats):
+                if backend.writable:
+                    t0 = time.perf_counter()
+                    backend.put(src, name)
+                    t_put.append(time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                backend.stat(name)
+                t_stat.append(time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                backend.get(name, tmp / f"dst_{size}_{i}.bin")
+                t_get.append(time.perf_counter() - t0)
+            mb = size / (1024 * 1024)
+            rows.append({
+                "backend": backend.label,
+                "size": size,
+                "put_p50_ms": _pct(t_put, 0.5) * 1000,
+                "put_p95_ms": _pct(t_put, 0.95) * 1000,
+                "put_MBps": mb / statistics.mean(t_put) if t_put else 0.0,
+                "get_p50_ms": _pct(t_get, 0.5) * 1000,
+                "get_p95_ms": _pct(t_get, 0.95) * 1000,
+                "get_MBps": mb / statistics.mean(t_get) if t_get else 0.0,
+                "stat_p50_ms": _pct(t_stat, 0.5) * 1000,
+            })
+    return rows
+
+
+def _bench_sola_lettura(backend: SyncBackend, repeats: int) -> list[dict]:
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in backend.list():
+            dest = Path(tmp) / "dst.bin"
+            t_get, t_stat, err = [], [], ""
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                backend.stat(name)
+                t_stat.append(time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                try:
+                    backend.get(name, dest)
+                except Exception as e:
+                    err = str(e)
+                    break
+                t_get.append(time.perf_counter() - t0)
+            size = dest.stat().st_size if t_get and dest.exists() else 0
+            mb = size / (1024 * 1024)
+            rows.append({
+                "backend": backend.label,
+                "name": name,
+                "size": size,
+                "put_p50_ms": 0.0, "put_p95_ms": 0.0, "put_MBps": 0.0,
+                "get_p50_ms": _pct(t_get, 0.5) * 1000,
+                "get_p95_ms": _pct(t_get, 0.95) * 1000,
+                "get_MBps": mb / statistics.mean(t_get) if t_get else 0.0,
+                "stat_p50_ms": _pct(t_stat, 0.5) * 1000,
+                "error": err,
+            })
+    return rows
+
+
+def _mega_links_da_secrets(path: Path) -> dict[str, str]:
+    """[mega] <chiave>_url di secrets.toml → {chiave: url} (senza importare Streamlit)."""
+    import tomllib
+
+    try:
+        conf = tomllib.loads(path.read_text(encoding="utf-8")).get("mega", {})
+    except (FileNotFoundError, tomllib.TOMLDecodeError):
+        return {}
+    return {k[:-4]: v for k, v in conf.items() if k.endswith("_url") and v}
+
+
+def _parse_size(txt: str) -> int:
+    txt = txt.strip().upper()
+    mult = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}.get(txt[-1:], 1)
+    return int(float(txt.rstrip("KMG")) * mult)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Benchmark backend di sincronizzazione CRM (tutti quelli configurabili)")
+    ap.add_argument("--root", help="Cartella del backend locale (default: temporanea)")
+    ap.add_argument("--sizes", nargs="+", default=["64K", "1M", "16M"])
+    ap.add_argument("--repeats", type=int, default=5)
+    ap.add_argument("--mega", nargs="*", default=[], metavar="NOME=URL",
+                    help="link pubblici MEGA da misurare (default: [mega] di .streamlit/secrets.toml)")
+    args = ap.parse_args()
+
+    links = dict(x.split("=", 1) for x in args.mega) or _mega_links_da_secrets(
+        Path(__file__).parent / ".streamlit" / "secrets.toml")
+
+    with tempfile.TemporaryDirectory() as default_root:
+        backends = [LocalDirBackend(args.root or default_root), MegaLinkBackend(links)]
+        for be in backends:
+            rows = benchmark_backend(be, [_parse_size(s) for s in args.sizes], args.repeats)
+            if not rows:
+                print(f"{be.label:<20} nessun file da misurare (configura i link in [mega] o usa --mega)")
+            for r in rows:
+                print(
+                    f"{r['backend']:<20} {r.get('name', ''):<24} {r['size']:>10} B | "
+                    f"put p50 {r['put_p50_ms']:8.2f} ms  {r['put_MBps']:8.1f} MB/s | "
+                    f"get p50 {r['get_p50_ms']:8.2f} ms  {r['get_MBps']:8.1f} MB/s | "
+                    f"stat {r['stat_p50_ms']:6.3f} ms"
+                    + (f" | ERRORE: {r['error']}" if r.get("error") else "")
+                )
@@ -0,0 +1,125 @@
+# =====================================
+# ui_tables.py — tabelle paginate (HTML in un unico blocco / AgGrid)
+# =====================================
+# Invece di una riga di st.columns per record (decine di elementi Streamlit
+# per riga), ogni pagina viene costruita come una sola stringa HTML e
+# mostrata con un unico st.markdown: il numero di elementi resta costante
+# qualunque sia il numero di righe.
+# =====================================
+from __future__ import annotations
+
+import html
+
+import pandas as pd
+import streamlit as st
+from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, JsCode
+
+PAGE_SIZES = [10, 25, 50, 100]
+
+TABLE_CSS = """
+<style>
+  .crm-tbl-wrap{border:1px solid #e5e7eb; border-radius:12px; overflow-x:auto;
+    box-shadow:0 4px 16px rgba(0,0,0,.06); background:#fff;}
+  table.crm-tbl{width:100%; border-collapse:collapse; font-size:13px;}
+  table.crm-tbl th{background:#2563eb; color:#fff; font-weight:700; padding:10px 8px;
+    text-align:center; border-right:1px solid rgba(255,255,255,.25); white-space:nowrap;}
+  table.crm-tbl td{padding:8px 8px; text-align:center; border-top:1px solid #eef2f7; vertical-align:top;}
+  table.crm-tbl td.left{text-align:left;}
+  table.crm-tbl td.mono{font-family:ui-monospace,monospace;}
+  table.crm-tbl tr:hover td{background:#f6faff;}
+  table.crm-tbl tr.row-closed td{background:#fff1f1;}
+  table.crm-tbl tr.row-selected td{outline:2px solid #2563eb; outline-offset:-2px;}
+</style>
+"""
+
+
+def paginate(df: pd.DataFrame, key: str, default_size: int = 25) -> tuple[pd.DataFrame, int, int]:
+    """
+    Controlli di paginazione (righe per pagina + numero pagina).
+    Ritorna (righe della pagina, pagina corrente 1-based, numero pagine).
+    """
+    c1, c2, c3 = st.columns([1, 1, 3])
+    size = c1.selectbox("Righe per pagina", PAGE_SIZES,
+                        index=PAGE_SIZES.index(default_size) if default_size in PAGE_SIZES else 1,
+                        key=f"{key}_size")
+    n_pages = max(1, -(-len(df) // size))
+    if st.session_state.get(f"{key}_page", 1) > n_pages:
+        st.session_state[f"{key}_page"] = n_pages
+    page = int(c2.number_input("Pagina", min_value=1, max_value=n_pages, step=1, key=f"{key}_page"))
+    start = (page - 1) * size
+    end = min(start + size, len(df))
+    c3.caption(f"Righe {start + 1 if len(df) else 0}–{end} di {len(df)} · pagina {page}/{n_pages}")
+    return df.iloc[start:end], page, n_pages
+
+
+def html_table(df: pd.DataFrame, columns: list[tuple[str, str, str]],
+               row_classes: pd.Series | None = None) -> str:
+    """
+    Costruisce la tabella HTML di una pagina.
+    columns = [(colonna df, intestazione, classi css cella)], valori già formattati.
+    """
+    head = "".join(f"<th>{html.escape(h)}</th>" for _, h, _ in columns)
+    cells = [
+        ("<td class='" + css + "'>") + df[col].fillna("").astype(str).map(html.escape) + "</td>"
+        for col, _, css in columns
+    ]
+    body_cells = cells[0].str.cat(cells[1:]) if len(cells) > 1 else cells[0]
+    classes = row_classes.reindex(df.index).fillna("") if row_classes is not None else pd.Series("", index=df.index)
+    rows = "<tr class='" + classes + "'>" + body_cells + "</tr>"
+    return f"<div class='crm-tbl-wrap'><table class='crm-tbl'><thead><tr>{head}</tr></thead>" \
+           f"<tbody>{''.join(rows.tolist())}</tbody></table></div>"
+
+
+# =====================================
+# GRIGLIA AgGrid CON MODELLO "SERVER SIDE"
+# =====================================
+# Ordinamento, filtri e paginazione restano in Python: al browser arriva
+# solo la finestra di righe visibile. La griglia serve per la resa e per
+# la selezione della riga (un solo pulsante d'azione sotto la griglia).
+LIVELLO_STYLE = JsCode("""
+function(params) {
+    const c = {scaduto: '#757575', '30': '#d32f2f', '90': '#f9a825', oltre: '#388e3c', nessuna: '#999999'};
+    const lv = params.data ? params.data._livello : null;
+    return lv ? {color: c[lv] || '#000', fontWeight: lv === 'nessuna' ? 400 : 600} : null;
+}
+""")
+
+
+def server_grid(page_df: pd.DataFrame, key: str, headers: dict[str, str],
+                styled_col: str | None = None, height: int | None = None) -> dict | None:
+    """
+    Mostra la pagina `page_df` in AgGrid (solo le colonne in `headers`, in quell'ordine)
+    e ritorna la riga selezionata come dict (tutte le colonne di page_df) oppure None.
+    Colonne tecniche che iniziano con '_' viaggiano nascoste (es. _livello, _row).
+    """
+    grid_df = page_df.reset_index(drop=True).copy()
+    grid_df["_row"] = range(len(grid_df))
+    hidden = [c for c in grid_df.columns if c.startswith("_")]
+    grid_df = grid_df[[*headers, *hidden]]
+
+    gb = GridOptionsBuilder.from_dataframe(grid_df)
+    gb.configure_default_column(sortable=False, filter=False, resizable=True, suppressMenu=True)
+    for col, label in headers.items():
+        gb.configure_column(col, header_name=label)
+    for col in hidden:
+        gb.configure_column(col, hide=True)
+    if styled_col:
+        gb.configure_column(styled_col, cellStyle=LIVELLO_STYLE)
+    gb.configure_selection("single")
+    gb.configure_grid_options(suppressPaginationPanel=True, domLayout="autoHeight" if height is None else "normal")
+
+    resp = AgGrid(
+        grid_df,
+        gridOptions=gb.build(),
+        height=height or 400,
+        update_mode=GridUpdateMode.SELECTION_CHANGED,
+        allow_unsafe_jscode=True,
+        fit_columns_on_grid_load=True,
+        enable_enterprise_modules=False,
+        key=key,
+    )
+    sel = resp.selected_rows if resp is not None else None
+    if sel is None or len(sel) == 0:
+        return None
+    row = int(pd.DataFrame(sel).iloc[0]["_row"])
+    return page_df.iloc[row].to_dict()